@@ -1,8 +1,23 @@
-import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import quote, urlencode
+import argparse
+import json
 import os
+import queue
+import threading
 import time
 
+import metrics
+import storage
+
 DATASETS = {
     "violations": "https://data.ny.gov/api/odata/v4/kh8p-hcbm",
     "speeds_2025": "https://data.ny.gov/api/odata/v4/kufs-yh3x",
@@ -10,45 +25,255 @@ DATASETS = {
 
 }
 
-def fetch_by_chunk(name,url,chunk_size=1000):
-    os.makedirs("data",exist_ok=True)
-    all_rows=0
-    skip=0
-    first_chunk = True
-    all_data=[]
-
-    while url:
-        for _ in range(3):
-            try:
-                response = requests.get(url, timeout=10)
-                response.raise_for_status()
-                data = response.json()
+DATA_DIR = Path("data")
+CHECKPOINT_DIR = DATA_DIR / ".checkpoints"
+
+# rows buffered before a parquet part (one row group) is written
+BATCH_ROWS = 250_000
+# pages fetched ahead of the writer per dataset
+PREFETCH_PAGES = 8
+# datasets downloaded at the same time
+MAX_WORKERS = 3
+
+
+def make_session(pool_size=MAX_WORKERS):
+    # one pooled keep-alive session shared by every download thread,
+    # retrying transient HTTP errors with exponential backoff
+    retry = Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# checkpoint = where the next page starts + how many parts are already on disk
+def load_checkpoint(name, checkpoint_dir=CHECKPOINT_DIR):
+    path = Path(checkpoint_dir) / f"{name}.json"
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def save_checkpoint(name, state, checkpoint_dir=CHECKPOINT_DIR):
+    path = Path(checkpoint_dir) / f"{name}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # write then rename so a crash never leaves a half-written checkpoint
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def fetch_pages(session, url, out, stop, timeout=30):
+    # producer: follows @odata.nextLink and hands (rows, next_link) to the writer
+    try:
+        while url and not stop.is_set():
+            response = session.get(url, timeout=timeout)
+            response.raise_for_status()
+            data = response.json()
+            rows = data.get("value", [])
+            url = data.get("@odata.nextLink")
+            if not rows:
                 break
-            except:
-                time.sleep(0.2)
+            out.put((rows, url))
+    except Exception as e:
+        out.put(e)
+        return
+    out.put(None)
+
+
+def stream_batches(session, url, batch_rows=BATCH_ROWS):
+    # consumer side of fetch_pages: yields (rows, next_link) once batch_rows
+    # rows are buffered, plus whatever is left at the end of the feed
+    pages = queue.Queue(maxsize=PREFETCH_PAGES)
+    stop = threading.Event()
+    producer = threading.Thread(target=fetch_pages, args=(session, url, pages, stop), daemon=True)
+    producer.start()
+
+    buffer = []
+    next_link = url
+    try:
+        while True:
+            item = pages.get()
+            if isinstance(item, Exception):
+                raise item
+            if item is not None:
+                rows, next_link = item
+                buffer.extend(rows)
+            if buffer and (len(buffer) >= batch_rows or item is None):
+                yield buffer, next_link
+                buffer = []
+            if item is None:
+                break
+    finally:
+        stop.set()
+
+
+def write_part(rows, out_dir, part, prefix="part"):
+    table = pa.Table.from_pylist(rows)
+    path = Path(out_dir) / f"{prefix}-{part:05d}.parquet"
+    tmp = path.with_suffix(".tmp")
+    pq.write_table(table, tmp, row_group_size=len(rows))
+    os.replace(tmp, path)
+    return path
 
-        rows = data.get("value",[])
-        if not rows:
-            break
 
-        time.sleep(0.1)
+def fetch_by_chunk(name, url, batch_rows=BATCH_ROWS, session=None,
+                   data_dir=DATA_DIR, checkpoint_dir=CHECKPOINT_DIR):
+    out_dir = Path(data_dir) / name
+    out_dir.mkdir(parents=True, exist_ok=True)
+    session = session or make_session()
 
-        df = pd.DataFrame(rows)
-        url = data.get('@odata.nextLink')
+    # resume from the last page whose rows made it into a parquet part
+    state = load_checkpoint(name, checkpoint_dir)
+    if state is not None:
+        if state["done"]:
+            print(f"[SKIP] {name} already complete ({state['rows']:,} rows)")
+            return state["rows"]
+        url = state["next_link"]
+        print(f"[INFO] Resuming {name} at part {state['parts']} ({state['rows']:,} rows so far)")
+    else:
+        state = {"next_link": url, "parts": 0, "rows": 0, "done": False}
 
-        output_file=f"data/{name}.csv"
+    for rows, next_link in stream_batches(session, url, batch_rows):
+        write_part(rows, out_dir, state["parts"])
+        state["parts"] += 1
+        state["rows"] += len(rows)
+        state["next_link"] = next_link
+        save_checkpoint(name, state, checkpoint_dir)
+        print(f"[{name}] wrote part {state['parts'] - 1}, total so far: {state['rows']:,}")
 
-        df.to_csv(output_file, mode='a', header=not os.path.exists(output_file), index=False)
-        all_rows += len(df)
-        print(f"Fetched {len(df)} rows, total so far: {all_rows}")
+    state["done"] = True
+    state["next_link"] = None
+    save_checkpoint(name, state, checkpoint_dir)
+    print(f"[DONE] Finished fetching {state['rows']:,} rows for {name}.")
+    return state["rows"]
 
-        skip+=1000
-    
-    print(f"Finished fetching {all_rows} rows.")
 
-def main():
-    for name,url in DATASETS.items():
-        fetch_by_chunk(name,url)
+# delta sync: per dataset, the time column that only grows and the natural
+# key that identifies a row. the stored high-water mark is the max time value
+# already on disk plus the keys of the rows sitting exactly on it, so rows
+# sharing that timestamp are neither lost nor fetched twice.
+SYNC_KEYS = {name: {"time": storage.FEEDS[name]["time"], "key": storage.FEEDS[name]["key"]} for name in DATASETS}
+
+def row_key(row, key_cols):
+    return "|".join(str(row.get(c)) for c in key_cols)
+
+
+def high_water_from_disk(name, data_dir=DATA_DIR):
+    # bootstrap the sync state from parts written by a full pull
+    out_dir = Path(data_dir) / name
+    if not any(out_dir.glob("*.parquet")):
+        return None
+    cols = SYNC_KEYS[name]
+    needed = list(dict.fromkeys([cols["time"], *cols["key"]]))
+    table = ds.dataset(out_dir, format="parquet").to_table(columns=needed)
+    times = table.column(cols["time"]).cast(pa.string())
+    high_water = pc.max(times).as_py()
+    if high_water is None:
+        return None
+    boundary = table.filter(pc.equal(times, high_water)).to_pylist()
+    return {
+        "column": cols["time"],
+        "high_water": high_water,
+        "boundary_keys": sorted({row_key(r, cols["key"]) for r in boundary}),
+    }
+
+
+def sync_dataset(name, url, batch_rows=BATCH_ROWS, session=None,
+                 data_dir=DATA_DIR, checkpoint_dir=CHECKPOINT_DIR):
+    out_dir = Path(data_dir) / name
+    session = session or make_session()
+    cols = SYNC_KEYS[name]
+
+    state = load_checkpoint(f"{name}.sync", checkpoint_dir)
+    if state is None:
+        # bootstrap only from a finished full pull: the parts of an
+        # interrupted one are not a prefix in time, so their max would skip
+        # every older row the pull had not reached yet
+        full = load_checkpoint(name, checkpoint_dir)
+        if full is None or full["done"]:
+            state = high_water_from_disk(name, data_dir)
+    if state is None:
+        print(f"[INFO] No complete local copy of {name}; running (or resuming) the full pull first")
+        fetch_by_chunk(name, url, batch_rows, session, data_dir, checkpoint_dir)
+        state = high_water_from_disk(name, data_dir)
+        save_checkpoint(f"{name}.sync", state, checkpoint_dir)
+        return 0
+
+    # "ge" rather than "gt": rows can share the high-water timestamp, the
+    # boundary keys below drop the ones already stored
+    query = urlencode({
+        "$filter": f"{cols['time']} ge {state['high_water']}",
+        "$orderby": cols["time"],
+    }, quote_via=quote)
+    delta_url = f"{url}{'&' if '?' in url else '?'}{query}"
+
+    run_id = time.strftime("%Y%m%dT%H%M%S")
+    seen = set(state["boundary_keys"])
+    added = 0
+    part = 0
+    print(f"[INFO] Syncing {name} from {cols['time']} >= {state['high_water']}")
+    for rows, _ in stream_batches(session, delta_url, batch_rows):
+        fresh = []
+        for row in rows:
+            k = row_key(row, cols["key"])
+            if k in seen:
+                continue
+            seen.add(k)
+            fresh.append(row)
+        if not fresh:
+            continue
+
+        write_part(fresh, out_dir, part, prefix=f"delta-{run_id}")
+        part += 1
+        added += len(fresh)
+
+        # rows arrive ordered by time, so the mark only moves forward and can
+        # be saved after every part
+        batch_max = max(str(r[cols["time"]]) for r in fresh)
+        if batch_max != state["high_water"]:
+            state["high_water"] = batch_max
+            state["boundary_keys"] = []
+        state["boundary_keys"] = sorted(
+            set(state["boundary_keys"])
+            | {row_key(r, cols["key"]) for r in fresh if str(r[cols["time"]]) == batch_max}
+        )
+        save_checkpoint(f"{name}.sync", state, checkpoint_dir)
+        print(f"[{name}] appended delta part {part - 1}, {added:,} new rows so far")
+
+    print(f"[DONE] {name}: {added:,} new rows, high-water mark {state['high_water']}")
+    return added
+
+
+@metrics.instrument(rows_out=lambda fetched: sum(fetched.values()))
+def main(datasets=None, max_workers=MAX_WORKERS, batch_rows=BATCH_ROWS,
+         data_dir=DATA_DIR, checkpoint_dir=CHECKPOINT_DIR, sync=False):
+    datasets = datasets or DATASETS
+    session = make_session(pool_size=max_workers)
+    fetch = sync_dataset if sync else fetch_by_chunk
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            name: pool.submit(fetch, name, url, batch_rows, session, data_dir, checkpoint_dir)
+            for name, url in datasets.items()
+        }
+        return {name: f.result() for name, f in futures.items()}
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Download the MTA OData feeds into data/<name>/*.parquet")
+    parser.add_argument("--base-url", help="serve every dataset from this OData root instead (e.g. a local test server)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS)
+    parser.add_argument("--sync", action="store_true", help="only fetch rows newer than the stored high-water mark")
+    args = parser.parse_args()
+
+    datasets = DATASETS
+    if args.base_url:
+        datasets = {name: f"{args.base_url.rstrip('/')}/{url.rsplit('/', 1)[-1]}" for name, url in DATASETS.items()}
+    main(datasets, max_workers=args.workers, batch_rows=args.batch_rows, sync=args.sync)
@@ -0,0 +1,410 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import psutil
+from pathlib import Path
+import argparse
+import contextlib
+import importlib
+import json
+import multiprocessing as mp
+import os
+import platform
+import runpy
+import shutil
+import subprocess
+import sys
+import time
+import metrics
+import schemas
+
+# Benchmark suite over synthetic data. A seeded generator writes feeds with
+# the violations and speeds schemas (OData parquet parts under data/, the
+# data_raw CSV exports, the DiD sample CSV) into a workspace per size; then
+# every pipeline stage runs in its own process inside that workspace while
+# the parent samples the RSS of the process tree. Wall time, CPU time and
+# peak RSS per stage are written to data/bench/results/<size>.json and
+# compared against data/bench/baselines/<size>.json.
+
+BENCH_DIR = Path("data/bench")
+REPO = Path(__file__).resolve().parent
+
+SIZES = {"1M": 1_000_000, "10M": 10_000_000, "100M": 100_000_000}
+SEED = 42
+# rows generated (and written as one parquet part / CSV block) at a time
+BATCH_ROWS = 1_000_000
+# share of violation rows kept in data/violations_sample.csv, like get_samples
+SAMPLE_FRAC = 0.01
+# seconds between RSS samples of a running stage
+SAMPLE_INTERVAL = 0.05
+# a stage is flagged when it is this much slower / bigger than its baseline
+TOLERANCE = 0.20
+
+# bump when the generator changes, so cached workspaces are regenerated
+GENERATOR_VERSION = 1
+
+# synthetic network: every route has STOPS_PER_ROUTE timepoints on a line
+STOPS_PER_ROUTE = 12
+CONTROL_ROUTES = ["B1", "B6", "B38", "BX1", "BX15", "M7", "M11", "M103", "M102", "M3",
+                  "Q10", "Q27", "Q58", "S40", "S53", "M5", "B15", "BX9", "Q65", "M31"]
+SPEEDS_START = pd.Timestamp("2023-01-01")
+SPEEDS_END = pd.Timestamp("2025-09-01")
+VIOLATIONS_START = pd.Timestamp("2019-10-07")
+VIOLATIONS_END = pd.Timestamp("2025-09-01")
+STATUSES = ["VIOLATION ISSUED", "EXEMPT - EMERGENCY VEHICLE", "EXEMPT - COMMERCIAL UNDER 20",
+            "EXEMPT - BUS/PARATRANSIT", "TECHNICAL ISSUE/OTHER", "DRIVER/VEHICLE INFO MISSING"]
+STATUS_P = [0.55, 0.08, 0.17, 0.05, 0.10, 0.05]
+TYPES = ["MOBILE BUS STOP", "MOBILE DOUBLE PARKED", "MOBILE BUS LANE"]
+N_VEHICLES = 500_000
+
+RAW_SPEEDS = [
+    "data_raw/MTA_Bus_Route_Segment_Speeds__2023_-_2024_20250921.csv",
+    "data_raw/MTA_Bus_Route_Segment_Speeds__Beginning_2025_20250919.csv",
+]
+RAW_VIOLATIONS = "data_raw/MTA_Bus_Automated_Camera_Enforcement_Violations__Beginning_October_2019_20250919.csv"
+RAW_ROUTES = "data_raw/MTA_Bus_Automated_Camera_Enforced_Routes__Beginning_October_2019_20250921.csv"
+
+# stage -> (module or script, function, kwargs), run in this order;
+# the store / cube builds are their own stages so the stages after them
+# are timed warm, as they run day to day
+STAGES = {
+    "store.violations": ("storage", "build_store", {"name": "violations"}),
+    "store.speeds_2025": ("storage", "build_store", {"name": "speeds_2025"}),
+    "store.speeds_raw": ("storage", "build_store", {"name": "speeds_raw"}),
+    "store.violations_raw": ("storage", "build_store", {"name": "violations_raw"}),
+    "sampler.violations": ("sampler", "sample", {"name": "violations", "fractions": [0.01, 0.05]}),
+    "fleet_estimation": ("fleet_estimation", "concurrency_timeline", {}),
+    "trips.build_runs": ("trips", "build_runs", {}),
+    "segment_join.build": ("segment_join", "build", {}),
+    "reliability.update": ("reliability", "update", {"full": True}),
+    "convex_optimization.get_values": ("convex_optimization", "get_values", {}),
+    "main.DiD": ("main", "DiD", {}),
+    "violation_cube.build_cube": ("violation_cube", "build_cube", {}),
+    "main.analyze": ("main", "analyze", {}),
+    "scripts/01": ("scripts/01_filter_hunter_routes.py", None, {}),
+    "scripts/02": ("scripts/02_label_ace_status.py", None, {}),
+    "scripts/03": ("scripts/03_clean_violations.py", None, {}),
+}
+
+# stage outputs, cleared before a full run
+OUTPUTS = ["data/store", "data/cube", "data/trips", "data/segments", "data/reliability", "data_work", "data/violations_before_01052025.csv",
+           "data/violations_after_01052025.csv"]
+
+
+def parse_size(size):
+    # "10M" -> 10_000_000; plain integers pass through
+    if size in SIZES:
+        return SIZES[size]
+    size = str(size).upper()
+    scale = {"K": 10**3, "M": 10**6, "B": 10**9}.get(size[-1])
+    return int(float(size[:-1]) * scale) if scale else int(size)
+
+
+def network(seed=SEED):
+    # routes (ACE routes from data/data.csv plus controls), their timepoint
+    # stops and the distance (miles) to the next stop
+    ace = schemas.read(REPO / "data/data.csv", "ace_routes")
+    routes = sorted(set(ace["route"].astype(str)) | set(CONTROL_ROUTES))
+    rng = np.random.default_rng([seed, 0])
+    n = len(routes) * STOPS_PER_ROUTE
+    origin = np.column_stack([rng.uniform(40.57, 40.88, len(routes)), rng.uniform(-74.05, -73.78, len(routes))])
+    heading = rng.uniform(0, 2 * np.pi, len(routes))
+    k = np.tile(np.arange(STOPS_PER_ROUTE), len(routes))
+    r = np.repeat(np.arange(len(routes)), STOPS_PER_ROUTE)
+    step = rng.uniform(0.003, 0.008, n)
+    lat = origin[r, 0] + np.cos(heading[r]) * k * step
+    lon = origin[r, 1] + np.sin(heading[r]) * k * step
+    streets = rng.choice(["AV", "ST", "BLVD", "PKWY"], n)
+    names = np.array([f"{routes[i]} {j * 7 + 3} {s}/{(j + 1) * 11} ST" for i, j, s in zip(r, k, streets)], dtype=object)
+    return {
+        "routes": np.array(routes, dtype=object),
+        "ace": np.isin(routes, ace.loc[ace["program"] == "ACE", "route"].astype(str)),
+        "stop_id": 400_000 + np.arange(n),
+        "stop_name": names,
+        "lat": lat,
+        "lon": lon,
+        "miles": rng.uniform(0.2, 0.9, n),
+    }
+
+
+def _seconds(rng, n, start, end, skew=1.0):
+    # uniform (skew=1) or late-weighted (skew<1) instants between start and end
+    span = (end - start).total_seconds()
+    return start.to_datetime64().astype("datetime64[s]") + (rng.random(n) ** skew * span).astype(np.int64)
+
+
+def speeds_batch(net, rng, n, start=SPEEDS_START, end=SPEEDS_END):
+    # OData speeds rows: one timepoint segment x clock hour each
+    n_routes = len(net["routes"])
+    r = rng.integers(0, n_routes, n)
+    k = rng.integers(0, STOPS_PER_ROUTE - 1, n)
+    direction = rng.integers(0, 2, n)
+    a = r * STOPS_PER_ROUTE + np.where(direction == 0, k, STOPS_PER_ROUTE - 1 - k)
+    b = a + np.where(direction == 0, 1, -1)
+    ts = _seconds(rng, n, start, end).astype("datetime64[h]")
+    hour = (ts - ts.astype("datetime64[D]")).astype(np.int64)
+    # slower at the peaks, faster overnight, lognormal noise
+    peak = 1 - 0.25 * (np.exp(-((hour - 8) ** 2) / 4) + np.exp(-((hour - 17) ** 2) / 4))
+    speed = np.clip(9.5 * peak * rng.lognormal(0, 0.35, n), 1.0, 45.0)
+    miles = net["miles"][np.minimum(a, b)]
+    return pd.DataFrame({
+        "timestamp": ts.astype("datetime64[s]"),
+        "route_id": net["routes"][r],
+        "direction": direction.astype(str),
+        "borough": np.array(["Manhattan", "Brooklyn", "Bronx", "Queens", "Staten Island"], dtype=object)[r % 5],
+        "route_type": np.where(net["ace"][r], "SBS", "Local"),
+        "stop_order": k + 1,
+        "timepoint_stop_id": net["stop_id"][a],
+        "timepoint_stop_name": net["stop_name"][a],
+        "timepoint_stop_latitude": net["lat"][a],
+        "timepoint_stop_longitude": net["lon"][a],
+        "next_timepoint_stop_id": net["stop_id"][b],
+        "next_timepoint_stop_name": net["stop_name"][b],
+        "next_timepoint_stop_latitude": net["lat"][b],
+        "next_timepoint_stop_longitude": net["lon"][b],
+        "road_distance": miles,
+        "average_travel_time": miles / speed * 60,
+        "average_road_speed": speed.round(2),
+        "bus_trip_count": rng.poisson(3, n) + 1,
+        "day_of_week": (ts.astype("datetime64[D]").astype(np.int64) + 3) % 7 + 1,
+        "hour_of_day": hour,
+    })
+
+
+def violations_batch(net, rng, n, first_id=0, start=VIOLATIONS_START, end=VIOLATIONS_END):
+    # OData violations rows: heavy-tailed repeat vehicles, mostly short
+    # blockages with a long tail, more violations in later years
+    n_routes = len(net["routes"])
+    weights = np.where(net["ace"], 4.0, 1.0)
+    r = rng.choice(n_routes, n, p=weights / weights.sum())
+    s = r * STOPS_PER_ROUTE + rng.integers(0, STOPS_PER_ROUTE, n)
+    first = _seconds(rng, n, start, end, skew=0.7)
+    minutes = np.where(rng.random(n) < 0.05, rng.exponential(240, n), rng.exponential(4, n))
+    last = first + (minutes * 60).astype(np.int64)
+    vehicle = (rng.zipf(1.3, n) * 7919) % N_VEHICLES
+    return pd.DataFrame({
+        "violation_id": (first_id + np.arange(n)).astype(str),
+        "vehicle_id": np.char.add("V", vehicle.astype(str)).astype(object),
+        "first_occurrence": first,
+        "last_occurrence": last,
+        "violation_status": np.array(STATUSES, dtype=object)[rng.choice(len(STATUSES), n, p=STATUS_P)],
+        "violation_type": np.array(TYPES, dtype=object)[rng.integers(0, len(TYPES), n)],
+        "bus_route_id": net["routes"][r],
+        "violation_latitude": net["lat"][s] + rng.normal(0, 0.0004, n),
+        "violation_longitude": net["lon"][s] + rng.normal(0, 0.0004, n),
+        "stop_id": net["stop_id"][s].astype(str),
+        "stop_name": net["stop_name"][s],
+        "bus_stop_latitude": net["lat"][s],
+        "bus_stop_longitude": net["lon"][s],
+    })
+
+
+def _odata(df):
+    # timestamps as the OData feed sends them
+    df = df.copy()
+    for col in df.columns[df.dtypes.map(pd.api.types.is_datetime64_any_dtype)]:
+        df[col] = df[col].dt.strftime("%Y-%m-%dT%H:%M:%S.000")
+    return df
+
+
+def _raw(df):
+    # data_raw export layout: Title Case headers, "%m/%d/%Y %I:%M:%S %p" times
+    df = df.rename(columns=schemas._title)
+    for col in df.columns[df.dtypes.map(pd.api.types.is_datetime64_any_dtype)]:
+        df[col] = df[col].dt.strftime(schemas.RAW[0])
+    return df
+
+
+def _append_csv(df, path, first):
+    df.to_csv(path, index=False, mode="w" if first else "a", header=first)
+
+
+def generate(rows, workdir, seed=SEED, batch_rows=BATCH_ROWS):
+    # rows violations + rows speeds, in every layout the stages read;
+    # batch i always draws from seed [seed, i + 1], so a size is reproducible
+    # whatever machine builds it
+    workdir = Path(workdir)
+    marker = workdir / "generated.json"
+    spec = {"rows": rows, "seed": seed, "batch_rows": batch_rows, "version": GENERATOR_VERSION}
+    if marker.exists() and json.loads(marker.read_text()) == spec:
+        print(f"[BENCH] Reusing {rows:,}-row data in {workdir}")
+        return workdir
+    shutil.rmtree(workdir, ignore_errors=True)
+    for d in ["data/violations", "data/speeds_2025", "data_raw"]:
+        (workdir / d).mkdir(parents=True)
+
+    net = network(seed)
+    shutil.copy(REPO / "data/data.csv", workdir / "data/data.csv")
+    routes = pd.read_csv(REPO / "data/data.csv")
+    routes = routes.drop(columns=["__id"]).rename(columns=schemas._title)
+    routes["Implementation Date"] = pd.to_datetime(routes["Implementation Date"]).dt.strftime("%m/%d/%Y")
+    routes.to_csv(workdir / RAW_ROUTES, index=False)
+
+    start = time.perf_counter()
+    for i, lo in enumerate(range(0, rows, batch_rows)):
+        n = min(batch_rows, rows - lo)
+        rng = np.random.default_rng([seed, i + 1])
+        first = i == 0
+
+        speeds = speeds_batch(net, rng, n, start=pd.Timestamp("2024-11-21"))
+        pq.write_table(pa.Table.from_pandas(_odata(speeds), preserve_index=False),
+                       workdir / f"data/speeds_2025/part-{i:05d}.parquet")
+        raw = _raw(speeds_batch(net, rng, n))
+        new_year = (pd.to_datetime(raw["Timestamp"], format=schemas.RAW[0]) >= "2025-01-01").to_numpy()
+        _append_csv(raw[~new_year], workdir / RAW_SPEEDS[0], first)
+        _append_csv(raw[new_year], workdir / RAW_SPEEDS[1], first)
+
+        violations = violations_batch(net, rng, n, first_id=lo)
+        odata = _odata(violations)
+        pq.write_table(pa.Table.from_pandas(odata, preserve_index=False),
+                       workdir / f"data/violations/part-{i:05d}.parquet")
+        _append_csv(odata.sample(frac=SAMPLE_FRAC, random_state=seed), workdir / "data/violations_sample.csv", first)
+        _append_csv(_raw(violations), workdir / RAW_VIOLATIONS, first)
+        print(f"[BENCH] generated {lo + n:,} / {rows:,} rows ({time.perf_counter() - start:.0f}s)")
+
+    marker.write_text(json.dumps(spec))
+    return workdir
+
+
+def _stage_child(stage, workdir, conn):
+    # runs in a fresh process: import (untimed), then time the call; stage
+    # output goes to logs/<stage>.log
+    os.chdir(workdir)
+    sys.path.insert(0, str(REPO))
+    target, func, kwargs = STAGES[stage]
+    log = Path("logs") / f"{stage.replace('/', '_')}.log"
+    log.parent.mkdir(exist_ok=True)
+    with open(log, "w") as f, contextlib.redirect_stdout(f):
+        fn = None
+        if func is not None:
+            fn = getattr(importlib.import_module(target), func)
+        cpu = os.times()
+        start = time.perf_counter()
+        if fn is None:
+            sys.argv = [target]
+            runpy.run_path(str(REPO / target), run_name="__main__")
+        else:
+            fn(**kwargs)
+        wall = time.perf_counter() - start
+        end = os.times()
+    conn.send({
+        "wall_s": wall,
+        # this process plus finished child processes (worker pools)
+        "cpu_s": sum(end[:4]) - sum(cpu[:4]),
+    })
+    conn.close()
+
+
+def run_stage(stage, workdir, interval=SAMPLE_INTERVAL):
+    ctx = mp.get_context("spawn")
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_stage_child, args=(stage, str(Path(workdir).resolve()), child))
+    proc.start()
+    child.close()
+    ps = psutil.Process(proc.pid)
+    peak = 0
+    while proc.is_alive():
+        peak = max(peak, metrics.tree_rss(ps))
+        proc.join(interval)
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = None
+    if result is None or proc.exitcode != 0:
+        raise RuntimeError(f"[STOP] Stage {stage} failed (exit {proc.exitcode}); see {workdir}/logs")
+    result["peak_rss_mb"] = peak / 2**20
+    return result
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(size, stages=None, bench_dir=BENCH_DIR, seed=SEED):
+    rows = parse_size(size)
+    workdir = generate(rows, Path(bench_dir) / "work" / str(size), seed)
+    # a full run starts cold; a --stages subset reuses the outputs of the
+    # stages it skips
+    for out in OUTPUTS if stages is None else []:
+        path = workdir / out
+        if path.is_dir():
+            shutil.rmtree(path)
+        elif path.exists():
+            path.unlink()
+
+    results = {}
+    for stage in STAGES:
+        if stages is not None and stage not in stages:
+            continue
+        r = run_stage(stage, workdir)
+        r["rows_per_s"] = rows / r["wall_s"] if r["wall_s"] else None
+        results[stage] = {k: round(v, 3) if v is not None else None for k, v in r.items()}
+        print(f"[PERF] {size} {stage}: {r['wall_s']:.2f}s wall, {r['cpu_s']:.2f}s cpu, {r['peak_rss_mb']:,.0f} MB peak")
+
+    report = {
+        "size": str(size),
+        "rows": rows,
+        "seed": seed,
+        "generator_version": GENERATOR_VERSION,
+        "commit": _commit(),
+        "created": pd.Timestamp.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "stages": results,
+    }
+    out = Path(bench_dir) / "results" / f"{size}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    return report
+
+
+def compare(report, baseline, tolerance=TOLERANCE):
+    # per stage: current / baseline ratios; flag marks a regression beyond
+    # tolerance in wall time or peak memory
+    rows = []
+    for stage, cur in report["stages"].items():
+        base = baseline["stages"].get(stage)
+        if base is None:
+            continue
+        wall = cur["wall_s"] / base["wall_s"] if base["wall_s"] else np.nan
+        rss = cur["peak_rss_mb"] / base["peak_rss_mb"] if base["peak_rss_mb"] else np.nan
+        rows.append({
+            "stage": stage,
+            "wall_s": cur["wall_s"],
+            "base_wall_s": base["wall_s"],
+            "wall_x": round(wall, 2),
+            "peak_rss_mb": cur["peak_rss_mb"],
+            "base_rss_mb": base["peak_rss_mb"],
+            "rss_x": round(rss, 2),
+            "flag": "SLOW" if wall > 1 + tolerance else "MEM" if rss > 1 + tolerance else "",
+        })
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time and memory-profile the pipeline on synthetic data")
+    parser.add_argument("--sizes", nargs="+", default=["1M"], help="e.g. 1M 10M 100M (or a row count)")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), help="default: every stage")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--bench-dir", default=BENCH_DIR)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        report = run(size, args.stages, args.bench_dir, args.seed)
+        baseline_path = Path(args.bench_dir) / "baselines" / f"{size}.json"
+        if args.save_baseline:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(report, indent=2))
+            print(f"[DONE] Baseline saved -> {baseline_path}")
+        elif baseline_path.exists():
+            diff = compare(report, json.loads(baseline_path.read_text()))
+            print(diff.to_string(index=False))
+            if (diff["flag"] != "").any():
+                print(f"[SLOW] {size}: {', '.join(diff.loc[diff['flag'] != '', 'stage'])}")
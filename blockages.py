@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+import argparse
+import storage
+
+# Interval index over blockage durations (first -> last occurrence of a
+# violation) per stop. Intervals are stored as two sorted key arrays, starts
+# and ends, where key = stop code << 32 | seconds since the index origin,
+# so every stop's intervals sit in one contiguous, time-sorted slice:
+# - active blockages at (stop, t): starts <= t minus ends < t, two
+#   searchsorted calls, vectorized over any number of queries
+# - overlaps with (stop, [a, b]): starts <= b minus ends < a
+# - the rows themselves: starts in [a - longest interval of the stop, b]
+#   with end >= a
+# Intervals are closed, so a single detection (first == last) counts at its
+# own instant. Concurrency timelines for every stop come from one sweep.
+
+# OData pulls (violations); the data_raw CSV uses "Stop Name",
+# "First Occurrence", "Last Occurrence"
+STOP = "stop_name"
+START = "first_occurrence"
+END = "last_occurrence"
+
+
+def build_index(df, stop=STOP, start=START, end=END):
+    first = pd.to_datetime(df[start], errors="coerce").to_numpy(dtype="datetime64[s]")
+    last = pd.to_datetime(df[end], errors="coerce").to_numpy(dtype="datetime64[s]")
+    stops = df[stop].to_numpy()
+    # negative or missing durations are dropped, as in Q2_02
+    ok = ~np.isnat(first) & ~np.isnat(last) & (last >= first) & pd.notna(stops)
+    rows = np.flatnonzero(ok)
+
+    codes, names = pd.factorize(stops[ok], sort=True)
+    # one day of headroom so queries before the first violation clip to an
+    # empty second
+    origin = first[ok].min() - np.timedelta64(1, "D")
+    s = (first[ok] - origin).astype(np.int64)
+    e = (last[ok] - origin).astype(np.int64)
+    codes = codes.astype(np.int64) << 32
+
+    order = np.argsort(codes | s, kind="stable")
+    longest = np.zeros(len(names), dtype=np.int64)
+    np.maximum.at(longest, codes >> 32, e - s)
+    return {
+        "stops": pd.Index(names),
+        "origin": origin,
+        "start_keys": (codes | s)[order],
+        "end_keys": np.sort(codes | e),
+        # end second and source row of each interval, in start_keys order
+        "ends": e[order],
+        "rows": rows[order],
+        "longest": longest,
+    }
+
+
+def _keys(index, stops, times):
+    codes = index["stops"].get_indexer(np.atleast_1d(stops)).astype(np.int64)
+    if (codes < 0).any():
+        raise KeyError(f"[STOP] Unknown stops: {list(np.atleast_1d(stops)[codes < 0][:5])}")
+    seconds = (pd.to_datetime(np.atleast_1d(times)).to_numpy(dtype="datetime64[s]") - index["origin"]).astype(np.int64)
+    return codes << 32, np.clip(seconds, 0, 2**32 - 1)
+
+
+def active_at(index, stops, times):
+    # number of blockages in progress at each (stop, time) pair
+    codes, t = _keys(index, stops, times)
+    started = np.searchsorted(index["start_keys"], codes | t, side="right")
+    ended = np.searchsorted(index["end_keys"], codes | t, side="left")
+    return started - ended
+
+
+def overlapping_count(index, stops, start, end):
+    # number of blockages overlapping each (stop, [start, end]) window
+    codes, a = _keys(index, stops, start)
+    _, b = _keys(index, stops, end)
+    started = np.searchsorted(index["start_keys"], codes | b, side="right")
+    ended = np.searchsorted(index["end_keys"], codes | a, side="left")
+    return started - ended
+
+
+def overlapping(index, stop, start, end):
+    # source row positions of the blockages overlapping [start, end] at one stop
+    codes, a = _keys(index, stop, start)
+    _, b = _keys(index, stop, end)
+    lo_t = np.maximum(a[0] - index["longest"][codes[0] >> 32], 0)
+    lo = np.searchsorted(index["start_keys"], codes[0] | lo_t, side="left")
+    hi = np.searchsorted(index["start_keys"], codes[0] | b[0], side="right")
+    hit = index["ends"][lo:hi] >= a[0]
+    return index["rows"][lo:hi][hit]
+
+
+def _sweep(index):
+    # +1 / -1 events of every stop in one lexsort; starts sort before ends at
+    # the same second (closed intervals touch). Each stop's events net to
+    # zero, so the running sum restarts at 0 for every stop
+    keys = np.concatenate([index["start_keys"], index["end_keys"]])
+    change = np.concatenate([np.ones(len(index["start_keys"]), np.int64),
+                             -np.ones(len(index["end_keys"]), np.int64)])
+    order = np.lexsort((-change, keys))
+    keys = keys[order]
+    return keys >> 32, keys & 0xFFFFFFFF, np.cumsum(change[order])
+
+
+def timeline(index):
+    # every change in the number of concurrent blockages, for every stop
+    code, seconds, active = _sweep(index)
+    return pd.DataFrame({
+        "stop": index["stops"][code],
+        "time": index["origin"] + seconds.astype("timedelta64[s]"),
+        "active": active,
+    })
+
+
+def blocked_minutes(index):
+    # per stop: minutes with at least one / at least two blockages in
+    # progress, vehicle-minutes, peak concurrency and event count; sorted by
+    # blocked minutes
+    code, seconds, active = _sweep(index)
+    # the level after each event holds until the next event of the same stop
+    same = np.r_[code[1:] == code[:-1], False]
+    span = np.where(same, np.r_[np.diff(seconds), 0], 0)
+
+    n = len(index["stops"])
+    peak = np.zeros(n, dtype=np.int64)
+    np.maximum.at(peak, code, active)
+    out = pd.DataFrame({
+        "stop": index["stops"],
+        "events": np.bincount(index["start_keys"] >> 32, minlength=n),
+        "blocked_min": np.bincount(code, weights=span * (active > 0), minlength=n) / 60,
+        "multi_blocked_min": np.bincount(code, weights=span * (active > 1), minlength=n) / 60,
+        "vehicle_min": np.bincount(code, weights=span * active, minlength=n) / 60,
+        "peak_concurrent": peak,
+    })
+    return out.sort_values(["blocked_min", "events"], ascending=False, ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rank stops by minutes blocked by exempt vehicles")
+    parser.add_argument("--routes", nargs="*")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+    df = storage.load("violations", columns=[STOP, START, END, "violation_status"], routes=args.routes)
+    df = df[df["violation_status"].astype("string").str.upper().str.contains("EXEMPT", na=False)]
+    print(blocked_minutes(build_index(df)).head(args.top).round(1).to_string(index=False))
@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+import argparse
+import phases
+import schemas
+import weighted
+
+# Origin -> destination commute times over corridor segments. For every
+# route and direction the timepoint stops are put in running order once, and
+# segment travel times (trip-weighted, per phase and hour of day) are turned
+# into prefix sums: cum[phase, hour, k] = minutes from the first stop to
+# stop k. Any stop pair is then cum[.., dest] - cum[.., origin], an O(1)
+# lookup; single queries also go through an LRU cache, and all_pairs()
+# evaluates every pair of a route at once.
+
+# scripts/02 output (Title Case columns)
+LABELED_PATH = "data_work/hunter_speeds_ace_labeled.parquet"
+
+HUNTER_ROUTES = ["M101", "M102", "M103"]
+CACHE_SIZE = 65_536
+
+
+def stop_order(segments):
+    # running order of stops from (from, to, weight) segments: start at the
+    # busiest stop nothing leads into and follow each stop's busiest next stop
+    nxt = (segments.sort_values("weight", ascending=False)
+           .drop_duplicates("from")
+           .set_index("from")["to"])
+    heads = segments[~segments["from"].isin(segments["to"])]
+    if len(heads):
+        stop = heads.groupby("from", observed=True)["weight"].sum().idxmax()
+    else:
+        # a loop route: start anywhere, at the busiest segment
+        stop = segments.loc[segments["weight"].idxmax(), "from"]
+    order = [stop]
+    seen = {stop}
+    while stop in nxt.index and nxt[stop] not in seen:
+        stop = nxt[stop]
+        order.append(stop)
+        seen.add(stop)
+    return order
+
+
+def build_table(df, weekdays_only=True, ace_start=phases.ACE_ANNOUNCE, cbd_start=phases.CBD_START):
+    # {(route, direction): {"stops", "pos", "cum", "observed"}}
+    times = pd.to_datetime(df["Timestamp"], errors="coerce")
+    df = df.assign(
+        Phase=phases.phase_label(times, ace_start, cbd_start=cbd_start).astype(object),
+        From=df["Timepoint Stop Name"],
+        To=df["Next Timepoint Stop Name"],
+    )
+    if weekdays_only:
+        df = df[(times.dt.dayofweek < 5).to_numpy()]
+
+    seg = ["Route ID", "Direction", "From", "To"]
+    value = "Average Travel Time"
+    by_hour = weighted.summarize(df, seg + ["Phase", "Hour of Day"], value=value, quantiles=())
+    by_phase = weighted.summarize(df, seg + ["Phase"], value=value, quantiles=())
+    overall = weighted.summarize(df, seg, value=value, quantiles=())
+
+    phase_code = {p: i for i, p in enumerate(phases.PHASES)}
+    table = {}
+    for (route, direction), segs in overall.groupby(["Route ID", "Direction"], sort=False, observed=True):
+        stops = stop_order(segs.rename(columns={"From": "from", "To": "to"}))
+        if len(stops) < 2:
+            continue
+        pos = {s: i for i, s in enumerate(stops)}
+        k = {(a, b): i for i, (a, b) in enumerate(zip(stops[:-1], stops[1:]))}
+        n_seg = len(stops) - 1
+
+        # per phase x hour x segment minutes; gaps fall back to the segment's
+        # all-hours mean in that phase, then to its overall mean
+        minutes = np.full((len(phases.PHASES), 24, n_seg), np.nan)
+        fill = np.full((len(phases.PHASES), 1, n_seg), np.nan)
+        overall_min = np.full(n_seg, np.nan)
+        sel = (by_hour["Route ID"] == route) & (by_hour["Direction"] == direction)
+        for rows, target, has_hour in [(by_hour[sel], minutes, True),
+                                       (by_phase[(by_phase["Route ID"] == route) & (by_phase["Direction"] == direction)], fill, False)]:
+            idx = np.array([k.get(ab, -1) for ab in zip(rows["From"], rows["To"])], dtype=np.int64)
+            keep = idx >= 0
+            p = rows["Phase"].map(phase_code).to_numpy()[keep]
+            h = rows["Hour of Day"].to_numpy(dtype=np.int64)[keep] if has_hour else np.zeros(keep.sum(), np.int64)
+            target[p, h, idx[keep]] = rows["mean"].to_numpy()[keep]
+        idx = np.array([k.get(ab, -1) for ab in zip(segs["From"], segs["To"])], dtype=np.int64)
+        overall_min[idx[idx >= 0]] = segs["mean"].to_numpy()[idx >= 0]
+
+        observed = ~np.isnan(minutes)
+        minutes = np.where(observed, minutes, fill)
+        minutes = np.where(np.isnan(minutes), overall_min, minutes)
+        cum = np.concatenate([np.zeros(minutes.shape[:2] + (1,)), np.cumsum(minutes, axis=2)], axis=2)
+        table[(route, direction)] = {"stops": stops, "pos": pos, "cum": cum, "observed": observed}
+    return table
+
+
+@lru_cache(maxsize=4)
+def load_table(path=LABELED_PATH, weekdays_only=True):
+    return build_table(schemas.read(path, "speeds_raw"), weekdays_only)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def travel_time(route, direction, origin, destination, phase, hour, path=LABELED_PATH):
+    # minutes from origin to destination (timepoint stops, in the running
+    # order of that direction); the table is keyed by (route, direction)
+    entry = load_table(path).get((route, direction))
+    if entry is None:
+        return np.nan
+    i, j = entry["pos"].get(origin), entry["pos"].get(destination)
+    if i is None or j is None or i >= j:
+        return np.nan
+    c = entry["cum"][phases.PHASES.index(phase), hour]
+    return float(c[j] - c[i])
+
+
+def savings(route, direction, origin, destination, hour, before="Pre-ACE", after="ACE only", path=LABELED_PATH):
+    # minutes saved going from the before phase to the after phase
+    return (travel_time(route, direction, origin, destination, before, hour, path)
+            - travel_time(route, direction, origin, destination, after, hour, path))
+
+
+def all_pairs(table, routes=HUNTER_ROUTES, hours=range(24), before="Pre-ACE", after="ACE only"):
+    # every origin -> destination pair of the routes, for every hour, from
+    # the prefix sums at once
+    hours = np.asarray(list(hours))
+    b, a = phases.PHASES.index(before), phases.PHASES.index(after)
+    out = []
+    for (route, direction), entry in table.items():
+        if routes is not None and route not in routes:
+            continue
+        i, j = np.triu_indices(len(entry["stops"]), k=1)
+        cum = entry["cum"][:, hours]
+        t_before = (cum[b][:, j] - cum[b][:, i]).ravel()
+        t_after = (cum[a][:, j] - cum[a][:, i]).ravel()
+        stops = np.asarray(entry["stops"], dtype=object)
+        out.append(pd.DataFrame({
+            "route": route,
+            "direction": direction,
+            "origin": np.tile(stops[i], len(hours)),
+            "destination": np.tile(stops[j], len(hours)),
+            "hour": np.repeat(hours, len(i)),
+            f"{before} min": t_before,
+            f"{after} min": t_after,
+            "saved_min": t_before - t_after,
+        }))
+    return pd.concat(out, ignore_index=True) if out else pd.DataFrame()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Commute time savings for every stop pair")
+    parser.add_argument("--path", default=LABELED_PATH)
+    parser.add_argument("--routes", nargs="*", default=HUNTER_ROUTES)
+    parser.add_argument("--before", default="Pre-ACE", choices=phases.PHASES)
+    parser.add_argument("--after", default="ACE only", choices=phases.PHASES)
+    parser.add_argument("--out", default="data_work/commute_savings.csv")
+    args = parser.parse_args()
+    pairs = all_pairs(load_table(args.path), args.routes, before=args.before, after=args.after)
+    pairs.to_csv(args.out, index=False)
+    print(f"[DONE] {len(pairs):,} stop pair x hour estimates -> {args.out}")
@@ -3,23 +3,59 @@ import polars as pl
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import itertools
+import os
 from geopy.distance import geodesic
 import mpld3
+import metrics
+import storage
+import trips
 
-df = pd.read_csv("data/speeds_2025.csv")
-df['timestamp'] = pd.to_datetime(df['timestamp'])
-df.sort_values(['route_id','timepoint_stop_id','timestamp'])
-unique_routes = df['route_id'].unique()
+SPEED_COLUMNS = ["route_id", "timepoint_stop_id", "timestamp", "average_road_speed"]
 
 
-def get_values():
+# the speeds feed is only read the first time it is needed
+@lru_cache(maxsize=1)
+def load_speeds():
+    return storage.load("speeds_2025", columns=SPEED_COLUMNS)
+
+
+def get_values(df=None):
+
+    if df is None:
+        df = load_speeds()
+
+    # one sort by route, stop, time; every per-group diff below is then a
+    # plain numpy diff masked at group boundaries instead of a groupby pass
+    df = df.sort_values(['route_id', 'timepoint_stop_id', 'timestamp'], kind='stable', ignore_index=True)
+    route = df['route_id'].to_numpy()
+    stop = df['timepoint_stop_id'].to_numpy()
+    ts = df['timestamp'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    speed = df['average_road_speed'].to_numpy(dtype=float)
+
+    new_route = np.r_[True, route[1:] != route[:-1]]
+    new_group = new_route | np.r_[True, stop[1:] != stop[:-1]]
+    gap = np.diff(ts, prepend=ts[0]) / 1e9
 
     # dwell_time: time spent at a stop
     # use dwell_time as a proxy for passenger capacity
-    df['dwell_time'] = df.groupby(['route_id', 'timepoint_stop_id'])['timestamp'].diff().dt.total_seconds()
-    df['dwell_time'] = df['dwell_time'].fillna(0)
-    avg_dwell_per_route = df.groupby('route_id')['dwell_time'].mean()
+    dwell = np.where(new_group, 0.0, gap)
+
+    # first stop of each route = its lowest timepoint_stop_id; those rows
+    # are contiguous and already in time order after the sort
+    first_stop = df.groupby('route_id', sort=False, observed=True)['timepoint_stop_id'].transform('min').to_numpy()
+    at_first = stop == first_stop
+    first_idx = np.flatnonzero(at_first)
+
+    # headway: time diff between consecutive buses at the first stop (minutes)
+    headway = np.full(len(first_idx), np.nan)
+    same_route = route[first_idx[1:]] == route[first_idx[:-1]]
+    headway[1:] = np.where(same_route, np.diff(ts[first_idx]) / 60e9, np.nan)
+
+    grouped = pd.DataFrame({'route_id': route, 'dwell_time': dwell, 'speed': speed}).groupby('route_id', sort=True)
+    avg_dwell_per_route = grouped['dwell_time'].mean()
 
     # passengers per hr
     # this is passengers per hr per route over the sum of the speed_2025.csv dataset
@@ -29,94 +65,188 @@ def get_values():
 
     # free flow speed per route
     # This ignores high congestion data and outliers, so we take the 95th percentile
-    s_r0 = df.groupby('route_id')['average_road_speed'].quantile(0.95) # 95th percentile to ignore outliers
-
-    # headway: time diff between consecutive buses
-    df_first_stop = df[df['timepoint_stop_id'] == df['timepoint_stop_id'].min()]  # first stop
-    df_first_stop = df_first_stop.sort_values(['route_id', 'timestamp'])
-    df_first_stop['headway'] = df_first_stop.groupby('route_id')['timestamp'].diff().dt.seconds / 60  # minutes
+    s_r0 = grouped['speed'].quantile(0.95) # 95th percentile to ignore outliers
+    s_r0.name = 'average_road_speed'
+
+    # alpha_r: congestion coefficient per bus route, s = s0 / (1 + alpha / h)
+    # this is linear in alpha (s0/s - 1 = alpha * 1/h), so the least-squares
+    # fit for every route is one grouped sum instead of a curve_fit per route
+    h = headway
+    s = speed[first_idx]
+    r = route[first_idx]
+    valid = (h > 0) & (s > 0) & np.isfinite(h)
+    x = 1.0 / h[valid]
+    y = s_r0.reindex(r[valid]).to_numpy() / s[valid] - 1.0
+    fit = pd.DataFrame({'route_id': r[valid], 'xy': x * y, 'xx': x * x}).groupby('route_id').agg(
+        xy=('xy', 'sum'), xx=('xx', 'sum'), n=('xx', 'size'))
+    alpha = (fit['xy'] / fit['xx']).clip(lower=0).where(fit['n'] > 2)
 
-    # alpha_r: congestion coefficient per bus route
     # e.g. Q109: np.float(1.0)
-    alpha_r = {}
-
-    for route in df['route_id'].unique():
-        route_data = df_first_stop[df_first_stop['route_id'] == route]
-        h_values = route_data['headway'].dropna().values
-        s_values = route_data['average_road_speed'].dropna().values
-        mask_h = h_values > 0
-        mask_s = s_values > 0
-        h_values = h_values[mask_h]
-        s_values = s_values[mask_s]
-        s0_r = s_r0[route]
-        if len(h_values) > 2:
-            popt, _ = curve_fit(lambda h, alpha: s0_r, h_values, s_values, bounds=(0, np.inf))
-            alpha_r[route] = popt[0]
-        else:
-            alpha_r[route] = np.nan
+    alpha_r = alpha.reindex(s_r0.index).to_dict()
 
     return P_r, s_r0, alpha_r
 
+# a scenario = one what-if setting of the model inputs; scalars apply to
+# every route, arrays/Series give one value per route
+DEFAULT_SCENARIO = {
+    "fleet_size": 1100,      # N_r
+    "route_length": 100000,  # L_r, feet
+    "headway": 5,            # h_r, minutes
+    "s_min": 5,              # min speed
+    "s_max": None,           # optional cap below L / (N * h); None = no cap, as in calculate()
+}
+
+
+def build_problem(P_r):
+    # compile the LP once; a scenario only changes parameter values.
+    # L / (N * h) is not DPP in N and h, so it is folded together with
+    # s_max (when set) into a single upper-bound parameter per route
+    R = len(P_r)
+    weights = np.asarray(P_r, dtype=float) / np.sum(P_r)
+    s = cp.Variable(R)
+    params = {"s_min": cp.Parameter(R), "s_upper": cp.Parameter(R)}
+    objective = cp.Maximize(weights @ s)
+    constraints = [
+        s >= params["s_min"],
+        s <= params["s_upper"],
+    ]
+    return cp.Problem(objective, constraints), params, s
+
+
+def solve_scenario(problem, scenario):
+    prob, params, s = problem
+    R = s.shape[0]
+    unknown = sorted(set(scenario) - set(DEFAULT_SCENARIO))
+    if unknown:
+        raise KeyError(f"[STOP] Unknown scenario keys: {unknown} (expected some of {list(DEFAULT_SCENARIO)})")
+    values = {k: np.broadcast_to(np.asarray(v, dtype=float), R)
+              for k, v in {**DEFAULT_SCENARIO, **scenario}.items() if v is not None}
+
+    max_speed = values["route_length"] / (values["fleet_size"] * values["headway"])
+    upper = np.minimum(max_speed, values["s_max"]) if "s_max" in values else max_speed
+    params["s_min"].value = np.array(values["s_min"])
+    params["s_upper"].value = np.array(upper)
+    prob.solve(warm_start=True)
+
+    s_opt = np.full(R, np.nan) if s.value is None else np.array(s.value).flatten()
+    return prob.status, prob.value, s_opt, max_speed, upper
+
+
+def binding(s_opt, max_speed, upper, s_min, tol=1e-5):
+    # which bound each route's optimized speed sits on: "max_speed"
+    # (L / (N * h)), "s_max" (the cap, when it is the tighter one), "s_min",
+    # or None
+    at_upper = s_opt >= upper - tol
+    capped = upper < max_speed
+    return np.select([at_upper & capped, at_upper, s_opt <= np.asarray(s_min, dtype=float) + tol],
+                     ["s_max", "max_speed", "s_min"], None)
+
+
+def _solve_chunk(routes, P_r, scenarios):
+    # runs in a worker process: compile once, then warm-start through the chunk
+    problem = build_problem(P_r)
+    out = []
+    for scenario_id, scenario in scenarios:
+        status, objective, s_opt, max_speed, upper = solve_scenario(problem, scenario)
+        frame = pd.DataFrame({
+            "scenario_id": scenario_id,
+            "route": routes,
+            "optimized_speed": s_opt,
+            "max_speed": max_speed,
+            "speed_upper": upper,
+            "binding": binding(s_opt, max_speed, upper, {**DEFAULT_SCENARIO, **scenario}["s_min"]),
+        })
+        frame["is_max_constrained"] = frame["binding"].isin(["max_speed", "s_max"])
+        frame["objective"] = objective
+        frame["status"] = status
+        out.append(frame)
+    return pd.concat(out, ignore_index=True)
+
+
+def scenario_grid(**axes):
+    # scenario_grid(fleet_size=[900, 1100], headway=[3, 5, 8]) -> every combination
+    keys = list(axes)
+    return [dict(zip(keys, combo)) for combo in itertools.product(*axes.values())]
+
+
+def sweep(scenarios, P_r=None, max_workers=None, chunks_per_worker=4):
+    # solve every scenario and return a tidy table: one row per scenario x
+    # route, with the scenario inputs, optimized speed and binding bound
+    if P_r is None:
+        P_r, _, _ = get_values()
+    routes = np.asarray(P_r.index)
+    P_values = P_r.to_numpy(dtype=float)
+
+    indexed = list(enumerate(scenarios))
+    max_workers = max_workers or os.cpu_count()
+    n_chunks = max(1, min(len(indexed), max_workers * chunks_per_worker))
+    chunks = [indexed[i::n_chunks] for i in range(n_chunks)]
+
+    if max_workers == 1 or len(chunks) == 1:
+        parts = [_solve_chunk(routes, P_values, c) for c in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            parts = list(pool.map(_solve_chunk, [routes] * len(chunks), [P_values] * len(chunks), chunks))
+
+    results = pd.concat(parts, ignore_index=True)
+    inputs = pd.DataFrame([{**DEFAULT_SCENARIO, **sc} for sc in scenarios])
+    inputs.index.name = "scenario_id"
+    scalar_cols = [c for c in inputs.columns if inputs[c].map(lambda v: v is None or np.isscalar(v)).all()]
+    results = results.merge(inputs[scalar_cols].reset_index(), on="scenario_id", how="left")
+    return results.sort_values(["scenario_id", "route"], ignore_index=True)
+
+
+@metrics.instrument()
 def calculate():
 
     # variables
     # passengers per hr, avg speed, congestion coefficients
     P_r, s_r0, alpha_r = get_values()
-    # number of routes
-    R = len(unique_routes)
+    metrics.record(rows_in=len(load_speeds()))
     # bus capacity
     C = 50
-    # fleet size
-    N_r = 1100 * np.ones(R)
-    # route length in feet
-    L_r = 100000 * np.ones(R)
-
-    s_min = 5 * np.ones(R)  # min speed
-    s_max = 35 * np.ones(R) # max speed
 
-    df_routes = pd.DataFrame({'route_id': unique_routes})
-    df_routes = df_routes.sort_values(by="route_id")
-
-    fixed_headways = [5] * R
-    headways = pd.DataFrame({
-        'fixed_headway': fixed_headways
+    # observed headway and fleet per route from the chained runs
+    # (trips.py). A route without them takes the median observed route,
+    # not DEFAULT_SCENARIO, whose fleet is the whole network's; the
+    # defaults are only used when no route was observed at all
+    scenario = dict(DEFAULT_SCENARIO)
+    observed = trips.load_summary()
+    if observed is not None:
+        observed = observed.reindex(P_r.index.astype(str))[['headway_min', 'fleet_size']]
+        missing = observed.isna().any(axis=1)
+        if missing.all():
+            observed = None
+    if observed is None:
+        print("[INFO] No observed routes in data/trips/routes.parquet; using the default headway and fleet size")
+    else:
+        median = observed[~missing].median()
+        if missing.any():
+            print(f"[INFO] {missing.sum()} of {len(missing)} routes have no observed headway or fleet; "
+                  f"using the median route ({median['headway_min']:g} min, {median['fleet_size']:g} buses)")
+        observed = observed.fillna(median)
+        scenario['headway'] = observed['headway_min'].to_numpy()
+        scenario['fleet_size'] = observed['fleet_size'].to_numpy()
+
+    route_params = pd.DataFrame({
+        'route': P_r.index,
+        'P_r': P_r.values,
+        's_r0': s_r0.reindex(P_r.index).values,
+        'headway': scenario['headway'],
+        'fleet_size': scenario['fleet_size'],
     })
 
-    objects = [df_routes, P_r, s_r0, headways]
-
-    clean_objs = []
-    for obj in objects:
-        if isinstance(obj, pd.Series):
-            clean_objs.append(obj.reset_index(drop=True).to_frame())
-        else:
-            clean_objs.append(obj.reset_index(drop=True))
-
-    route_params = pd.concat(clean_objs, axis=1, ignore_index=True)
-    route_params.columns = ['route', 'P_r', 's_r0', 'headway']
-
-    # head_way
-    h_r = route_params['headway'].values
-
-    # optimization
-    s = cp.Variable(R)
-
-    objective = cp.Maximize(cp.sum(cp.multiply(P_r,s)) / cp.sum(P_r))
-
-    constraints = [
-        s >= s_min,
-        s <= L_r / (N_r * h_r),
-    ]
-
-    prob = cp.Problem(objective, constraints)
-    prob.solve()
-
-    s_opt = np.array(s.value).flatten()
+    # optimization (route length and speed bounds from DEFAULT_SCENARIO;
+    # use sweep() for what-if grids)
+    status, objective, s_opt, max_speed, upper = solve_scenario(build_problem(P_r), scenario)
 
     route_params['optimized_speed'] = s_opt
-    route_params['max_speed'] = L_r / (N_r * h_r)
-    route_params['is_max_constrained'] = route_params['optimized_speed'] >= route_params['max_speed'] - 1e-5
+    route_params['max_speed'] = max_speed
+    route_params['binding'] = binding(s_opt, max_speed, upper, scenario['s_min'])
+    route_params['is_max_constrained'] = route_params['binding'].isin(['max_speed', 's_max'])
 
     max_constrained_routes = route_params[route_params['is_max_constrained']]
+    metrics.record(rows_out=len(route_params))
     
     routes = route_params['route']
     current = route_params['s_r0']
@@ -0,0 +1,201 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+# Difference-in-differences / event-study engine over a route x day panel of
+# violation counts. The panel is built in one bincount; every estimate is a
+# masked mean over its rows, and inference (moving-block bootstrap over days,
+# label permutation, or a route-cluster bootstrap for event studies) is done
+# for all routes at once in NumPy, with resamples split across processes.
+
+WINDOW_DAYS = 90   # days compared on each side of a route's start date
+BLOCK_DAYS = 7     # bootstrap block length (keeps weekly autocorrelation)
+N_BOOT = 2000
+SEED = 42
+
+
+def daily_panel(times, routes):
+    # routes x days matrix of counts (days with no violations are 0)
+    day = pd.to_datetime(pd.Series(times), errors="coerce").to_numpy().astype("datetime64[D]")
+    routes = pd.Series(routes).to_numpy()
+    ok = ~np.isnat(day) & pd.notna(routes)
+    day, routes = day[ok], routes[ok]
+
+    codes, labels = pd.factorize(routes, sort=True)
+    first = day.min()
+    d_idx = (day - first).astype(np.int64)
+    n_days = int(d_idx.max()) + 1
+    counts = np.bincount(codes * n_days + d_idx, minlength=len(labels) * n_days)
+    return pd.DataFrame(
+        counts.reshape(len(labels), n_days),
+        index=pd.Index(labels, name="route"),
+        columns=pd.date_range(pd.Timestamp(first), periods=n_days, freq="D"),
+    )
+
+
+def _gaps(panel, starts, controls=None):
+    # treated route minus the mean control route, per day; treated routes are
+    # those with a start date strictly inside the panel
+    starts = pd.Series(starts).reindex(panel.index)
+    days = panel.columns.values
+    if controls is None:
+        controls = starts.isna().to_numpy()
+    y = panel.to_numpy(dtype=float)
+    control = y[controls].mean(axis=0)
+
+    treated = starts.notna().to_numpy() & (starts > days[0]).to_numpy() & (starts <= days[-1]).to_numpy()
+    s_idx = np.searchsorted(days, starts[treated].to_numpy(dtype="datetime64[ns]"))
+    return y[treated] - control, s_idx, panel.index[treated], starts[treated]
+
+
+def _segments(g, s_idx, window):
+    # before = [start - window, start), after = [start, start + window), each
+    # packed to the left with its valid length
+    n_days = g.shape[1]
+    offs = np.arange(window)
+    rows = np.arange(len(g))[:, None]
+
+    def take(idx):
+        valid = (idx >= 0) & (idx < n_days)
+        vals = np.where(valid, g[rows, np.clip(idx, 0, n_days - 1)], np.nan)
+        order = np.argsort(~valid, axis=1, kind="stable")
+        return np.take_along_axis(vals, order, axis=1), valid.sum(axis=1)
+
+    before, n_before = take(s_idx[:, None] - window + offs)
+    after, n_after = take(s_idx[:, None] + offs)
+    return before, n_before, after, n_after
+
+
+def _block_means(seg, n, n_boot, block, rng):
+    # moving-block bootstrap means for every row at once: (rows, n_boot)
+    rows, width = seg.shape
+    n_blocks = -(-width // block)
+    safe_n = np.maximum(n, 1)
+    starts = (rng.random((n_boot, rows, n_blocks)) * safe_n[None, :, None]).astype(np.int64)
+    idx = (starts[..., None] + np.arange(block)).reshape(n_boot, rows, -1)[..., :width]
+    idx %= safe_n[None, :, None]
+    vals = seg[np.arange(rows)[None, :, None], idx]
+    keep = np.arange(width)[None, None, :] < n[None, :, None]
+    return (np.where(keep, vals, 0.0).sum(axis=2) / safe_n[None, :]).T
+
+
+def _permuted_diffs(before, n_before, after, n_after, n_boot, rng):
+    # shuffle day labels within each route's window: (rows, n_boot)
+    pooled = np.concatenate([before, after], axis=1)
+    valid = ~np.isnan(pooled)
+    pooled = np.where(valid, pooled, 0.0)
+    total = n_before + n_after
+    # valid days to the front, then a random order among them
+    keys = np.where(valid[None], rng.random((n_boot,) + pooled.shape), np.inf)
+    order = np.argsort(keys, axis=2)
+    shuffled = np.take_along_axis(np.broadcast_to(pooled, keys.shape), order, axis=2)
+    pos = np.arange(pooled.shape[1])[None, None, :]
+    is_after = pos < n_after[None, :, None]
+    in_window = pos < total[None, :, None]
+    sum_after = np.where(is_after, shuffled, 0.0).sum(axis=2)
+    sum_before = np.where(in_window & ~is_after, shuffled, 0.0).sum(axis=2)
+    return (sum_after / np.maximum(n_after, 1) - sum_before / np.maximum(n_before, 1)).T
+
+
+def _resample_chunk(method, before, n_before, after, n_after, n_boot, block, seed):
+    rng = np.random.default_rng(seed)
+    if method == "permutation":
+        return _permuted_diffs(before, n_before, after, n_after, n_boot, rng)
+    return _block_means(after, n_after, n_boot, block, rng) - _block_means(before, n_before, n_boot, block, rng)
+
+
+def _resample(method, before, n_before, after, n_after, n_boot, block, seed, max_workers):
+    # split the resamples across processes, each with its own seed stream
+    max_workers = max_workers or os.cpu_count()
+    sizes = [len(c) for c in np.array_split(np.arange(n_boot), max_workers) if len(c)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(method, before, n_before, after, n_after, size, block, s) for size, s in zip(sizes, seeds)]
+    if len(args) == 1:
+        return _resample_chunk(*args[0])
+    with ProcessPoolExecutor(max_workers=len(args)) as pool:
+        parts = list(pool.map(_resample_chunk, *zip(*args)))
+    return np.concatenate(parts, axis=1)
+
+
+def _summarize(effect, draws, method, level):
+    lo, hi = (1 - level) / 2, 1 - (1 - level) / 2
+    if method == "permutation":
+        # draws are the null distribution of the effect
+        p = (np.abs(draws) >= np.abs(effect)[:, None]).mean(axis=1)
+        ci = effect[:, None] - np.quantile(draws, [hi, lo], axis=1).T
+    else:
+        p = 2 * np.minimum((draws <= 0).mean(axis=1), (draws >= 0).mean(axis=1))
+        ci = np.quantile(draws, [lo, hi], axis=1).T
+    return ci[:, 0], ci[:, 1], np.minimum(p, 1.0)
+
+
+def route_effects(panel, starts, controls=None, window=WINDOW_DAYS, method="bootstrap",
+                  n_boot=N_BOOT, block=BLOCK_DAYS, level=0.95, seed=SEED, max_workers=None):
+    # DiD for every treated route against its own start date:
+    # (route - controls) after minus (route - controls) before, within window
+    # days. starts = route -> start date (e.g. phases.implementation_dates());
+    # controls default to routes with no start date
+    g, s_idx, routes, route_starts = _gaps(panel, starts, controls)
+    before, n_before, after, n_after = _segments(g, s_idx, window)
+    effect = np.nanmean(after, axis=1) - np.nanmean(before, axis=1)
+
+    draws = _resample(method, before, n_before, after, n_after, n_boot, block, seed, max_workers)
+    ci_low, ci_high, p = _summarize(effect, draws, method, level)
+    return pd.DataFrame({
+        "route": routes,
+        "start": route_starts.to_numpy(),
+        "n_before": n_before,
+        "n_after": n_after,
+        "effect": effect,
+        "ci_low": ci_low,
+        "ci_high": ci_high,
+        "p_value": p,
+    }).sort_values("start", ignore_index=True)
+
+
+def pooled_did(panel, treated, cutoff, method="bootstrap", n_boot=N_BOOT, block=BLOCK_DAYS,
+               level=0.95, seed=SEED, max_workers=None):
+    # one DiD for all treated routes together around a single cutoff (e.g.
+    # CBD_START): daily totals of treated vs control routes
+    y = panel.to_numpy(dtype=float)
+    treated = np.asarray(treated, dtype=bool)
+    g = (y[treated].sum(axis=0) - y[~treated].sum(axis=0))[None, :]
+    s_idx = np.searchsorted(panel.columns.values, np.datetime64(pd.Timestamp(cutoff)))[None]
+    before, n_before, after, n_after = _segments(g, s_idx, panel.shape[1])
+    effect = np.nanmean(after, axis=1) - np.nanmean(before, axis=1)
+
+    draws = _resample(method, before, n_before, after, n_after, n_boot, block, seed, max_workers)
+    ci_low, ci_high, p = _summarize(effect, draws, method, level)
+    return {"effect": effect[0], "ci_low": ci_low[0], "ci_high": ci_high[0], "p_value": p[0]}
+
+
+def event_study(panel, starts, controls=None, weeks=12, n_boot=N_BOOT, level=0.95, seed=SEED):
+    # effect by week relative to each route's start date, averaged across
+    # routes and measured against week -1; CIs resample routes (clusters)
+    g, s_idx, routes, _ = _gaps(panel, starts, controls)
+    n_routes, n_days = g.shape
+    week = np.floor((np.arange(n_days)[None, :] - s_idx[:, None]) / 7).astype(np.int64)
+    keep = (week >= -weeks) & (week < weeks)
+    n_bins = 2 * weeks
+    key = np.arange(n_routes)[:, None] * n_bins + (week + weeks)
+
+    sums = np.bincount(key[keep], weights=g[keep], minlength=n_routes * n_bins).reshape(n_routes, n_bins)
+    counts = np.bincount(key[keep], minlength=n_routes * n_bins).reshape(n_routes, n_bins)
+    means = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+    means = means - means[:, [weeks - 1]]
+    observed = ~np.isnan(means)
+    means0 = np.where(observed, means, 0.0)
+
+    rng = np.random.default_rng(seed)
+    w = rng.multinomial(n_routes, np.full(n_routes, 1 / n_routes), size=n_boot).astype(float)
+    boot = (w @ means0) / np.maximum(w @ observed, 1)
+
+    lo, hi = (1 - level) / 2, 1 - (1 - level) / 2
+    return pd.DataFrame({
+        "event_week": np.arange(-weeks, weeks),
+        "estimate": np.nanmean(means, axis=0),
+        "ci_low": np.quantile(boot, lo, axis=0),
+        "ci_high": np.quantile(boot, hi, axis=0),
+        "n_routes": observed.sum(axis=0),
+    })
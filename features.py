@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pathlib import Path
+import argparse
+import json
+import os
+import phases
+import schemas
+
+# Prepared feature files for the notebooks. The labeled speeds (scripts/02)
+# and filtered violations (scripts/03) are read once, the columns every
+# notebook used to derive for itself are added (Is Weekday, Hour of Day,
+# Corridor, Phase, route_tag), and the result is written as an
+# uncompressed Arrow IPC (Feather v2) file. Loading memory-maps that file:
+# nothing is parsed, Arrow columns point straight into the page cache, and
+# every process reading the same file shares those pages. A file is rebuilt
+# when its source changes (size / mtime / path recorded in its metadata).
+
+FEATURE_DIR = Path("data/features")
+
+# source and schema per feature set; the source can be overridden per call
+SETS = {
+    "speeds": {
+        "source": "data_work/hunter_speeds_ace_labeled.parquet",
+        "schema": "speeds_raw",
+        "time": "Timestamp",
+        "route": "Route ID",
+    },
+    "violations": {
+        "source": "data_work/violations_routes_filtered.parquet",
+        "schema": "violations_raw",
+        "time": "Datetime",
+        "route": "Bus Route ID",
+    },
+}
+
+# bump when the derived columns change
+VERSION = 1
+
+
+def route_tag(r):
+    # canonical route name: M101 variants -> M101, M60 / M15 SBS variants
+    # -> M60+ / M15+, everything else upper-cased
+    if pd.isna(r):
+        return None
+    r = str(r).upper().strip()
+    if r.startswith("M101"):
+        return "M101"
+    if r.startswith("M60"):
+        return "M60+" if ("SBS" in r or "+" in r or "-" in r) else "M60"
+    if r.startswith("M15"):
+        return "M15+" if ("SBS" in r or "+" in r) else "M15"
+    return r
+
+
+def route_tags(routes):
+    # route_tag for a whole column through a lookup table: the function runs
+    # once per distinct route name, rows only index into the result
+    codes, names = pd.factorize(pd.Series(routes).astype("string"))
+    # missing routes have code -1, i.e. the trailing None
+    table = np.array([route_tag(n) for n in names] + [None], dtype=object)
+    return pd.Categorical(table[codes])
+
+
+def derive(df, name, ace_start=phases.ACE_ANNOUNCE, cbd_start=phases.CBD_START):
+    spec = SETS[name]
+    times = df[spec["time"]]
+    df["Is Weekday"] = (times.dt.dayofweek < 5).to_numpy()
+    if "Hour of Day" not in df:
+        df["Hour of Day"] = times.dt.hour.astype("int8")
+    df["route_tag"] = route_tags(df[spec["route"]])
+    if name == "speeds":
+        df["Corridor"] = (df["Timepoint Stop Name"].astype("string") + " → "
+                          + df["Next Timepoint Stop Name"].astype("string")).astype("category")
+        # categories in name order, so groupbys sort phases the way the
+        # notebooks' string labels did
+        df["Phase"] = pd.Categorical(phases.phase_label(times, ace_start, cbd_start=cbd_start).astype(object))
+    return df
+
+
+def feature_path(name, source=None, feature_dir=FEATURE_DIR):
+    # one file per set and source, e.g. data/features/speeds-hunter_speeds_ace_labeled.arrow
+    source = source or SETS[name]["source"]
+    return Path(feature_dir) / f"{name}-{Path(source).stem}.arrow"
+
+
+def _source_stamp(source):
+    st = Path(source).stat()
+    return {"source": str(Path(source).resolve()), "size": st.st_size, "mtime_ns": st.st_mtime_ns, "version": VERSION}
+
+
+def build(name, source=None, feature_dir=FEATURE_DIR):
+    source = source or SETS[name]["source"]
+    df = derive(schemas.read(source, SETS[name]["schema"]), name)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        b"features": json.dumps(_source_stamp(source)).encode(),
+    })
+    path = feature_path(name, source, feature_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".arrow.tmp")
+    # uncompressed, so the file can be memory-mapped as is
+    with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=1_000_000)
+    os.replace(tmp, path)
+    print(f"[DONE] {name} features: {len(df):,} rows -> {path}")
+    return path
+
+
+def stamp(name, source=None, feature_dir=FEATURE_DIR):
+    path = feature_path(name, source, feature_dir)
+    if not path.exists():
+        return None
+    with pa.memory_map(str(path)) as f:
+        meta = pa.ipc.open_file(f).schema.metadata or {}
+    return json.loads(meta[b"features"]) if b"features" in meta else None
+
+
+def is_stale(name, source=None, feature_dir=FEATURE_DIR):
+    source = source or SETS[name]["source"]
+    return stamp(name, source, feature_dir) != _source_stamp(source)
+
+
+def load_table(name, columns=None, source=None, feature_dir=FEATURE_DIR):
+    # Arrow table backed by the memory-mapped file (zero-copy); built or
+    # rebuilt first if missing or stale
+    source = source or SETS[name]["source"]
+    path = feature_path(name, source, feature_dir)
+    if not path.exists() or (Path(source).exists() and is_stale(name, source, feature_dir)):
+        build(name, source, feature_dir)
+    table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+    return table.select(columns) if columns else table
+
+
+def load(name, columns=None, source=None, feature_dir=FEATURE_DIR):
+    # pandas view of the feature file: numeric / timestamp columns without
+    # nulls stay in the mapped buffers (split_blocks avoids consolidating
+    # them into new 2D blocks), dictionary columns come back categorical
+    table = load_table(name, columns, source, feature_dir)
+    return table.to_pandas(split_blocks=True, self_destruct=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the memory-mapped feature files for the notebooks")
+    parser.add_argument("names", nargs="*", default=list(SETS), choices=list(SETS))
+    parser.add_argument("--source", help="source file instead of the default (one name only)")
+    args = parser.parse_args()
+    for name in args.names:
+        build(name, args.source)
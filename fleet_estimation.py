@@ -1,57 +1,143 @@
 import polars as pl
 import pandas as pd
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import os
+import metrics
+import storage
 
-# load dataset
-df = pl.read_csv("data/speeds_2025.csv")
-
-# convert to datetime
-df = df.with_columns([
-    pl.col('timestamp').str.strptime(pl.Datetime, format=None, strict=False)
-])
-
-# calculate end time by adding avg travel time to timestamp(start time)
-# timestamp = the time the bus arrives at stop A
-# end_time = the time the bus arrives at stop B
-# each row in speeds_2025.csv contains data about a bus going from stop A to stop B
-df = df.with_columns([
-    (pl.col('timestamp') + (pl.col('average_travel_time')*60_000_000).cast(pl.Duration('us'))).alias('end_time')
-])
-
-# make start_events
-start_events = df.select([
-    pl.col("route_id"),
-    pl.col("timestamp").alias("time"),
-    pl.lit(1).alias("change")
-])
-
-# make end_events
-end_events = df.select([
-    pl.col("route_id"),
-    pl.col("end_time").alias("time"),
-    pl.lit(-1).alias("change")
-])
-
-# concatenate start and end events
-events_df = pl.concat([start_events, end_events])
-
-# sort by route and time
-events_df = events_df.sort(["route_id", "time"])
-
-# find cumulative active buses per route
-events_df = events_df.with_columns([
-    pl.col("change").cum_sum().over("route_id").alias("active_buses")
-])
-
-# find max active buses per route
-fleet_per_route_df = events_df.group_by("route_id").agg([
-    pl.max("active_buses").alias("fleet_size")
-])
-
-fleet_per_route = dict(zip(fleet_per_route_df["route_id"], fleet_per_route_df["fleet_size"]))
-total_fleet_size = sum(fleet_per_route.values())
-
-print(fleet_per_route)
-print("Total active fleet size: ", total_fleet_size)
+FEEDS = ["speeds_2025"]
+HOUR_NS = 3_600_000_000_000
+
+
+# each row in the speeds feeds contains data about a bus going from stop A
+# to stop B: timestamp = the time the bus arrives at stop A and
+# end_time = timestamp + average travel time = the time it arrives at stop B
+def load_route(route, feeds=FEEDS):
+    # only this route's partitions, only the two columns the sweep needs
+    frames = [
+        storage.scan(name, routes=[route]).select(
+            pl.col("timestamp").cast(pl.Datetime("ns")),
+            pl.col("average_travel_time").cast(pl.Float64),
+        )
+        for name in feeds
+    ]
+    return pl.concat(frames).drop_nulls().collect()
+
+
+def sweep(starts, ends):
+    # sweep-line over +1 (start) / -1 (end) events; ends sort before starts
+    # at the same instant so a bus finishing a segment and starting the next
+    # is not counted twice. returns event times and active buses after each
+    times = np.concatenate([starts, ends])
+    change = np.concatenate([np.ones(len(starts), np.int32), -np.ones(len(ends), np.int32)])
+    order = np.lexsort((change, times))
+    return times[order], np.cumsum(change[order])
+
+
+def hourly_peaks(times, active):
+    # peak active buses in every clock hour between the first and last
+    # event: the max of the level carried into the hour and every level
+    # reached inside it
+    hour = times // HOUR_NS
+    first_hour = hour[0]
+    n_hours = int(hour[-1] - first_hour) + 1
+    idx = (hour - first_hour).astype(np.int64)
+
+    # first/last event of each hour that has events
+    first = np.flatnonzero(np.r_[True, idx[1:] != idx[:-1]])
+    last_event = np.r_[first[1:] - 1, len(idx) - 1]
+
+    # last event at or before each hour -> level carried into the next hour
+    last = np.full(n_hours, -1, np.int64)
+    last[idx[first]] = last_event
+    last = np.maximum.accumulate(last)
+    level_at_end = np.where(last >= 0, active[np.maximum(last, 0)], 0)
+    level_at_start = np.concatenate([[0], level_at_end[:-1]])
+
+    peak = level_at_start.copy()
+    peak[idx[first]] = np.maximum(peak[idx[first]], np.maximum.reduceat(active, first))
+    return (first_hour + np.arange(n_hours)) * HOUR_NS, peak
+
+
+def route_timeline(route, feeds=FEEDS):
+    df = load_route(route, feeds)
+    if df.is_empty():
+        return None
+    starts = df["timestamp"].to_numpy().astype(np.int64)
+    ends = starts + (df["average_travel_time"].to_numpy() * 60e9).astype(np.int64)
+    times, active = sweep(starts, ends)
+    hours, peak = hourly_peaks(times, active)
+    keep = peak > 0
+    return pd.DataFrame({
+        "route_id": route,
+        "hour": pd.to_datetime(hours[keep]),
+        "active_buses": peak[keep],
+    })
+
+
+@metrics.instrument()
+def concurrency_timeline(feeds=FEEDS, routes=None, max_workers=None):
+    # full timeline: peak active buses per route per clock hour, computed
+    # route by route (bounded memory) on a thread pool
+    if routes is None:
+        routes = sorted(set().union(*(storage.routes(name) for name in feeds)))
+    metrics.record(rows_in=sum(storage.count_rows(name, routes=routes) for name in feeds))
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+        parts = [t for t in pool.map(lambda r: route_timeline(r, feeds), routes) if t is not None]
+    timeline = pd.concat(parts, ignore_index=True)
+    timeline["date"] = timeline["hour"].dt.date
+    timeline["hour_of_day"] = timeline["hour"].dt.hour
+    timeline["route_id"] = timeline["route_id"].astype("category")
+    return timeline
+
+
+def fleet_summary(timeline, percentiles=(50, 90, 99)):
+    # per route: max active buses (the old fleet_size) plus percentiles of
+    # the hourly peaks over the hours the route was in service
+    g = timeline.groupby("route_id", observed=True)["active_buses"]
+    summary = g.max().rename("fleet_size").to_frame()
+    for p in percentiles:
+        summary[f"p{p}"] = g.quantile(p / 100)
+    return summary.reset_index()
+
+
+def by_hour_of_day(timeline, percentiles=(50, 90, 99)):
+    # typical concurrency profile: percentiles of the peak per route and hour of day
+    g = timeline.groupby(["route_id", "hour_of_day"], observed=True)["active_buses"]
+    out = g.max().rename("max").to_frame()
+    for p in percentiles:
+        out[f"p{p}"] = g.quantile(p / 100)
+    return out.reset_index()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--feeds", nargs="+", default=FEEDS, help="e.g. speeds_2025 speeds_2023-24")
+    args = parser.parse_args()
+
+    timeline = concurrency_timeline(args.feeds)
+    summary = fleet_summary(timeline)
+
+    fleet_per_route = dict(zip(summary["route_id"], summary["fleet_size"]))
+    total_fleet_size = sum(fleet_per_route.values())
+
+    print(fleet_per_route)
+    print("Total active fleet size: ", total_fleet_size)
+
+    # system-wide active buses per hour
+    system = timeline.groupby("hour")["active_buses"].sum()
+    print("Peak system-wide active buses in one hour: ", system.max())
+    print(summary.describe())
+
+    # segment concurrency is a lower bound; runs chained by trips.py also
+    # count the buses between segments
+    import trips
+    chained = trips.load_summary()
+    if chained is not None:
+        print("Total fleet from chained runs: ", chained["fleet_size"].sum())
 
 # This estimation is a lower bound for the active fleet
 # where active fleet is defined as the number of MTA buses
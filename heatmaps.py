@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import folium
+from folium.plugins import HeatMap
+
+# Size-bounded heatmap export. Instead of one heat point per violation, points
+# are binned into weighted grid cells at several levels of detail and the
+# finest level that fits in max_points is written, so the HTML size stays
+# bounded however many violations there are. Several maps (e.g. before /
+# after a cutoff) are binned in one shared pass and drawn at the same level
+# with the same weight scale, so they stay comparable.
+
+# finest cell edge in degrees (~11 m of latitude)
+FINEST_CELL = 0.0001
+# each level is 4x coarser than the previous one (~2 zoom levels)
+LEVEL_FACTORS = [1, 4, 16, 64, 256]
+# heat points written per map
+MAX_POINTS = 20_000
+
+
+def bin_points(lat, lon, groups=None, weights=None, cell=FINEST_CELL):
+    # one pass: weighted counts per group x finest grid cell
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    groups = np.zeros(len(lat), dtype=np.int64) if groups is None else np.asarray(groups)
+    weights = np.ones(len(lat)) if weights is None else np.asarray(weights, dtype=float)
+
+    ok = np.isfinite(lat) & np.isfinite(lon)
+    frame = pd.DataFrame({
+        "group": groups[ok],
+        "lat_cell": np.floor(lat[ok] / cell).astype(np.int64),
+        "lon_cell": np.floor(lon[ok] / cell).astype(np.int64),
+        "weight": weights[ok],
+    })
+    return frame.groupby(["group", "lat_cell", "lon_cell"], sort=False, observed=True)["weight"].sum().reset_index()
+
+
+def coarsen(cells, factor):
+    # re-bin finest cells into cells factor times larger (cheap: cells, not points)
+    if factor == 1:
+        return cells
+    out = cells.assign(
+        lat_cell=cells["lat_cell"] // factor,
+        lon_cell=cells["lon_cell"] // factor,
+    )
+    return out.groupby(["group", "lat_cell", "lon_cell"], sort=False, observed=True)["weight"].sum().reset_index()
+
+
+def level_of_detail(cells, max_points=MAX_POINTS, factors=LEVEL_FACTORS):
+    # finest level where no group needs more than max_points cells; past the
+    # coarsest level the heaviest max_points cells per group are kept
+    for factor in factors:
+        level = coarsen(cells, factor)
+        if level.groupby("group", observed=True).size().max() <= max_points:
+            return level, factor
+    level = level.sort_values("weight", ascending=False).groupby("group", observed=True).head(max_points)
+    return level, factor
+
+
+def heat_points(level, factor, cell=FINEST_CELL):
+    # {group: [[lat, lon, weight], ...]} at cell centers, weights scaled by
+    # one shared max so every group is drawn on the same scale
+    size = cell * factor
+    top = level["weight"].max() if len(level) else 1.0
+    points = {}
+    for group, g in level.groupby("group", observed=True):
+        points[group] = np.column_stack([
+            ((g["lat_cell"].to_numpy() + 0.5) * size).round(6),
+            ((g["lon_cell"].to_numpy() + 0.5) * size).round(6),
+            (g["weight"].to_numpy() / top).round(4),
+        ]).tolist()
+    return points
+
+
+def save_heatmaps(lat, lon, groups, paths, center=None, zoom_start=12,
+                  radius=8, blur=15, max_points=MAX_POINTS):
+    # paths = {group value: output html}; all maps come from one binning pass
+    cells = bin_points(lat, lon, groups)
+    level, factor = level_of_detail(cells, max_points)
+    points = heat_points(level, factor)
+
+    if center is None:
+        center = [np.nanmean(np.asarray(lat, dtype=float)), np.nanmean(np.asarray(lon, dtype=float))]
+    for group, path in paths.items():
+        m = folium.Map(location=center, zoom_start=zoom_start)
+        HeatMap(points.get(group, []), radius=radius, blur=blur).add_to(m)
+        m.save(path)
+    print(f"[HEATMAP] {len(cells):,} cells, level x{factor} ({FINEST_CELL * factor:g} deg), "
+          f"{max(len(p) for p in points.values()) if points else 0:,} points max per map")
+    return points
@@ -1,9 +1,14 @@
 import pandas as pd
 import numpy as np
 import plotly.express as px
-import folium
-from folium.plugins import HeatMap
-from scipy.stats import ttest_ind
+import did
+import heatmaps
+import metrics
+import offenders
+import phases
+import sampler
+import schemas
+import violation_cube
 
 # Datathon business questions:
 
@@ -22,91 +27,78 @@ from scipy.stats import ttest_ind
 # the implementation of congestion pricing?
 
 
-def get_samples():
-    df_violations = pd.read_csv("data/violations.csv")
-    df_speeds_2025 = pd.read_csv("data/speeds_2025.csv")
-    df_speeds_2023_24 = pd.read_csv("data/speeds_2023-24.csv")
-
-    violations_sample = df_violations.sample(frac=0.01,random_state=42)
-    speeds_2025_sample = df_speeds_2025.sample(frac=0.01,random_state=42)
-    speeds_2023_24_sample = df_speeds_2023_24.sample(frac=0.01,random_state=42)
-
-    violations_sample.to_csv("data/violations_sample.csv",index=False)
-    speeds_2025_sample.to_csv("data/speeds_2025_sample.csv",index=False)
-    speeds_2023_24_sample.to_csv("data/speeds_2023_24_sample.csv",index=False)
+@metrics.instrument()
+def get_samples(fractions=sampler.FRACTIONS):
+    # deterministic hash samples, streamed from the store. No per-stratum
+    # top-up (min_rows=0): did.daily_panel and the heatmaps read these as
+    # uniform samples and do not use sample_weight
+    for name in ["violations", "speeds_2025", "speeds_2023-24"]:
+        sampler.write_samples(name, fractions, min_rows=0)
 
 # separates violation sample into before/after congestion policy
 # then plots it
+@metrics.instrument()
 def plot():
 
     cutoff = pd.Timestamp("2025-01-05 00:00:00")
 
-    df = pd.read_csv("data/violations_sample.csv", parse_dates=["first_occurrence"])
+    df = schemas.read("data/violations_sample.csv", "violations")
+    metrics.record(rows_in=len(df))
 
-    df['first_occurrence'] = pd.to_datetime(df['first_occurrence'], unit='s', errors='coerce')
     df_before = df[df['first_occurrence'] < cutoff]
 
     df_after = df[df['first_occurrence'] >= cutoff]
 
-    m = folium.Map(
-        location=[df['violation_latitude'].mean(),df['violation_longitude'].mean()],
-        zoom_start=12
-    )
-
-    l = folium.Map(
-        location=[df['violation_latitude'].mean(),df['violation_longitude'].mean()],
-        zoom_start=12
-    )
-
     df_before.to_csv("data/violations_before_01052025.csv",index=False)
     df_after.to_csv("data/violations_after_01052025.csv",index=False)
+    metrics.record(rows_out=len(df_before) + len(df_after))
 
-    heat_data_m = df_before[['violation_latitude','violation_longitude']].dropna().values.tolist()
-    heat_data_l = df_after[['violation_latitude','violation_longitude']].dropna().values.tolist()
-
-
-    HeatMap(heat_data_m,radius=8,blue=15).add_to(m)
-    HeatMap(heat_data_l,radius=8,blue=15).add_to(l)
-
-    m.save("data/violations__before_heatmap.html")
-    l.save("data/violations__after_heatmap.html")
+    # both maps from one binning pass, size-bounded (see heatmaps.py)
+    period = np.select(
+        [df['first_occurrence'] < cutoff, df['first_occurrence'] >= cutoff], ['before', 'after'], default=None
+    )
+    heatmaps.save_heatmaps(
+        df['violation_latitude'], df['violation_longitude'], period,
+        {'before': "data/violations__before_heatmap.html", 'after': "data/violations__after_heatmap.html"},
+    )
 
 # does a spatial analysis on before/after congestion pricing
-def analyze():
-    df_before = pd.read_csv("data/violations_before_01052025.csv")
-    df_after = pd.read_csv("data/violations_after_01052025.csv")
-    
-    # round to ~1km grid
-    df_before['lat_grid'] = df_before['violation_latitude'].round(3)
-    df_before['lon_grid'] = df_before['violation_longitude'].round(3)
-
-    df_after['lat_grid'] = df_after['violation_latitude'].round(3)
-    df_after['lon_grid'] = df_after['violation_longitude'].round(3)
-
-    grid_before = df_before.groupby(['lat_grid', 'lon_grid']).size().reset_index(name='violations')
-    grid_after = df_after.groupby(['lat_grid', 'lon_grid']).size().reset_index(name='violations')
-
-    grid_comparison = pd.merge(grid_before, grid_after, on=['lat_grid','lon_grid'], how='outer', suffixes=('_before','_after')).fillna(0)
-
-    grid_comparison['diff'] = grid_comparison['violations_after'] - grid_comparison['violations_before']
+# (any cutoff / route subset / status filter, read from the violation cube)
+@metrics.instrument()
+def analyze(cutoff=phases.CBD_START, routes=None, statuses=None, status_contains=None):
+    cube = violation_cube.load_cube()
+    metrics.record(rows_in=len(cube))
+
+    # ~1km grid cells (lat/lon rounded to 3 decimals)
+    grid_comparison = violation_cube.hotspot_diff(
+        cube, cutoff, routes=routes, statuses=statuses, status_contains=status_contains
+    )
 
     # Top 10 hotspot changes in before/after
     top_increase = grid_comparison.sort_values('diff', ascending=True).head(10)
+    metrics.record(rows_out=len(grid_comparison))
     print(top_increase)
 
 # plots the repeat exempt violation offenders' locations
+@metrics.instrument()
 def plot_q2():
-    df_before = pd.read_csv("data/violations_before_01052025.csv")
-    df_after = pd.read_csv("data/violations_after_01052025.csv")
+    df_before = schemas.read("data/violations_before_01052025.csv", "violations")
+    df_after = schemas.read("data/violations_after_01052025.csv", "violations")
+    metrics.record(rows_in=len(df_before) + len(df_after))
 
-    df_before['violation_status'] = df_before['violation_status'].str.upper()
-    df_after['violation_status'] = df_after['violation_status'].str.upper()
+    df_before['violation_status'] = df_before['violation_status'].astype("string").str.upper()
+    df_after['violation_status'] = df_after['violation_status'].astype("string").str.upper()
 
-    exempt_before = df_before[df_before['violation_status'].str.contains("EXEMPT")]
-    exempt_after = df_after[df_after['violation_status'].str.contains("EXEMPT")]
+    exempt_before = df_before[df_before['violation_status'].str.contains("EXEMPT")].copy()
+    exempt_after = df_after[df_after['violation_status'].str.contains("EXEMPT")].copy()
 
-    exempt_before['is_repeat_offender'] = exempt_before['first_occurrence'] != exempt_before['last_occurrence']
-    exempt_after['is_repeat_offender'] = exempt_after['first_occurrence'] != exempt_after['last_occurrence']
+    # repeat offender = lingered (first != last occurrence) or the same vehicle
+    # has more than one exempt violation on the route (offenders.py state)
+    state = offenders.update(offenders.new_state(), pd.concat([exempt_before, exempt_after]))
+    for exempt in [exempt_before, exempt_after]:
+        keys = pd.MultiIndex.from_arrays([exempt['bus_route_id'].astype("string"), exempt['vehicle_id'].astype("string")])
+        seen = state['vehicles']['count'].reindex(keys).fillna(0).to_numpy()
+        exempt['is_repeat_offender'] = (exempt['first_occurrence'] != exempt['last_occurrence']).to_numpy() | (seen > 1)
 
     # repeat exempt violators before congestion pricing
     df_repeat_exempt_before = exempt_before[exempt_before['is_repeat_offender']]
@@ -115,76 +107,43 @@ def plot_q2():
 
     center = [df_before['violation_latitude'].mean(), df_before['violation_longitude'].mean()]
 
-    # heatmap before cutoff
-    m_before = folium.Map(location=center, zoom_start=12)
-    HeatMap(df_repeat_exempt_before[['violation_latitude','violation_longitude']].values.tolist(), radius=8, blur=15).add_to(m_before)
-    m_before.save("data/repeat_heatmap_before.html")
-
-    # heatmap after cutoff
-    m_after = folium.Map(location=center, zoom_start=12)
-    HeatMap(df_repeat_exempt_after[['violation_latitude','violation_longitude']].values.tolist(), radius=8, blur=15).add_to(m_after)
-    m_after.save("data/repeat_heatmap_after.html")
+    # heatmaps before/after cutoff, from one shared binning pass
+    repeat = pd.concat([df_repeat_exempt_before, df_repeat_exempt_after], keys=['before', 'after'])
+    metrics.record(rows_out=len(repeat))
+    heatmaps.save_heatmaps(
+        repeat['violation_latitude'], repeat['violation_longitude'], repeat.index.get_level_values(0),
+        {'before': "data/repeat_heatmap_before.html", 'after': "data/repeat_heatmap_after.html"},
+        center=center,
+    )
 
-def DiD():
-    df = pd.read_csv("data/violations_sample.csv")
-    bus_routes = pd.read_csv("data/data.csv")
+@metrics.instrument(rows_out=lambda result: len(result[1]))
+def DiD(method="bootstrap"):
+    df = schemas.read("data/violations_sample.csv", "violations")
+    metrics.record(rows_in=len(df))
 
-    # converts bus route - implementation date dataframe to a dictionary
-    bus_implementation = bus_routes.set_index('route')['implementation_date'].to_dict()
+    # bus route -> ACE implementation date
+    bus_implementation = phases.implementation_dates("data/data.csv")
 
-    # converts to datetime
-    df['first_occurrence'] = pd.to_datetime(df['first_occurrence'])
-    bus_implementation = {k: pd.to_datetime(v) for k, v in bus_implementation.items()}
+    # route x day violation counts, built in one pass
+    panel = did.daily_panel(df['first_occurrence'], df['bus_route_id'])
 
+    # treated = has camera enforcement on route
+    treated = panel.index.isin(bus_implementation.index)
 
-    df['timeframe'] = df.apply(
-        lambda row: 'before' if row['first_occurrence'] < bus_implementation.get(row['bus_route_id'], pd.Timestamp.max) else 'after',
-        axis=1
-    )
+    # cbd = congestion pricing policy
+    cutoff = phases.CBD_START
 
-    # treated = has camera enforcement on route
-    df['treated'] = df['bus_route_id'].isin(bus_implementation.keys())
+    pooled = did.pooled_did(panel, treated, cutoff, method=method)
+    print("DiD estimate (effect of cameras):", pooled["effect"])
+    print("95% CI:", (pooled["ci_low"], pooled["ci_high"]))
+    print("P-value:", pooled["p_value"])
 
-    cutoff = pd.Timestamp("2025-01-05 00:00:00")
+    # every ACE route against its own implementation date, non-ACE routes as controls
+    effects = did.route_effects(panel, bus_implementation, method=method)
+    print(effects.to_string(index=False))
+    print(did.event_study(panel, bus_implementation).to_string(index=False))
+    return pooled, effects
 
-    # cbd = congestion pricing policy
-    df['is_after'] = df['first_occurrence'] >= cutoff
-    df['is_after'] = df['first_occurrence'] >= cutoff
-
-    treated_before = df[(df['treated']) & (~df['is_after'])]
-    treated_after  = df[(df['treated']) & (df['is_after'])]
-
-    control_before = df[(~df['treated']) & (~df['is_after'])]
-    control_after  = df[(~df['treated']) & (df['is_after'])]
-
-    tb_daily = treated_before.groupby(treated_before['first_occurrence'].dt.date).size()
-    ta_daily = treated_after.groupby(treated_after['first_occurrence'].dt.date).size()
-    cb_daily = control_before.groupby(control_before['first_occurrence'].dt.date).size()
-    ca_daily = control_after.groupby(control_after['first_occurrence'].dt.date).size()
-
-    # Means
-    tb_mean = tb_daily.mean()
-    ta_mean = ta_daily.mean()
-    cb_mean = cb_daily.mean()
-    ca_mean = ca_daily.mean()
-
-    treated_change = ta_daily.values - tb_daily.values[:len(ta_daily)]  # align lengths if needed
-    control_change = ca_daily.values - cb_daily.values[:len(ca_daily)]
-
-    DiD = (ta_mean - tb_mean) - (ca_mean - cb_mean)
-
-    print("DiD estimate (effect of cameras):", DiD)
-    t_stat, p_value = ttest_ind(treated_change, control_change, equal_var=False)
-    print("T-statistic:", t_stat)
-    print("P-value:", p_value)
-
-    # This DiD and T-test reported an increase of 60 violations on
-    # average per day when going from before the congestion policy enforcement
-    # This was calculated at a p-value = 1e-114 << 0.05, so this is statistically
-    # significant to conclude that there was an increase in violations
-    # after the ACE camera enforcement. Maybe just due to the increase
-    # cameras, more violations were reported, which means there would be
-    # survivorship bias.
 
 if __name__ == "__main__":
     DiD()
@@ -0,0 +1,239 @@
+from contextlib import contextmanager
+from pathlib import Path
+import argparse
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+import psutil
+
+# Stage instrumentation. Every entry point runs inside a span that records
+# wall time, CPU time (this process and waited-for children), peak RSS of
+# the process tree, bytes read and the rows the stage says it took in and
+# wrote out; finished spans are appended to SPANS_PATH as one JSON object
+# per line. Spans nest, so a span knows the stage it ran under. CPU, memory
+# and I/O are process-wide: spans running side by side on threads of one
+# process see each other's work.
+#
+#   @metrics.instrument()                       # or instrument("name")
+#   def stage(...):
+#       df = ...
+#       metrics.record(rows_in=len(df))
+#
+#   with metrics.span("scripts/02") as s:
+#       ...
+#       s["rows_out"] = len(out)
+#
+# `python metrics.py serve` exposes the latest span per stage to Prometheus;
+# `python metrics.py summary` prints it.
+
+SPANS_PATH = Path(os.environ.get("METRICS_PATH", "data/.metrics/spans.jsonl"))
+PORT = 9108
+
+# RSS is polled this often while a span is open
+SAMPLE_INTERVAL = 0.05
+
+_current = contextvars.ContextVar("metrics_span", default=None)
+_write_lock = threading.Lock()
+
+
+def tree_rss(proc):
+    # RSS of a process and all of its children, in bytes
+    try:
+        procs = [proc] + proc.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return 0
+    total = 0
+    for p in procs:
+        try:
+            total += p.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+
+def _cpu(proc):
+    t = proc.cpu_times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _bytes_read(proc):
+    # read_chars counts every read() (page cache included); not available
+    # on every platform
+    try:
+        io = proc.io_counters()
+    except (AttributeError, psutil.AccessDenied, NotImplementedError):
+        return None
+    return getattr(io, "read_chars", io.read_bytes)
+
+
+def _watch_rss(proc, peak, stop):
+    while not stop.wait(SAMPLE_INTERVAL):
+        peak[0] = max(peak[0], tree_rss(proc))
+
+
+def record(**values):
+    # set or add to fields of the innermost open span (rows_in, rows_out,
+    # or anything else worth keeping); a no-op outside a span
+    s = _current.get()
+    if s is None:
+        return
+    for k, v in values.items():
+        if k in ("rows_in", "rows_out") and s.get(k) is not None:
+            s[k] += v
+        else:
+            s[k] = v
+
+
+def write(span, path=None):
+    path = Path(path or SPANS_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    line = json.dumps(span, default=str)
+    with _write_lock, open(path, "a") as f:
+        f.write(line + "\n")
+
+
+@contextmanager
+def span(name, path=None, **attrs):
+    parent = _current.get()
+    proc = psutil.Process()
+    s = {"name": name, "parent": parent["name"] if parent else None, "pid": os.getpid(),
+         "start": time.strftime("%Y-%m-%dT%H:%M:%S"), **attrs}
+    token = _current.set(s)
+
+    peak, stop = [tree_rss(proc)], threading.Event()
+    watcher = threading.Thread(target=_watch_rss, args=(proc, peak, stop), daemon=True)
+    watcher.start()
+    cpu0, read0, t0 = _cpu(proc), _bytes_read(proc), time.perf_counter()
+    status = "ok"
+    try:
+        yield s
+    except BaseException as e:
+        status = "error"
+        s["error"] = repr(e)
+        raise
+    finally:
+        wall = time.perf_counter() - t0
+        stop.set()
+        watcher.join()
+        read1 = _bytes_read(proc)
+        _current.reset(token)
+        s["status"] = status
+        s["wall_s"] = round(wall, 4)
+        s["cpu_s"] = round(_cpu(proc) - cpu0, 4)
+        s["peak_rss_mb"] = round(max(peak[0], tree_rss(proc)) / 2**20, 1)
+        if read0 is not None and read1 is not None:
+            s.setdefault("bytes_read", read1 - read0)
+        write(s, path)
+
+
+def _rows(result):
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return len(result)
+    return None
+
+
+def instrument(name=None, rows_out=_rows):
+    # decorator: the call runs in a span named module.function; rows_out maps
+    # the return value to a row count (DataFrames/Series by default)
+    def wrap(fn):
+        label = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with span(label) as s:
+                result = fn(*args, **kwargs)
+                if s.get("rows_out") is None:
+                    n = rows_out(result)
+                    if n is not None:
+                        s["rows_out"] = n
+                return result
+        return inner
+    return wrap
+
+
+def read_spans(path=None):
+    path = Path(path or SPANS_PATH)
+    if not path.exists():
+        return pd.DataFrame()
+    return pd.read_json(path, lines=True)
+
+
+def summary(path=None):
+    # latest span per stage, plus how many times each stage has run
+    spans = read_spans(path)
+    if spans.empty:
+        return spans
+    runs = spans.groupby("name").size().rename("runs")
+    latest = spans.groupby("name").tail(1).set_index("name")
+    cols = [c for c in ["start", "status", "wall_s", "cpu_s", "peak_rss_mb", "rows_in", "rows_out", "bytes_read"]
+            if c in latest]
+    return latest[cols].join(runs).sort_values("start")
+
+
+_FIELDS = {
+    "wall_s": ("stage_wall_seconds", "Wall time of the stage's last run"),
+    "cpu_s": ("stage_cpu_seconds", "CPU time of the stage's last run"),
+    "peak_rss_mb": ("stage_peak_rss_megabytes", "Peak RSS of the stage's last run"),
+    "rows_in": ("stage_rows_in", "Rows read by the stage's last run"),
+    "rows_out": ("stage_rows_out", "Rows written by the stage's last run"),
+    "bytes_read": ("stage_bytes_read", "Bytes read by the stage's last run"),
+}
+
+
+def _collect(path):
+    from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+
+    spans = read_spans(path)
+    if spans.empty:
+        return
+    latest = spans.groupby("name").tail(1)
+    for field, (metric, doc) in _FIELDS.items():
+        if field not in latest:
+            continue
+        g = GaugeMetricFamily(metric, doc, labels=["stage"])
+        for name, v in zip(latest["name"], latest[field]):
+            if pd.notna(v):
+                g.add_metric([name], float(v))
+        yield g
+    runs = CounterMetricFamily("stage_runs", "Finished stage runs", labels=["stage", "status"])
+    for (name, status), n in spans.groupby(["name", "status"]).size().items():
+        runs.add_metric([name, status], n)
+    yield runs
+
+
+class _SpansCollector:
+    # prometheus_client registers collectors as objects with collect()
+    def __init__(self, path):
+        self.path = path
+
+    def collect(self):
+        return _collect(self.path)
+
+
+def serve(port=PORT, path=None):
+    # Prometheus endpoint over the spans file, so stages running in other
+    # processes (pipeline workers, cron jobs) show up too; each scrape
+    # re-reads the file
+    from prometheus_client import REGISTRY, start_http_server
+
+    REGISTRY.register(_SpansCollector(path))
+    start_http_server(port)
+    print(f"[INFO] Serving stage metrics from {Path(path or SPANS_PATH)} on :{port}/metrics")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stage timings, memory and row counts from the spans file")
+    parser.add_argument("command", choices=["summary", "serve"])
+    parser.add_argument("--path", default=SPANS_PATH)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+    if args.command == "summary":
+        print(summary(args.path).to_string())
+    else:
+        serve(args.port, args.path)
+        threading.Event().wait()
@@ -0,0 +1,249 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import argparse
+import json
+import os
+import storage
+
+# Streaming repeat-offender tracker. Violations are folded in batch by batch;
+# only the batch is sorted, and its rows are chained onto the stored state
+# of each route x vehicle (count, first/last seen, sum of gaps, a coarse
+# inter-arrival histogram). Per route, inter-arrival times also go into a
+# log-spaced sketch (1% relative error) for medians / P90s. Top chronic plates
+# per route and per stop are kept in fixed-size Space-Saving summaries, so
+# the stop level costs TOP_K entries per stop however many plates pass by.
+
+STATE_DIR = Path("data/offenders")
+
+# column names per schema: OData pulls (violations) and data_raw CSVs
+COLUMNS = {
+    "violations": {"route": "bus_route_id", "stop": "stop_name", "vehicle": "vehicle_id",
+                   "time": "first_occurrence", "status": "violation_status", "key": "violation_id"},
+    "violations_raw": {"route": "Bus Route ID", "stop": "Stop Name", "vehicle": "Vehicle ID",
+                       "time": "First Occurrence", "status": "Violation Status", "key": "Violation ID"},
+}
+
+# plates kept per route / per stop
+TOP_K = 100
+
+# per-vehicle inter-arrival histogram (days)
+GAP_EDGES = [0, 1 / 24, 1, 7, 30, 90, 365, np.inf]
+GAP_LABELS = ["<1h", "1h-1d", "1d-1w", "1w-30d", "30-90d", "90-365d", ">365d"]
+HIST = [f"gaps_{label}" for label in GAP_LABELS]
+
+# per-route inter-arrival sketch
+ACCURACY = 0.01
+GAMMA = (1 + ACCURACY) / (1 - ACCURACY)
+MIN_GAP_DAYS = 1 / 1440
+
+VEHICLE_KEYS = ["route", "vehicle"]
+
+
+def new_state():
+    vehicles = pd.DataFrame(
+        {"count": pd.Series(dtype="int64"), "first_seen": pd.Series(dtype="datetime64[ns]"),
+         "last_seen": pd.Series(dtype="datetime64[ns]"), "gap_sum": pd.Series(dtype="float64"),
+         **{h: pd.Series(dtype="int64") for h in HIST}},
+        index=pd.MultiIndex.from_arrays([[], []], names=VEHICLE_KEYS),
+    )
+    return {
+        "vehicles": vehicles,
+        "gaps": pd.DataFrame({"route": pd.Series(dtype="string"), "bin": pd.Series(dtype="int16"),
+                              "n": pd.Series(dtype="int64")}),
+        "top": pd.DataFrame({"scope": pd.Series(dtype="string"), "key": pd.Series(dtype="string"),
+                             "vehicle": pd.Series(dtype="string"), "count": pd.Series(dtype="int64"),
+                             "error": pd.Series(dtype="int64")}),
+        "high_water": None,
+        # ids of the folded rows sitting on the high-water mark
+        "boundary_keys": [],
+        "rows": 0,
+    }
+
+
+def _gap_bin(days):
+    return np.ceil(np.log(np.maximum(days, MIN_GAP_DAYS)) / np.log(GAMMA)).astype(np.int16)
+
+
+def _merge_top(top, counts, top_k):
+    # Space-Saving merge: a plate missing from a full summary may have had up
+    # to that summary's smallest count, so it is credited that much (and the
+    # same amount of error); then each scope/key keeps its top_k plates.
+    # Batch counts are exact, so only the stored side needs the floor.
+    groups = top.groupby(["scope", "key"], observed=True)["count"]
+    floor = groups.min().where(groups.size() >= top_k, 0).rename("floor")
+    merged = top.merge(counts, on=["scope", "key", "vehicle"], how="outer", suffixes=("", "_new"))
+    merged = merged.merge(floor.reset_index(), on=["scope", "key"], how="left")
+    floor = merged["floor"].fillna(0)
+    missing = merged["count"].isna()
+    merged["count"] = merged["count"].fillna(floor) + merged["count_new"].fillna(0)
+    merged["error"] = merged["error"].where(~missing, floor)
+    merged = merged.sort_values(["scope", "key", "count"], ascending=[True, True, False], kind="stable")
+    merged = merged.groupby(["scope", "key"], observed=True, sort=False).head(top_k)
+    return merged[["scope", "key", "vehicle", "count", "error"]].astype({"count": "int64", "error": "int64"})
+
+
+def update(state, batch, columns=COLUMNS["violations"], top_k=TOP_K):
+    # fold a batch of violations into state; rows are expected roughly in
+    # time order across batches, and a row older than its vehicle's last
+    # stored violation is counted but adds no gap
+    c = columns
+    b = pd.DataFrame({
+        "route": batch[c["route"]].astype("string").to_numpy(),
+        "stop": batch[c["stop"]].astype("string").to_numpy(),
+        "vehicle": batch[c["vehicle"]].astype("string").to_numpy(),
+        "time": pd.to_datetime(batch[c["time"]], errors="coerce").to_numpy(),
+        "key": (storage.row_keys(batch, [c["key"]]).to_numpy() if c.get("key") in batch
+                else np.full(len(batch), None, dtype=object)),
+    }).dropna(subset=["route", "vehicle", "time"])
+    if b.empty:
+        return state
+    b = b.sort_values(VEHICLE_KEYS + ["time"], kind="stable", ignore_index=True)
+
+    # previous violation of the same route/vehicle: earlier in the batch, or
+    # the stored last_seen for the first row of each run
+    vehicles = state["vehicles"]
+    starts = ((b["route"] != b["route"].shift()) | (b["vehicle"] != b["vehicle"].shift())).to_numpy()
+    prev = b["time"].shift().to_numpy()
+    run_keys = pd.MultiIndex.from_frame(b.loc[starts, VEHICLE_KEYS])
+    prev[starts] = vehicles["last_seen"].reindex(run_keys).to_numpy()
+    gap = (b["time"].to_numpy() - prev) / np.timedelta64(1, "D")
+    gap = np.where(gap >= 0, gap, np.nan)
+
+    run = np.cumsum(starts) - 1
+    has_gap = ~np.isnan(gap)
+    hist = np.zeros((starts.sum(), len(HIST)), dtype=np.int64)
+    np.add.at(hist, (run[has_gap], np.digitize(gap[has_gap], GAP_EDGES[1:-1])), 1)
+    times = b["time"].to_numpy()
+    delta = pd.DataFrame({
+        "count": np.bincount(run),
+        "first_seen": times[starts],
+        "last_seen": np.maximum.reduceat(times.astype(np.int64), np.flatnonzero(starts)).astype("datetime64[ns]"),
+        "gap_sum": np.bincount(run, weights=np.nan_to_num(gap)),
+        **dict(zip(HIST, hist.T)),
+    }, index=run_keys)
+
+    both = pd.concat([vehicles, delta])
+    grouped = both.groupby(level=VEHICLE_KEYS, sort=False)
+    vehicles = grouped[["count", "gap_sum"] + HIST].sum()
+    vehicles.insert(1, "first_seen", grouped["first_seen"].min())
+    vehicles.insert(2, "last_seen", grouped["last_seen"].max())
+
+    gaps = pd.DataFrame({"route": b["route"][has_gap], "bin": _gap_bin(gap[has_gap]), "n": 1})
+    gaps = pd.concat([state["gaps"], gaps]).groupby(["route", "bin"], sort=False)["n"].sum().reset_index()
+
+    counts = pd.concat([
+        b.groupby(["route", "vehicle"], sort=False).size().rename_axis(["key", "vehicle"]).reset_index(name="count_new").assign(scope="route"),
+        b.dropna(subset=["stop"]).groupby(["stop", "vehicle"], sort=False).size().rename_axis(["key", "vehicle"]).reset_index(name="count_new").assign(scope="stop"),
+    ])
+    top = _merge_top(state["top"], counts, top_k)
+
+    # the mark moves to the latest row; the ids of rows on it are kept so a
+    # refresh from the mark (>=) skips them
+    latest = pd.Timestamp(times.max())
+    high_water, boundary = state["high_water"], set(state.get("boundary_keys", []))
+    if high_water is None or latest > pd.Timestamp(high_water):
+        high_water, boundary = latest.isoformat(), set()
+    if b["key"].notna().any() and latest == pd.Timestamp(high_water):
+        boundary |= set(b.loc[b["time"] == latest, "key"].dropna())
+    return {"vehicles": vehicles, "gaps": gaps, "top": top, "high_water": high_water,
+            "boundary_keys": sorted(boundary), "rows": state["rows"] + len(b)}
+
+
+def load_state(state_dir=STATE_DIR):
+    state_dir = Path(state_dir)
+    if not (state_dir / "state.json").exists():
+        return new_state()
+    with open(state_dir / "state.json") as f:
+        state = json.load(f)
+    for part in ["vehicles", "gaps", "top"]:
+        state[part] = pd.read_parquet(state_dir / f"{part}.parquet")
+    return state
+
+
+def save_state(state, state_dir=STATE_DIR):
+    # tables first, state.json (high-water mark) last, each written then renamed
+    state_dir = Path(state_dir)
+    state_dir.mkdir(parents=True, exist_ok=True)
+    for part in ["vehicles", "gaps", "top"]:
+        tmp = state_dir / f"{part}.parquet.tmp"
+        state[part].to_parquet(tmp)
+        os.replace(tmp, state_dir / f"{part}.parquet")
+    tmp = state_dir / "state.json.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"high_water": state["high_water"], "boundary_keys": state.get("boundary_keys", []),
+                   "rows": state["rows"]}, f)
+    os.replace(tmp, state_dir / "state.json")
+
+
+def refresh(name="violations", exempt_only=True, state_dir=STATE_DIR):
+    # fold in the store rows from the high-water mark on, one month at a
+    # time; rows on the mark whose ids were already folded in are skipped
+    state = load_state(state_dir)
+    c = COLUMNS[name]
+    high_water = pd.Timestamp(state["high_water"]) if state["high_water"] else None
+    months = sorted({f.parent.name.split("=", 1)[1] for f in storage.store_path(name).rglob("*.parquet")})
+    if high_water is not None:
+        months = [m for m in months if m >= high_water.strftime("%Y-%m")]
+
+    for month in months:
+        start = pd.Timestamp(month + "-01")
+        df = storage.load(name, columns=[c[k] for k in ["route", "stop", "vehicle", "time", "status", "key"]],
+                          start=start, end=start + pd.offsets.MonthBegin())
+        if high_water is not None:
+            seen = set(state.get("boundary_keys", []))
+            on = (df[c["time"]] == high_water).to_numpy()
+            on[on] = storage.row_keys(df[on], [c["key"]]).isin(seen).to_numpy()
+            df = df[(df[c["time"]] >= high_water).to_numpy() & ~on]
+        if exempt_only:
+            df = df[df[c["status"]].astype("string").str.upper().str.contains("EXEMPT", na=False)]
+        state = update(state, df, c)
+        save_state(state, state_dir)
+        print(f"[OFFENDERS] {month}: +{len(df):,} rows, {len(state['vehicles']):,} route/vehicle pairs")
+    return state
+
+
+def repeat_buckets(state, route):
+    # violations per vehicle on one route, bucketed like the Q2 notebook
+    counts = state["vehicles"].xs(route, level="route")["count"]
+    labels = ["=1", "2-5", "6-10", "11-25", "26-50", ">50"]
+    cats = pd.cut(counts, bins=[0, 1, 5, 10, 25, 50, 10**9], labels=labels)
+    dist = cats.value_counts().reindex(labels).fillna(0).astype(int)
+    return pd.DataFrame({"count": dist, "pct": (dist / dist.sum() * 100).round(2)})
+
+
+def interarrival(state, quantiles=(0.5, 0.75, 0.9)):
+    # per route: days between consecutive violations of the same vehicle
+    v = state["vehicles"]
+    intervals = v[HIST].sum(axis=1).groupby(level="route").sum()
+    per_route = pd.DataFrame({
+        "n_intervals": intervals,
+        "mean_days_between": v["gap_sum"].groupby(level="route").sum() / intervals,
+        "n_repeat_vehicles": (v["count"] > 1).groupby(level="route").sum(),
+    })
+
+    g = state["gaps"].sort_values(["route", "bin"], ignore_index=True)
+    cum = g.groupby("route", sort=False)["n"].cumsum()
+    total = g["route"].map(g.groupby("route")["n"].sum())
+    for q in quantiles:
+        first = g[cum >= q * total].groupby("route").first()["bin"]
+        per_route[f"p{round(q * 100):g}_days_between"] = 2 * GAMMA ** first.astype(float) / (GAMMA + 1)
+    return per_route.reset_index()
+
+
+def top_offenders(state, scope="route", key=None, n=10):
+    # chronic plates from the Space-Saving summaries; count may overstate the
+    # true count by at most error (0 when the plate was never evicted)
+    top = state["top"][state["top"]["scope"] == scope]
+    if key is not None:
+        top = top[top["key"] == key]
+    return top.groupby("key", sort=False).head(n).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fold new exempt violations into the repeat-offender state")
+    parser.add_argument("--feed", default="violations", choices=list(COLUMNS))
+    parser.add_argument("--all-statuses", action="store_true", help="track every violation, not only exempt ones")
+    args = parser.parse_args()
+    state = refresh(args.feed, exempt_only=not args.all_statuses)
+    print(interarrival(state).round(2).to_string(index=False))
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import schemas
+
+# Vectorized policy-phase labeling shared by scripts/02, main.DiD and the
+# speeds notebooks. Every function labels whole columns at once: route start
+# dates are looked up through categorical codes and phases come from
+# comparing against (or searchsorted over) the phase boundaries, so there
+# is no per-row Python call.
+
+ROUTES_PATH = "data/data.csv"
+
+# ACE announcement date used as the single phase start in the speeds notebooks
+ACE_ANNOUNCE = pd.Timestamp("2024-06-17")
+
+# length of the ACE warning period (no fines yet)
+WARNING_DAYS = 60
+# congestion pricing start
+CBD_START = pd.Timestamp("2025-01-05")
+
+# notebook phases, in time order
+PHASES = ["Pre-ACE", "ACE Warning (skip)", "ACE only", "ACE + CBD"]
+# scripts/02 ace_status values, in time order
+ACE_STATUS = ["pre_ace", "warning", "post_ace"]
+
+
+def implementation_dates(path=ROUTES_PATH, program="ACE"):
+    # route -> implementation date, from data/data.csv or the raw
+    # "Automated Camera Enforced Routes" export (same columns, title case)
+    if not isinstance(path, pd.DataFrame):
+        header = pd.read_csv(path, nrows=0).columns
+        path = schemas.read(path, "ace_routes" if "route" in header else "ace_routes_raw")
+    routes = path
+    routes = routes.rename(columns=lambda c: c.strip().lower().replace(" ", "_"))
+    if program is not None:
+        routes = routes[routes["program"] == program]
+    dates = pd.to_datetime(routes["implementation_date"], format="mixed", errors="coerce")
+    # a route listed twice keeps its latest entry, like set_index().to_dict()
+    return pd.Series(dates.values, index=routes["route"].values).groupby(level=0, observed=True).last()
+
+
+def route_starts(routes, dates, default=None):
+    # per-row start date for a column of routes; routes missing from dates
+    # get default (NaT if None)
+    routes = pd.Categorical(routes)
+    lookup = pd.Series(dates).reindex(routes.categories)
+    if default is not None:
+        lookup = lookup.fillna(pd.Timestamp(default))
+    lookup = np.append(lookup.to_numpy(dtype="datetime64[ns]"), np.datetime64("NaT", "ns"))
+    # code -1 (missing route) indexes the trailing NaT
+    return lookup[routes.codes]
+
+
+def _as_datetime64(values):
+    if isinstance(values, np.ndarray) and values.dtype == "datetime64[ns]":
+        return values
+    return pd.to_datetime(values, errors="coerce").to_numpy(dtype="datetime64[ns]")
+
+
+def _categorical(codes, labels, missing):
+    codes = np.where(missing, -1, codes)
+    return pd.Categorical.from_codes(codes, categories=labels, ordered=True)
+
+
+def phase_label(times, starts, warning_days=WARNING_DAYS, cbd_start=CBD_START):
+    # Pre-ACE < start <= ACE Warning < start + warning_days <= ACE only
+    # < cbd_start <= ACE + CBD
+    # starts is one date for every row (notebook style) or a per-row array
+    # from route_starts(); rows with no time or no start are left missing
+    t = _as_datetime64(times)
+    cbd = np.datetime64(pd.Timestamp(cbd_start), "ns")
+    warn = np.timedelta64(warning_days, "D")
+
+    if np.ndim(starts) == 0:
+        start = np.datetime64(pd.Timestamp(starts), "ns")
+        bounds = np.array([start, start + warn, max(start + warn, cbd)])
+        codes = np.searchsorted(bounds, t, side="right")
+        missing = np.isnat(t)
+    else:
+        start = _as_datetime64(starts)
+        fine = start + warn
+        codes = (t >= start).astype(np.int8) + (t >= fine) + (t >= np.maximum(fine, cbd))
+        missing = np.isnat(t) | np.isnat(start)
+
+    return _categorical(codes, PHASES, missing)
+
+
+def ace_status(times, starts, warning_days=WARNING_DAYS):
+    # day-level status used by scripts/02: pre_ace before the start date,
+    # warning for the first warning_days days, post_ace after, and no_ace
+    # for routes without a start date
+    days = _as_datetime64(times).astype("datetime64[D]")
+    start = _as_datetime64(starts).astype("datetime64[D]")
+    codes = (days >= start).astype(np.int8) + (days >= start + np.timedelta64(warning_days, "D"))
+    codes = np.where(np.isnat(start), len(ACE_STATUS), codes)
+    return _categorical(codes, ACE_STATUS + ["no_ace"], np.isnat(days) & ~np.isnat(start))
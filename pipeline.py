@@ -0,0 +1,342 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+import argparse
+import ast
+import hashlib
+import importlib
+import importlib.util
+import json
+import os
+import runpy
+import sys
+import time
+
+# Pipeline runner for the analysis stages. Every stage declares what it
+# runs, the files it reads and writes, and its parameters. A stage is
+# skipped when the content hashes of its inputs, its source file plus every
+# repo module it imports (directly or not), and its parameters match the
+# last successful run and its outputs are still there; otherwise it
+# reruns, and stages downstream rerun only if its outputs actually
+# changed. Stages whose inputs are ready run in parallel, each in a fresh
+# worker process, so the violations and speeds branches overlap.
+# A stage depends on every stage that writes one of its inputs.
+
+STATE_PATH = Path("data/.pipeline/state.json")
+# stage modules and scripts import their siblings from here
+REPO_DIR = Path(__file__).resolve().parent
+
+# feeds converted into the route/month store (see storage.FEEDS)
+_STORE_FEEDS = {
+    "violations": ["data/violations"],
+    "speeds_2025": ["data/speeds_2025"],
+    "speeds_2023-24": ["data/speeds_2023-24"],
+    "speeds_raw": [
+        "data_raw/MTA_Bus_Route_Segment_Speeds__2023_-_2024_20250921.csv",
+        "data_raw/MTA_Bus_Route_Segment_Speeds__Beginning_2025_20250919.csv",
+    ],
+    "violations_raw": ["data_raw/MTA_Bus_Automated_Camera_Enforcement_Violations__Beginning_October_2019_20250919.csv"],
+}
+
+# run = (module, function) or (script path, None); params are passed as
+# keyword arguments to functions and as command-line flags to scripts
+STAGES = {
+    **{
+        f"store.{name}": {
+            "run": ("storage", "build_store"),
+            "inputs": source,
+            "outputs": [f"data/store/{name}"],
+            "params": {"name": name},
+        }
+        for name, source in _STORE_FEEDS.items()
+    },
+    "get_samples": {
+        "run": ("main", "get_samples"),
+        "inputs": ["data/store/violations", "data/store/speeds_2025", "data/store/speeds_2023-24"],
+        "outputs": ["data/violations_sample.csv", "data/speeds_2025_sample.csv", "data/speeds_2023_24_sample.csv"],
+    },
+    "plot": {
+        "run": ("main", "plot"),
+        "inputs": ["data/violations_sample.csv"],
+        "outputs": ["data/violations_before_01052025.csv", "data/violations_after_01052025.csv",
+                    "data/violations__before_heatmap.html", "data/violations__after_heatmap.html"],
+    },
+    "violation_cube": {
+        "run": ("violation_cube", "build_cube"),
+        "inputs": ["data/store/violations"],
+        "outputs": ["data/cube/violations.parquet"],
+    },
+    "analyze": {
+        "run": ("main", "analyze"),
+        "inputs": ["data/cube/violations.parquet"],
+        "outputs": [],
+        "params": {"cutoff": "2025-01-05"},
+    },
+    "plot_q2": {
+        "run": ("main", "plot_q2"),
+        "inputs": ["data/violations_before_01052025.csv", "data/violations_after_01052025.csv"],
+        "outputs": ["data/repeat_heatmap_before.html", "data/repeat_heatmap_after.html"],
+    },
+    "DiD": {
+        "run": ("main", "DiD"),
+        "inputs": ["data/violations_sample.csv", "data/data.csv"],
+        "outputs": [],
+        "params": {"method": "bootstrap"},
+    },
+    "trips": {
+        "run": ("trips", "build_runs"),
+        "inputs": ["data/store/speeds_2025"],
+        "outputs": ["data/trips/runs.parquet", "data/trips/routes.parquet"],
+    },
+    "segment_join": {
+        "run": ("segment_join", "build"),
+        "inputs": ["data/store/violations", "data/store/speeds_2025"],
+        "outputs": ["data/segments/segment_hours.parquet", "data/segments/load_vs_speed.parquet"],
+    },
+    "reliability": {
+        "run": ("reliability", "update"),
+        "inputs": ["data/store/speeds_2025", "data/trips/runs.parquet", "data/data.csv"],
+        "outputs": [f"data/reliability/{level}_{window}.parquet"
+                    for level in ["route", "corridor", "wait"] for window in ["daily", "weekly", "28d"]],
+    },
+    "scripts/01": {
+        "run": ("scripts/01_filter_hunter_routes.py", None),
+        "inputs": ["data/store/speeds_raw"],
+        "outputs": ["data_work/hunter_speeds_filtered.parquet"],
+    },
+    "scripts/02": {
+        "run": ("scripts/02_label_ace_status.py", None),
+        "inputs": ["data_work/hunter_speeds_filtered.parquet",
+                   "data_raw/MTA_Bus_Automated_Camera_Enforced_Routes__Beginning_October_2019_20250921.csv"],
+        "outputs": ["data_work/hunter_speeds_ace_labeled.parquet"],
+    },
+    "scripts/03": {
+        "run": ("scripts/03_clean_violations.py", None),
+        "inputs": ["data/store/violations_raw"],
+        "outputs": ["data_work/violations_routes_filtered.parquet"],
+    },
+    "features/speeds": {
+        "run": ("features", "build"),
+        "params": {"name": "speeds"},
+        "inputs": ["data_work/hunter_speeds_ace_labeled.parquet"],
+        "outputs": ["data/features/speeds-hunter_speeds_ace_labeled.arrow"],
+    },
+    "features/violations": {
+        "run": ("features", "build"),
+        "params": {"name": "violations"},
+        "inputs": ["data_work/violations_routes_filtered.parquet"],
+        "outputs": ["data/features/violations-violations_routes_filtered.arrow"],
+    },
+}
+
+
+def _covers(output, path):
+    # an output directory covers every path under it
+    return path == output or path.startswith(output.rstrip("/") + "/")
+
+
+def upstream(stages=STAGES):
+    # stage -> stages that write one of its inputs
+    return {
+        name: sorted({other for other, o in stages.items() if other != name
+                      for out in o["outputs"] for path in s["inputs"] if _covers(out, path)})
+        for name, s in stages.items()
+    }
+
+
+def with_upstream(targets, stages=STAGES):
+    deps = upstream(stages)
+    todo, keep = list(targets), set()
+    while todo:
+        name = todo.pop()
+        if name not in keep:
+            keep.add(name)
+            todo.extend(deps[name])
+    return keep
+
+
+def load_state(path=STATE_PATH):
+    path = Path(path)
+    if not path.exists():
+        return {"stages": {}, "files": {}}
+    return json.loads(path.read_text())
+
+
+def save_state(state, path=STATE_PATH):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(state, indent=1, sort_keys=True))
+    os.replace(tmp, path)
+
+
+def file_hash(path, cache):
+    # sha256 of the bytes; reused from the cache while size and mtime match
+    st = path.stat()
+    key = str(path)
+    hit = cache.get(key)
+    if hit is not None and hit[0] == st.st_size and hit[1] == st.st_mtime_ns:
+        return hit[2]
+    with open(path, "rb") as f:
+        digest = hashlib.file_digest(f, "sha256").hexdigest()
+    cache[key] = [st.st_size, st.st_mtime_ns, digest]
+    return digest
+
+
+def path_hash(path, cache):
+    # a file, or a directory as the hash of its files' relative paths and
+    # hashes; None if missing
+    path = Path(path)
+    if path.is_file():
+        return file_hash(path, cache)
+    if not path.is_dir():
+        return None
+    h = hashlib.sha256()
+    for f in sorted(p for p in path.rglob("*") if p.is_file() and not p.name.endswith(".tmp")):
+        h.update(f.relative_to(path).as_posix().encode())
+        h.update(file_hash(f, cache).encode())
+    return h.hexdigest()
+
+
+def _source(stage):
+    target, func = stage["run"]
+    return Path(target if func is None else importlib.util.find_spec(target).origin)
+
+
+def local_imports(path, repo_dir=REPO_DIR):
+    # repo modules a source file imports, followed transitively; found from
+    # the import statements, nothing is executed
+    seen, todo = set(), [Path(path).resolve()]
+    while todo:
+        f = todo.pop()
+        if f in seen:
+            continue
+        seen.add(f)
+        for node in ast.walk(ast.parse(f.read_text(), filename=str(f))):
+            if isinstance(node, ast.Import):
+                names = [a.name for a in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module = repo_dir / f"{name.split('.')[0]}.py"
+                if module.exists():
+                    todo.append(module.resolve())
+    return sorted(seen)
+
+
+def stage_key(stage, cache):
+    # everything a stage's result depends on, as one hash
+    inputs = {p: path_hash(p, cache) for p in stage["inputs"]}
+    spec = {
+        "inputs": inputs,
+        "code": {f.relative_to(REPO_DIR).as_posix() if f.is_relative_to(REPO_DIR) else str(f): file_hash(f, cache)
+                 for f in local_imports(_source(stage))},
+        "params": stage.get("params", {}),
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest(), inputs
+
+
+def execute(name, stages=STAGES):
+    # runs in a worker process
+    stage = stages[name]
+    target, func = stage["run"]
+    params = stage.get("params", {})
+    start = time.perf_counter()
+    if func is None:
+        sys.argv = [target] + [a for k, v in params.items() for a in (f"--{k}", *map(str, v if isinstance(v, list) else [v]))]
+        runpy.run_path(target, run_name="__main__")
+    else:
+        getattr(importlib.import_module(target), func)(**params)
+    return time.perf_counter() - start
+
+
+def run(targets=None, force=(), max_workers=None, dry_run=False, stages=STAGES, state_path=STATE_PATH):
+    # run the targets (default: every stage) and whatever they depend on
+    names = with_upstream(targets, stages) if targets else set(stages)
+    deps = {n: [d for d in ds if d in names] for n, ds in upstream(stages).items() if n in names}
+    state = load_state(state_path)
+    cache = state["files"]
+    done, failed, ran, skipped = set(), set(), [], []
+    running, keys = {}, {}
+
+    def ready():
+        return [n for n in sorted(names - done - failed - set(running.values()))
+                if all(d in done for d in deps[n]) and not any(d in failed for d in deps[n])]
+
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), max_tasks_per_child=1) as pool:
+        while True:
+            for name in ready():
+                stage = stages[name]
+                missing = [p for p in stage["inputs"] if not Path(p).exists()]
+                if missing and not dry_run:
+                    print(f"[STOP] {name}: missing inputs {missing}")
+                    failed.add(name)
+                    continue
+                key, inputs = stage_key(stage, cache) if not missing else (None, {})
+                last = state["stages"].get(name, {})
+                outputs = {p: path_hash(p, cache) for p in stage["outputs"]}
+                fresh = (name not in force and key is not None and last.get("key") == key
+                         and all(h is not None and last.get("outputs", {}).get(p) == h for p, h in outputs.items()))
+                if dry_run and any(d in ran for d in deps[name]):
+                    # its inputs are about to change
+                    fresh = False
+                if fresh:
+                    print(f"[SKIP] {name}: inputs, code and params unchanged")
+                    skipped.append(name)
+                    done.add(name)
+                elif dry_run:
+                    print(f"[RUN] {name} (dry run)")
+                    ran.append(name)
+                    done.add(name)
+                else:
+                    print(f"[RUN] {name}")
+                    running[pool.submit(execute, name, stages)] = name
+                    state["stages"].pop(name, None)
+                    keys[name] = key
+            if not running:
+                if ready():
+                    # skipped stages freed their dependents
+                    continue
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                stage = stages[name]
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    print(f"[STOP] {name} failed: {e!r}")
+                    failed.add(name)
+                    continue
+                state["stages"][name] = {
+                    "key": keys.pop(name),
+                    "outputs": {p: path_hash(p, cache) for p in stage["outputs"]},
+                    "seconds": round(seconds, 2),
+                    "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                }
+                save_state(state, state_path)
+                print(f"[DONE] {name} in {seconds:.1f}s")
+                ran.append(name)
+                done.add(name)
+
+    if not dry_run:
+        save_state(state, state_path)
+    blocked = sorted(names - done - failed)
+    print(f"[PIPELINE] ran {len(ran)}, skipped {len(skipped)}, failed {len(failed)}, blocked {len(blocked)}")
+    return {"ran": ran, "skipped": skipped, "failed": sorted(failed), "blocked": blocked}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the analysis pipeline, skipping up-to-date stages")
+    parser.add_argument("targets", nargs="*", help=f"stages to bring up to date (default: all): {', '.join(STAGES)}")
+    parser.add_argument("--force", nargs="*", default=[], help="rerun these stages even if unchanged")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--dry-run", action="store_true", help="list the stages that would run")
+    args = parser.parse_args()
+    unknown = [t for t in args.targets + args.force if t not in STAGES]
+    if unknown:
+        raise SystemExit(f"[STOP] Unknown stages: {unknown}")
+    result = run(args.targets or None, set(args.force), args.workers, args.dry_run)
+    if result["failed"]:
+        raise SystemExit(1)
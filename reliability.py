@@ -0,0 +1,300 @@
+import polars as pl
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from pathlib import Path
+import argparse
+import json
+import os
+import metrics
+import phases
+import speed_cube
+import storage
+import trips
+
+# Rolling reliability: trailing-window weighted speed percentiles per route
+# and per corridor, for every day rather than for fixed before/after phase
+# buckets. Speed rows are first reduced to daily cells, one row per
+# route x corridor x day x speed_cube sketch bin holding weighted sums. A
+# window is then a polars group_by_dynamic over the sorted days of each
+# (series, bin): every day ends one trailing window of 1, 7 or 28 days, and
+# its histogram is the sum of the daily cells inside. Quantiles come from
+# one cumulative sum over the bins of each window, as in speed_cube.query.
+# Because daily cells are sums, an update rebuilds the cells from the
+# high-water mark's day on and recomputes only the windows ending on or
+# after that day.
+#
+# Wait Assessment is approximated from trips.py's chained runs: the share of
+# origin headways within the usual headway (median per route, direction
+# and hour) plus 3 minutes in peak hours, 5 minutes otherwise.
+
+OUT_DIR = Path("data/reliability")
+FEED = "speeds_2025"
+
+# window name -> length in days; one trailing window ends on every day
+WINDOWS = {"daily": 1, "weekly": 7, "28d": 28}
+LEVELS = {"route": ["route"], "corridor": ["route", "corridor"]}
+QUANTILES = (0.10, 0.50, 0.90)
+
+PEAK_HOURS = [7, 8, 9, 16, 17, 18]
+WAIT_SLACK_MIN = {"peak": 3, "offpeak": 5}
+
+# store columns per feed schema
+COLUMNS = {
+    "speeds": {"time": "timestamp", "route": "route_id", "from": "timepoint_stop_name",
+               "to": "next_timepoint_stop_name", "speed": "average_road_speed", "weight": "bus_trip_count"},
+    "speeds_raw": {"time": "Timestamp", "route": "Route ID", "from": "Timepoint Stop Name",
+                   "to": "Next Timepoint Stop Name", "speed": "Average Road Speed", "weight": "Bus Trip Count"},
+}
+
+SUMS = ["rows", "weight", "weighted_speed", "crawl_weight"]
+
+
+def daily_cells(lf, schema):
+    # lazy speed rows -> route x corridor x day x bin sums
+    c = COLUMNS[schema]
+    speed = pl.col(c["speed"]).cast(pl.Float64)
+    weight = pl.col(c["weight"]).cast(pl.Float64)
+    return (
+        lf.filter(speed.is_not_nan() & weight.is_not_nan() & pl.col(c["time"]).is_not_null())
+        .select(
+            pl.col(c["route"]).cast(pl.String).alias("route"),
+            (pl.col(c["from"]).cast(pl.String) + " → " + pl.col(c["to"]).cast(pl.String)).alias("corridor"),
+            pl.col(c["time"]).dt.date().alias("day"),
+            (speed.clip(lower_bound=speed_cube.MIN_SPEED).log() / np.log(speed_cube.GAMMA)).ceil().cast(pl.Int16).alias("bin"),
+            pl.lit(1, pl.Int64).alias("rows"),
+            weight.alias("weight"),
+            (weight * speed).alias("weighted_speed"),
+            (weight * (speed < speed_cube.CRAWL_MPH)).alias("crawl_weight"),
+        )
+        .group_by(["route", "corridor", "day", "bin"])
+        .agg(pl.col(SUMS).sum())
+        .collect()
+    )
+
+
+def merge(*cells):
+    # cells are sums, so merging is concat + group-by sum
+    cells = pl.concat([c for c in cells if c is not None])
+    return cells.group_by(["route", "corridor", "day", "bin"]).agg(pl.col(SUMS).sum()).sort(["route", "corridor", "day", "bin"])
+
+
+def windows(cells, keys, days, since=None, quantiles=QUANTILES):
+    # one row per series of `keys` and window end day: weighted mean,
+    # quantiles, crawl share, weight, rows and the days with data; with
+    # since, only windows ending on or after that day
+    if since is not None:
+        cells = cells.filter(pl.col("day") >= since - timedelta(days=days - 1))
+    last = cells["day"].max()
+    # integer series ids: the window frame is ~days times the cells, and
+    # sorting / grouping it on strings costs more than the windows themselves
+    series = cells.select(keys).unique().sort(keys).with_row_index("series")
+    binned = cells.join(series, on=keys).group_by(["series", "day", "bin"]).agg(pl.col(SUMS).sum()).sort("day")
+
+    def rolling(frame, by):
+        # label="right" is the day after the window, hence the - 1 day
+        return (
+            frame.group_by_dynamic("day", every="1d", period=f"{days}d", offset=f"-{days - 1}d",
+                                   group_by=by, label="right", closed="left", start_by="window")
+        )
+
+    hist = (
+        rolling(binned, ["series", "bin"]).agg(pl.col(SUMS).sum())
+        .with_columns((pl.col("day") - pl.duration(days=1)).alias("end"))
+        .filter(pl.col("end") <= last)
+    )
+    if since is not None:
+        hist = hist.filter(pl.col("end") >= since)
+    covered = (
+        rolling(binned.select("series", "day").unique().sort("day"), ["series"]).agg(pl.len().alias("days"))
+        .with_columns((pl.col("day") - pl.duration(days=1)).alias("end"))
+        .drop("day")
+    )
+
+    # bins in order inside each window: the q-quantile is the bin where the
+    # running weight first reaches q * total
+    window = ["series", "end"]
+    p = [f"p{round(q * 100):g}" for q in quantiles]
+    hist = hist.sort(["series", "end", "bin"]).with_columns(
+        pl.col("weight").cum_sum().over(window).alias("cum"),
+        pl.col("weight").sum().over(window).alias("total"),
+    )
+    hist = hist.with_columns(*[
+        pl.when((pl.col("cum") >= q * pl.col("total")) & (pl.col("cum") - pl.col("weight") < q * pl.col("total")))
+        .then(pl.col("bin")).alias(name)
+        for q, name in zip(quantiles, p)
+    ])
+    out = (
+        hist.group_by(window).agg(pl.col(SUMS).sum(), pl.col(p).max())
+        .join(covered, on=window, how="left")
+        .join(series, on="series")
+        .sort(keys + ["end"])
+        .with_columns(
+            (pl.col("weighted_speed") / pl.col("weight")).alias("mean"),
+            (pl.col("crawl_weight") / pl.col("weight")).alias("crawl_share"),
+            pl.col(p).cast(pl.Float64),
+        )
+    )
+    out = out.select(keys + ["end", "mean", *p, "crawl_share", "weight", "rows", "days"]).to_pandas()
+    for col in p:
+        out[col] = speed_cube.bin_value(out[col].to_numpy())
+    return out
+
+
+def label_phases(frame, routes_path=phases.ROUTES_PATH):
+    # phase of each window end under its route's ACE start; left out when
+    # the routes file is missing
+    if not Path(routes_path).exists():
+        print(f"[INFO] {routes_path} not found, windows are not labeled with phases")
+        return frame
+    starts = phases.route_starts(frame["route"], phases.implementation_dates(routes_path, program="ACE"))
+    frame["phase"] = phases.phase_label(pd.to_datetime(frame["end"]), starts).astype(object)
+    return frame
+
+
+def wait_assessment(runs, days, peak_hours=PEAK_HOURS, slack_min=WAIT_SLACK_MIN):
+    # per route and window end: share of origin headways within the usual
+    # headway plus slack, and the headway count
+    h = trips.headways(runs)
+    if h.empty:
+        return pd.DataFrame(columns=["route", "end", "wait_assessment", "headways"])
+    h["route_id"] = h["route_id"].astype(str)
+    h["direction"] = h["direction"].astype(str)
+    h["hour"] = h["start"].dt.hour
+    usual = h.groupby(["route_id", "direction", "hour"])["headway_min"].transform("median")
+    slack = np.where(h["hour"].isin(peak_hours), slack_min["peak"], slack_min["offpeak"])
+    daily = (
+        pl.from_pandas(pd.DataFrame({
+            "route": h["route_id"], "day": h["start"].dt.date,
+            "ok": (h["headway_min"] <= usual + slack).astype(int),
+        }))
+        .group_by(["route", "day"]).agg(pl.col("ok").sum(), pl.len().alias("headways"))
+        .sort("day")
+    )
+    last = daily["day"].max()
+    out = (
+        daily.group_by_dynamic("day", every="1d", period=f"{days}d", offset=f"-{days - 1}d",
+                               group_by="route", label="right", closed="left", start_by="window")
+        .agg(pl.col("ok").sum(), pl.col("headways").sum())
+        .with_columns((pl.col("day") - pl.duration(days=1)).alias("end"))
+        .filter(pl.col("end") <= last)
+        .with_columns((pl.col("ok") / pl.col("headways")).alias("wait_assessment"))
+        .select("route", "end", "wait_assessment", "headways")
+        .sort(["route", "end"])
+    )
+    return out.to_pandas()
+
+
+def load_state(out_dir=OUT_DIR):
+    path = Path(out_dir) / "state.json"
+    if not path.exists():
+        return None, None
+    with open(path) as f:
+        state = json.load(f)
+    return pl.read_parquet(Path(out_dir) / "cells.parquet"), state
+
+
+def _replace(frame, path):
+    tmp = path.with_suffix(".parquet.tmp")
+    frame.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def save_state(cells, state, out_dir=OUT_DIR):
+    # cells first, so state never points past them
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tmp = out_dir / "cells.parquet.tmp"
+    cells.write_parquet(tmp)
+    os.replace(tmp, out_dir / "cells.parquet")
+    tmp = out_dir / "state.json.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, out_dir / "state.json")
+
+
+def window_path(level, window, out_dir=OUT_DIR):
+    return Path(out_dir) / f"{level}_{window}.parquet"
+
+
+@metrics.instrument()
+def update(name=FEED, routes=None, window_days=WINDOWS, full=False, out_dir=OUT_DIR):
+    # fold speed rows from the high-water mark's day on into the daily
+    # cells, then recompute only the windows ending on or after that day.
+    # The mark's day is rebuilt from the store every time, so rows that
+    # arrive late with a timestamp in that day (on the mark or before it)
+    # are not lost and nothing is counted twice. The mark is shared by all
+    # routes, so pass the same routes on every update (or full=True after
+    # changing them)
+    cells, state = (None, None) if full else load_state(out_dir)
+    feed = storage.FEEDS[name]
+    high_water = pd.Timestamp(state["high_water"]) if state and state["high_water"] else None
+    if state and state["feed"] != name:
+        raise ValueError(f"{out_dir} holds {state['feed']}; rebuild with full=True for {name}")
+
+    since = None if high_water is None else high_water.normalize()
+    lf = storage.scan(name, routes=routes, start=since)
+    latest = lf.select(pl.col(feed["time"]).max()).collect().item()
+    if latest is None:
+        print(f"[SKIP] no {name} rows from {since}")
+        return cells
+    new = daily_cells(lf.filter(pl.col(feed["time"]) <= latest), feed["schema"])
+    if cells is not None:
+        rebuilt = pl.col("day") >= since.date()
+        if routes is not None:
+            rebuilt &= pl.col("route").is_in(list(routes))
+        cells = cells.filter(~rebuilt)
+    metrics.record(rows_in=int(new["rows"].sum()))
+    since = None if cells is None else since.date()
+    cells = new.sort(["route", "corridor", "day", "bin"]) if cells is None else merge(cells, new)
+    added = int(cells["rows"].sum()) - (state["rows"] if state else 0)
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    written = 0
+    for level, keys in LEVELS.items():
+        for window, days in window_days.items():
+            fresh = label_phases(windows(cells, keys, days, since))
+            path = window_path(level, window, out_dir)
+            if since is not None and path.exists():
+                old = pd.read_parquet(path)
+                fresh = (pd.concat([old[old["end"] < pd.Timestamp(since)], fresh])
+                         .sort_values(keys + ["end"], ignore_index=True))
+            _replace(fresh, path)
+            written += len(fresh)
+    state = {"feed": name, "high_water": max(pd.Timestamp(latest), high_water or pd.Timestamp(latest)).isoformat(),
+             "rows": int(cells["rows"].sum())}
+    save_state(cells, state, out_dir)
+    metrics.record(rows_out=written)
+
+    runs_path = trips.OUT_DIR / "runs.parquet"
+    if runs_path.exists():
+        # runs are rebuilt whole by trips.build_runs, so this is recomputed whole
+        runs = pd.read_parquet(runs_path)
+        for window, days in window_days.items():
+            _replace(wait_assessment(runs, days), window_path("wait", window, out_dir))
+    else:
+        print(f"[INFO] {runs_path} not found, skipping Wait Assessment (run trips.py first)")
+    print(f"[DONE] {added:,} new rows, windows from {since or cells['day'].min()} "
+          f"recomputed, high water {state['high_water']} -> {out_dir}")
+    return cells
+
+
+def load(level="route", window="28d", out_dir=OUT_DIR):
+    # stored windows, with Wait Assessment joined on for routes when present
+    frame = pd.read_parquet(window_path(level, window, out_dir))
+    wait = window_path("wait", window, out_dir)
+    if level == "route" and wait.exists():
+        frame = frame.merge(pd.read_parquet(wait), on=["route", "end"], how="left")
+    return frame
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rolling speed reliability and Wait Assessment per route and corridor")
+    parser.add_argument("--feed", default=FEED, choices=[n for n, f in storage.FEEDS.items() if f["schema"] in COLUMNS])
+    parser.add_argument("--routes", nargs="*")
+    parser.add_argument("--windows", nargs="+", default=list(WINDOWS), choices=list(WINDOWS))
+    parser.add_argument("--full", action="store_true", help="rebuild from scratch instead of from the high-water mark")
+    args = parser.parse_args()
+    update(args.feed, args.routes, {w: WINDOWS[w] for w in args.windows}, args.full)
+    print(load("route", args.windows[-1]).tail(20).round(3).to_string())
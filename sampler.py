@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pathlib import Path
+import argparse
+import metrics
+import storage
+
+# Streaming, deterministic samples of the stored feeds. The store is read
+# batch by batch and a row is in the sample at fraction f when
+# hash(row id) / 2**64 < f, so the same row is always picked, appending
+# data never changes which old rows are in, and the 1% sample is a subset
+# of the 5% one, so every fraction comes out of the same pass. Strata
+# (route x month by default) that would get fewer than min_rows rows are
+# topped up with their next-smallest hashes, so small routes are not lost;
+# sample_weight = stratum rows / stratum sample rows expands back to totals.
+# Memory is the samples plus min_rows candidates per stratum.
+
+OUT_DIR = Path("data")
+
+# row ids per feed (storage.FEEDS "key", as access_data dedupes on)
+ROW_KEYS = {name: feed["key"] for name, feed in storage.FEEDS.items()}
+
+# output file stems (main.get_samples used speeds_2023_24)
+SAMPLE_NAMES = {"speeds_2023-24": "speeds_2023_24"}
+
+FRACTIONS = (0.01,)
+MIN_ROWS = 20
+BATCH_ROWS = 250_000
+
+
+def row_hash(df, keys):
+    # uint64 per row from the key columns only; timestamps hash as int64
+    # nanoseconds, so parsed / re-read copies of a row agree
+    cols = {}
+    for k in keys:
+        s = df[k]
+        cols[k] = s.astype("datetime64[ns]").astype("int64") if pd.api.types.is_datetime64_any_dtype(s) else s
+    return pd.util.hash_pandas_object(pd.DataFrame(cols), index=False).to_numpy()
+
+
+def unit(h):
+    # hash -> [0, 1) from its top 53 bits
+    return (h >> np.uint64(11)).astype(np.float64) * 2.0**-53
+
+
+def _frames(dataset, batch_rows):
+    # the store has one small file per route and month; batches are merged
+    # up to batch_rows so per-batch work is not repeated thousands of times
+    pending, rows = [], 0
+    for batch in dataset.to_batches(batch_size=batch_rows):
+        pending.append(batch)
+        rows += batch.num_rows
+        if rows >= batch_rows:
+            yield pa.Table.from_batches(pending).to_pandas()
+            pending, rows = [], 0
+    if rows:
+        yield pa.Table.from_batches(pending).to_pandas()
+
+
+def sample(name, fractions=FRACTIONS, min_rows=MIN_ROWS, strata=None,
+           batch_rows=BATCH_ROWS, store_dir=storage.STORE_DIR):
+    # {fraction: sample frame} in one pass over the store
+    feed = storage.FEEDS[name]
+    keys = ROW_KEYS[name]
+    strata = strata or [feed["route"], "month"]
+    top = max(fractions)
+
+    kept, counts = [], []
+    pool = None
+    for df in _frames(storage.dataset(name, store_dir), batch_rows):
+        df["_u"] = unit(row_hash(df, keys))
+        counts.append(df.groupby(strata, observed=True, dropna=False).size())
+        hit = (df["_u"] < top).to_numpy()
+        kept.append(df[hit])
+        if min_rows:
+            # min_rows smallest hashes above the largest fraction, per stratum
+            rest = df[~hit] if pool is None else pd.concat([pool, df[~hit]], ignore_index=True)
+            pool = rest.sort_values("_u").groupby(strata, observed=True, dropna=False).head(min_rows)
+
+    if not counts:
+        return {f: pd.DataFrame() for f in fractions}
+    totals = pd.concat(counts).groupby(level=list(range(len(strata))), dropna=False).sum().rename("_n")
+    totals.index.names = strata
+    kept = pd.concat(kept, ignore_index=True)
+    metrics.record(rows_in=int(totals.sum()))
+
+    out = {}
+    for f in sorted(fractions):
+        base = kept[kept["_u"] < f]
+        if min_rows:
+            have = base.groupby(strata, observed=True, dropna=False).size().reindex(totals.index, fill_value=0)
+            need = (np.minimum(totals, min_rows) - have).clip(lower=0).rename("_need")
+            need = need[need > 0]
+            if len(need):
+                cand = pd.concat([kept[kept["_u"] >= f], pool], ignore_index=True).sort_values("_u")
+                cand = cand.merge(need.reset_index(), on=strata, how="inner")
+                cand = cand[cand.groupby(strata, observed=True, dropna=False).cumcount() < cand["_need"]]
+                base = pd.concat([base, cand.drop(columns="_need")], ignore_index=True)
+        n = base.groupby(strata, observed=True, dropna=False).size().rename("_k")
+        base = base.merge((totals / n).rename("sample_weight").reset_index(), on=strata, how="left")
+        out[f] = base.sort_values([feed["route"], feed["time"]], kind="stable", ignore_index=True).drop(columns="_u")
+    return out
+
+
+def sample_path(name, fraction, out_dir=OUT_DIR):
+    # data/violations_sample.csv for 1%, data/violations_sample_5pct.csv etc.
+    stem = SAMPLE_NAMES.get(name, name)
+    suffix = "" if fraction == 0.01 else f"_{fraction * 100:g}pct"
+    return Path(out_dir) / f"{stem}_sample{suffix}.csv"
+
+
+def write_samples(name, fractions=FRACTIONS, min_rows=MIN_ROWS, out_dir=OUT_DIR, store_dir=storage.STORE_DIR):
+    paths = []
+    for f, df in sample(name, fractions, min_rows, store_dir=store_dir).items():
+        path = sample_path(name, f, out_dir)
+        df.to_csv(path, index=False)
+        metrics.record(rows_out=len(df))
+        paths.append(path)
+        print(f"[SAMPLE] {name} {f:.2%}: {len(df):,} rows -> {path}")
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic stratified samples of the stored feeds")
+    parser.add_argument("names", nargs="*", default=["violations", "speeds_2025", "speeds_2023-24"],
+                        choices=list(ROW_KEYS))
+    parser.add_argument("--fractions", nargs="+", type=float, default=list(FRACTIONS))
+    parser.add_argument("--min-rows", type=int, default=MIN_ROWS, help="rows kept per route x month at least")
+    args = parser.parse_args()
+    for name in args.names:
+        write_samples(name, args.fractions, args.min_rows)
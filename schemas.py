@@ -0,0 +1,250 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pathlib import Path
+import argparse
+import time
+
+# One schema registry for every feed the project reads: repeated IDs and
+# names become categoricals (dictionary-encoded in Arrow), measurements get
+# the narrowest numeric type that holds them, and every timestamp column has
+# explicit formats, so nothing falls back to per-row format inference.
+# Columns a schema does not list are left as they are.
+
+# formats tried in order; the first one that parses a sample of the column
+# is used for the whole column
+ISO = ["ISO8601"]
+RAW = ["%m/%d/%Y %I:%M:%S %p", "ISO8601"]
+
+# OData (snake_case) column types
+_VIOLATIONS = {
+    "violation_id": "string",
+    "vehicle_id": "category",
+    "first_occurrence": "datetime",
+    "last_occurrence": "datetime",
+    "violation_status": "category",
+    "violation_type": "category",
+    "bus_route_id": "category",
+    "violation_latitude": "float32",
+    "violation_longitude": "float32",
+    "stop_id": "category",
+    "stop_name": "category",
+    "bus_stop_latitude": "float32",
+    "bus_stop_longitude": "float32",
+}
+
+_SPEEDS = {
+    "timestamp": "datetime",
+    "route_id": "category",
+    "direction": "category",
+    "borough": "category",
+    "route_type": "category",
+    "stop_order": "int16",
+    "timepoint_stop_id": "int32",
+    "timepoint_stop_name": "category",
+    "timepoint_stop_latitude": "float32",
+    "timepoint_stop_longitude": "float32",
+    "next_timepoint_stop_id": "int32",
+    "next_timepoint_stop_name": "category",
+    "next_timepoint_stop_latitude": "float32",
+    "next_timepoint_stop_longitude": "float32",
+    "road_distance": "float32",
+    "average_travel_time": "float32",
+    "average_road_speed": "float32",
+    "bus_trip_count": "float32",
+    "day_of_week": "int8",
+    "hour_of_day": "int8",
+}
+
+_ACE_ROUTES = {
+    "route": "category",
+    "program": "category",
+    "implementation_date": "datetime",
+}
+
+
+def _title(name):
+    # data_raw CSV header for an OData column: route_id -> Route ID,
+    # hour_of_day -> Hour of Day
+    words = {"id": "ID", "of": "of"}
+    return " ".join(words.get(w, w.capitalize()) for w in name.split("_"))
+
+
+def _raw(columns):
+    return {_title(c): kind for c, kind in columns.items()}
+
+
+SCHEMAS = {
+    "violations": {"columns": _VIOLATIONS, "formats": ISO},
+    "speeds": {"columns": _SPEEDS, "formats": ISO},
+    "ace_routes": {"columns": _ACE_ROUTES, "formats": ISO + ["%m/%d/%Y", "%m/%d/%Y %I:%M:%S %p"]},
+    # data_raw exports, plus the columns scripts/02 and scripts/03 add
+    "violations_raw": {
+        "columns": {**_raw(_VIOLATIONS), "Datetime": "datetime", "is_exempt": "bool"},
+        "formats": RAW,
+    },
+    "speeds_raw": {
+        "columns": {**_raw(_SPEEDS), "ace_start_date": "datetime", "Date": "datetime",
+                    "ace_status": "category", "Phase": "category"},
+        "formats": RAW,
+    },
+    "ace_routes_raw": {"columns": _raw(_ACE_ROUTES), "formats": ["%m/%d/%Y", "%m/%d/%Y %I:%M:%S %p"] + ISO},
+}
+
+
+def time_format(s, formats):
+    # first format that parses every non-null value of a sample
+    sample = s.dropna().head(1000)
+    for fmt in formats:
+        if pd.to_datetime(sample, format=fmt, errors="coerce").notna().all():
+            return fmt
+    return formats[0]
+
+
+def _parse_raw(s):
+    # "%m/%d/%Y %I:%M:%S %p" is fixed width ("09/19/2025 01:05:00 PM"), so
+    # the whole column is parsed with numpy digit arithmetic instead of
+    # strptime per row; None if any value does not fit the layout
+    values = s.to_numpy(dtype=object)
+    missing = pd.isna(values)
+    try:
+        b = np.where(missing, "01/01/1970 12:00:00 AM", values).astype("S")
+    except (UnicodeEncodeError, ValueError):
+        return None
+    if b.dtype.itemsize != 22:
+        return None
+    m = b.view(np.uint8).reshape(-1, 22)
+    d = m.astype(np.int64) - ord("0")
+    digits = [0, 1, 3, 4, 6, 7, 8, 9, 11, 12, 14, 15, 17, 18]
+    layout = {2: "/", 5: "/", 10: " ", 13: ":", 16: ":", 19: " ", 21: "M"}
+    if ((d[:, digits] < 0) | (d[:, digits] > 9)).any() or not np.isin(m[:, 20], [ord("A"), ord("P")]).all():
+        return None
+    if any((m[:, i] != ord(c)).any() for i, c in layout.items()):
+        return None
+
+    month = d[:, 0] * 10 + d[:, 1]
+    day = d[:, 3] * 10 + d[:, 4]
+    year = d[:, 6] * 1000 + d[:, 7] * 100 + d[:, 8] * 10 + d[:, 9]
+    hour = d[:, 11] * 10 + d[:, 12]
+    minute = d[:, 14] * 10 + d[:, 15]
+    second = d[:, 17] * 10 + d[:, 18]
+    if ((month < 1) | (month > 12) | (day < 1) | (hour < 1) | (hour > 12) | (minute > 59) | (second > 59)).any():
+        return None
+    months = ((year - 1970) * 12 + month - 1).astype("datetime64[M]")
+    dates = months.astype("datetime64[D]") + (day - 1)
+    if (dates.astype("datetime64[M]") != months).any():
+        # day past the end of its month
+        return None
+    hour = hour % 12 + 12 * (m[:, 20] == ord("P"))
+    times = dates.astype("datetime64[s]") + hour * 3600 + minute * 60 + second
+    times = times.astype("datetime64[ns]")
+    times[missing] = np.datetime64("NaT")
+    return pd.Series(times, index=s.index, name=s.name)
+
+
+def parse_times(s, formats):
+    formats = [formats] if isinstance(formats, str) else formats
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    fmt = time_format(s, formats)
+    if fmt == RAW[0]:
+        parsed = _parse_raw(s)
+        if parsed is not None:
+            return parsed
+    return pd.to_datetime(s, format=fmt, errors="coerce")
+
+
+def _narrow(s, kind):
+    # numeric cast only if it loses nothing (no new missing values); integer
+    # columns with gaps stay float32
+    values = pd.to_numeric(s, errors="coerce")
+    if values.isna().sum() > s.isna().sum():
+        return s
+    if kind.startswith("int") and values.isna().any():
+        kind = "float32"
+    return values.astype(kind)
+
+
+def apply(df, name, categories=True):
+    # cast df's columns in place to schema `name` and return it
+    schema = SCHEMAS[name]
+    for col, kind in schema["columns"].items():
+        if col not in df.columns:
+            continue
+        s = df[col]
+        if kind == "datetime":
+            df[col] = parse_times(s, schema["formats"])
+        elif kind == "category":
+            if categories and not isinstance(s.dtype, pd.CategoricalDtype):
+                df[col] = s.astype("category")
+        elif kind == "bool":
+            if s.dtype != bool:
+                df[col] = s.astype(str).str.lower().isin(["true", "1", "t", "yes", "y"])
+        elif kind != "string":
+            df[col] = _narrow(s, kind)
+    return df
+
+
+def _csv_dtypes(name):
+    # types the CSV parser can produce itself
+    return {c: k for c, k in SCHEMAS[name]["columns"].items() if k in ("category", "string")}
+
+
+def read(path, name, columns=None):
+    # typed read of a CSV or parquet file: categoricals are built by the CSV
+    # parser directly, timestamps parsed with the schema's formats
+    path = Path(path)
+    if path.suffix == ".parquet" or path.is_dir():
+        df = pd.read_parquet(path, columns=columns)
+    else:
+        df = pd.read_csv(path, usecols=columns, dtype=_csv_dtypes(name), low_memory=False)
+    return apply(df, name)
+
+
+def to_pandas(table, name):
+    # Arrow -> pandas with the schema applied; categorical columns are
+    # dictionary-encoded in Arrow first so pandas never holds them as
+    # Python strings
+    kinds = SCHEMAS[name]["columns"]
+    for i, field in enumerate(table.schema):
+        if kinds.get(field.name) == "category" and (pa.types.is_string(field.type) or pa.types.is_large_string(field.type)):
+            table = table.set_column(i, field.name, pc.dictionary_encode(table.column(i)))
+    return apply(table.to_pandas(), name)
+
+
+def benchmark(path, name, nrows=None):
+    # default read + inferred timestamps vs the schema-typed read
+    def default():
+        df = pd.read_csv(path, nrows=nrows, low_memory=False)
+        for col, kind in SCHEMAS[name]["columns"].items():
+            if kind == "datetime" and col in df:
+                df[col] = pd.to_datetime(df[col], errors="coerce")
+        return df
+
+    def typed():
+        return apply(pd.read_csv(path, nrows=nrows, dtype=_csv_dtypes(name), low_memory=False), name)
+
+    rows = []
+    for label, fn in [("default", default), ("schema", typed)]:
+        start = time.perf_counter()
+        df = fn()
+        rows.append({
+            "loader": label,
+            "rows": len(df),
+            "seconds": round(time.perf_counter() - start, 3),
+            "memory_mb": round(df.memory_usage(deep=True).sum() / 2**20, 1),
+        })
+    out = pd.DataFrame(rows)
+    out["memory_x"] = (out["memory_mb"].iloc[0] / out["memory_mb"]).round(2)
+    out["speed_x"] = (out["seconds"].iloc[0] / out["seconds"]).round(2)
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory / parse-time of default vs schema-typed loading")
+    parser.add_argument("path")
+    parser.add_argument("--schema", required=True, choices=list(SCHEMAS))
+    parser.add_argument("--nrows", type=int)
+    args = parser.parse_args()
+    print(benchmark(args.path, args.schema, args.nrows).to_string(index=False))
@@ -1,36 +1,63 @@
-import pandas as pd
+import argparse
+import sys
+import time
 from pathlib import Path
 
+import polars as pl
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import metrics
+import storage
+
 # relevant routes
 ROUTES = ["M101", "M102", "M103", "M2", "M3", "M4", "M15+"]
 
 
-# raw data files
-INPUT_FILES = [
-    "data_raw/MTA_Bus_Route_Segment_Speeds__2023_-_2024_20250921.csv",
-    "data_raw/MTA_Bus_Route_Segment_Speeds__Beginning_2025_20250919.csv"
-]
+# raw data files are converted once into the route/month store
+# (see storage.FEEDS["speeds_raw"]); only the Hunter route partitions are read
 
 # create output path
 OUT_PATH = Path("data_work/hunter_speeds_filtered.parquet")
-OUT_PATH.parent.mkdir(parents=True, exist_ok=True) # check if parent folder exists
-
-dfs = []
-
-for file in INPUT_FILES:
-    print(f"[INFO] Processing {file}")
-    for chunk in pd.read_csv(file, chunksize=100000):
-        # filter rows for Hunter routes
-        chunk_filtered = chunk[chunk['Route ID'].isin(ROUTES)]
-        if not chunk_filtered.empty:
-            dfs.append(chunk_filtered)
-
-# combine everything
-hunter_speeds = pd.concat(dfs, ignore_index=True)
 
-# save to CSV
-hunter_speeds.to_parquet(OUT_PATH, index=False)
-print(f"[DONE] Wrote {len(hunter_speeds):,} rows -> {OUT_PATH}")
 
-# sanity check
-print(hunter_speeds['Route ID'].value_counts())
\ No newline at end of file
+@metrics.instrument("scripts/01", rows_out=lambda rows_out: rows_out)
+def run(routes=ROUTES, out_path=OUT_PATH):
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True) # check if parent folder exists
+
+    print(f"[INFO] Streaming routes {routes} from the speeds store")
+    start = time.perf_counter()
+
+    # lazy scan -> filter -> sink: rows flow through in batches on all
+    # cores and are never collected into one frame
+    (
+        storage.scan("speeds_raw", routes=routes)
+        .filter(pl.col("Route ID").is_in(routes))
+        .drop("month")
+        .sink_parquet(out_path)
+    )
+
+    elapsed = time.perf_counter() - start
+    rows_in = storage.count_rows("speeds_raw", routes=routes)
+    rows_out = pl.scan_parquet(out_path).select(pl.len()).collect().item()
+    metrics.record(rows_in=rows_in)
+    print(f"[DONE] Wrote {rows_out:,} rows -> {out_path}")
+    print(f"[PERF] {rows_in:,} rows in {elapsed:.2f}s ({rows_in / max(elapsed, 1e-9):,.0f} rows/sec)")
+    return rows_out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--routes", nargs="+", default=ROUTES)
+    parser.add_argument("--out", default=OUT_PATH)
+    args = parser.parse_args()
+
+    run(args.routes, args.out)
+
+    # sanity check
+    print(
+        pl.scan_parquet(args.out)
+        .group_by("Route ID").len()
+        .sort("len", descending=True)
+        .collect()
+    )
@@ -1,51 +1,71 @@
-import pandas as pd
+import argparse
+import sys
+import time
 from pathlib import Path
 
+import polars as pl
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import metrics
+import storage
+
 ROUTES = ["M101", "M102", "M103", "M2", "M3", "M4", "M15+", "M15", "M60+", "M100"]
 
-INPUT_CSV = Path("data_raw/MTA_Bus_Automated_Camera_Enforcement_Violations__Beginning_October_2019_20250919.csv")
+# raw CSV is converted once into the route/month store
+# (see storage.FEEDS["violations_raw"]); only our route partitions are read
 OUT_PATH = Path("data_work/violations_routes_filtered.parquet")
 
-CHUNK = 200_000
 
-OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
+@metrics.instrument("scripts/03", rows_out=lambda rows_out: rows_out)
+def run(routes=ROUTES, out_path=OUT_PATH):
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
 
-dfs = []
-total_in = 0
-total_kept = 0
+    total_in = storage.count_rows("violations_raw")
+    total_kept = storage.count_rows("violations_raw", routes=routes)
+    metrics.record(rows_in=total_in)
+    if not total_kept:
+        # error handling
+        raise SystemExit(f"[STOP] No rows kept. Check the ROUTES list or 'Bus Route ID' column name.")
 
+    print("[INFO] Streaming violations from the store...")
+    start = time.perf_counter()
 
-print("[INFO] Processing Chunks...")
-for chunk in pd.read_csv(INPUT_CSV, chunksize=CHUNK, low_memory=False):
-    total_in += len(chunk)
-    # keep only our routes
-    mask = chunk["Bus Route ID"].isin(ROUTES)
-    part = chunk.loc[mask].copy()
-    kept = len(part)
-    total_kept += kept
-    if kept:
-        dfs.append(part)
+    # keep only our routes, add useful columns, write new parquet -- all in
+    # one streaming pass
+    (
+        storage.scan("violations_raw", routes=routes)
+        .filter(pl.col("Bus Route ID").is_in(routes))
+        .drop("month")
+        .with_columns(
+            pl.col("First Occurrence").alias("Datetime"),
+            pl.col("Violation Status").cast(pl.String).str.to_uppercase()
+              .str.contains("EXEMPT").fill_null(False).alias("is_exempt"),
+        )
+        .sink_parquet(out_path)
+    )
 
-if not dfs:
-    # error handling
-    raise SystemExit(f"[STOP] No rows kept. Check the ROUTES list or 'Bus Route ID' column name.")
+    elapsed = time.perf_counter() - start
 
-df = pd.concat(dfs, ignore_index=True)
+    # logs
+    print(f"[DONE] Read {total_in:,} rows; kept {total_kept:,} for routes {routes}")
+    print(f"[WRITE] {out_path} (rows: {total_kept:,})")
+    print(f"[PERF] {total_kept:,} rows in {elapsed:.2f}s ({total_kept / max(elapsed, 1e-9):,.0f} rows/sec)")
+    return total_kept
 
-# add useful columns
-df["Datetime"] = pd.to_datetime(df["First Occurrence"], errors='coerce')
-df['is_exempt'] = df["Violation Status"].astype(str).str.contains("EXEMPT", case=False, na=False)
 
-# Write new parquet
-df.to_parquet(OUT_PATH, index=False)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--routes", nargs="+", default=ROUTES)
+    parser.add_argument("--out", default=OUT_PATH)
+    args = parser.parse_args()
 
-# logs
-print(f"[DONE] Read {total_in:,} rows; kept {total_kept:,} for routes {ROUTES}")
-print(f"[WRITE] {OUT_PATH} (rows: {len(df):,})")
+    run(args.routes, args.out)
 
-# Quick sanity peeks
-print("\n[Route counts]")
-print(df["Bus Route ID"].value_counts())
+    # Quick sanity peeks
+    out = pl.scan_parquet(args.out)
+    print("\n[Route counts]")
+    print(out.group_by("Bus Route ID").len().sort("len", descending=True).collect())
 
-print("\n[Exempt flag]")
-print(df["is_exempt"].value_counts(dropna=False))
\ No newline at end of file
+    print("\n[Exempt flag]")
+    print(out.group_by("is_exempt").len().collect())
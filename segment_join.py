@@ -0,0 +1,253 @@
+import polars as pl
+import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import argparse
+import os
+import metrics
+import storage
+
+# Spatial-temporal join of violations onto speed segments. A segment is a
+# route's Timepoint Stop -> Next Timepoint Stop pair, drawn as the straight
+# line between the two stops. Route by route:
+# - segments are sampled every half grid cell and every sample registers
+#   the segment in its own and the 8 neighbouring cells (CELL_M metres in
+#   a local projection), so one cell lookup finds every segment within
+#   MAX_DIST_M of a point; cells are one sorted key array, as in
+#   blockages.py
+# - each violation on the route looks up its cell, measures its distance
+#   to the few candidate segments and takes the nearest one within
+#   MAX_DIST_M
+# - violations are bucketed to the clock hour of their first occurrence
+#   and joined to that segment's speed row for the hour
+# Work is linear in rows (plus a sort), and routes run in parallel. The
+# result is one row per segment x hour with the speed and the violations
+# that sat on the segment, and a per-segment violation load vs speed table.
+
+VIOLATIONS = "violations"
+SPEEDS = ["speeds_2025"]
+OUT_DIR = Path("data/segments")
+
+CELL_M = 200
+MAX_DIST_M = 75
+M_PER_DEG = 111_320
+
+SEGMENT = ["route_id", "direction", "timepoint_stop_id", "next_timepoint_stop_id"]
+
+
+def load_speeds(route, feeds=SPEEDS):
+    # speed rows of one route, trip-weighted per segment x hour
+    frames = [
+        storage.scan(name, routes=[route]).select(
+            pl.col("direction").cast(pl.String),
+            pl.col("timepoint_stop_id").cast(pl.Int64),
+            pl.col("next_timepoint_stop_id").cast(pl.Int64),
+            pl.col("timepoint_stop_name").cast(pl.String),
+            pl.col("next_timepoint_stop_name").cast(pl.String),
+            pl.col("timepoint_stop_latitude").cast(pl.Float64).alias("a_lat"),
+            pl.col("timepoint_stop_longitude").cast(pl.Float64).alias("a_lon"),
+            pl.col("next_timepoint_stop_latitude").cast(pl.Float64).alias("b_lat"),
+            pl.col("next_timepoint_stop_longitude").cast(pl.Float64).alias("b_lon"),
+            pl.col("timestamp").cast(pl.Datetime("ns")).dt.truncate("1h").alias("hour"),
+            pl.col("average_road_speed").cast(pl.Float64).alias("speed"),
+            pl.col("bus_trip_count").cast(pl.Float64).fill_null(1).alias("trips"),
+        )
+        for name in feeds
+    ]
+    return (
+        pl.concat(frames)
+        .drop_nulls(["timepoint_stop_id", "next_timepoint_stop_id", "hour", "speed"])
+        .collect()
+        .to_pandas()
+    )
+
+
+def load_violations(route, name=VIOLATIONS):
+    feed = storage.FEEDS[name]
+    return storage.scan(name, routes=[route]).select(
+        pl.col("violation_latitude").cast(pl.Float64).alias("lat"),
+        pl.col("violation_longitude").cast(pl.Float64).alias("lon"),
+        pl.col(feed["time"]).cast(pl.Datetime("ns")).alias("first"),
+        pl.col("last_occurrence").cast(pl.Datetime("ns")).alias("last"),
+    ).drop_nulls(["lat", "lon", "first"]).collect().to_pandas()
+
+
+def project(lat, lon, lat0):
+    # metres east / north of (lat0, 0), fine at city scale
+    return lon * M_PER_DEG * np.cos(np.radians(lat0)), lat * M_PER_DEG
+
+
+def segment_index(ax, ay, bx, by, cell_m=CELL_M):
+    # sorted cell keys and the segment registered under each; origin and
+    # width let points compute their key the same way
+    length = np.hypot(bx - ax, by - ay)
+    samples = np.ceil(length / (cell_m / 2)).astype(np.int64) + 1
+    seg = np.repeat(np.arange(len(ax)), samples)
+    start = np.repeat(np.cumsum(samples) - samples, samples)
+    t = (np.arange(len(seg)) - start) / np.maximum(samples[seg] - 1, 1)
+    cx = np.floor((ax[seg] + t * (bx[seg] - ax[seg])) / cell_m).astype(np.int64)
+    cy = np.floor((ay[seg] + t * (by[seg] - ay[seg])) / cell_m).astype(np.int64)
+
+    offsets = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+    cx = (cx[:, None] + offsets[:, 0]).ravel()
+    cy = (cy[:, None] + offsets[:, 1]).ravel()
+    seg = np.repeat(seg, len(offsets))
+    origin = (cx.min(), cy.min())
+    width = cy.max() - origin[1] + 1
+    keys = (cx - origin[0]) * width + (cy - origin[1])
+    pairs = np.unique(np.column_stack([keys, seg]), axis=0)
+    return {"keys": pairs[:, 0], "segments": pairs[:, 1], "origin": origin,
+            "width": width, "height": cx.max() - origin[0] + 1, "cell_m": cell_m}
+
+
+def nearest_segment(px, py, index, ax, ay, bx, by, max_dist_m=MAX_DIST_M):
+    # per point: nearest segment within max_dist_m (or -1) and its distance
+    n = len(px)
+    best = np.full(n, -1, np.int64)
+    dist = np.full(n, np.nan)
+    cx = np.floor(px / index["cell_m"]).astype(np.int64) - index["origin"][0]
+    cy = np.floor(py / index["cell_m"]).astype(np.int64) - index["origin"][1]
+    inside = (cx >= 0) & (cx < index["height"]) & (cy >= 0) & (cy < index["width"])
+    key = np.where(inside, cx * index["width"] + cy, -1)
+    lo = np.searchsorted(index["keys"], key, "left")
+    hi = np.searchsorted(index["keys"], key, "right")
+    count = np.where(inside, hi - lo, 0)
+    if not count.sum():
+        return best, dist
+
+    # every (point, candidate segment) pair, distances in one pass
+    point = np.repeat(np.arange(n), count)
+    pos = np.repeat(lo - (np.cumsum(count) - count), count) + np.arange(count.sum())
+    seg = index["segments"][pos]
+    dx, dy = bx[seg] - ax[seg], by[seg] - ay[seg]
+    t = np.clip(((px[point] - ax[seg]) * dx + (py[point] - ay[seg]) * dy) / np.maximum(dx * dx + dy * dy, 1e-9), 0, 1)
+    d = np.hypot(px[point] - (ax[seg] + t * dx), py[point] - (ay[seg] + t * dy))
+
+    order = np.lexsort((seg, d, point))
+    first = order[np.r_[True, point[order][1:] != point[order][:-1]]]
+    hit = d[first] <= max_dist_m
+    best[point[first[hit]]] = seg[first[hit]]
+    dist[point[first[hit]]] = d[first[hit]]
+    return best, dist
+
+
+def route_join(route, feeds=SPEEDS, violations=VIOLATIONS, cell_m=CELL_M, max_dist_m=MAX_DIST_M):
+    # segment x hour rows of one route: speed, trips, violations, blocked minutes
+    speeds = load_speeds(route, feeds)
+    if speeds.empty:
+        return None, 0, 0
+    keys = ["direction", "timepoint_stop_id", "next_timepoint_stop_id"]
+    segments = speeds.drop_duplicates(keys, ignore_index=True)[keys + ["a_lat", "a_lon", "b_lat", "b_lon"]]
+    segments = segments.dropna(subset=["a_lat", "a_lon", "b_lat", "b_lon"]).reset_index(drop=True)
+
+    v = load_violations(route, violations)
+    matched = 0
+    counts = None
+    if len(v) and len(segments):
+        lat0 = segments["a_lat"].mean()
+        ax, ay = project(segments["a_lat"].to_numpy(), segments["a_lon"].to_numpy(), lat0)
+        bx, by = project(segments["b_lat"].to_numpy(), segments["b_lon"].to_numpy(), lat0)
+        index = segment_index(ax, ay, bx, by, cell_m)
+        px, py = project(v["lat"].to_numpy(), v["lon"].to_numpy(), lat0)
+        seg, _ = nearest_segment(px, py, index, ax, ay, bx, by, max_dist_m)
+
+        hit = seg >= 0
+        matched = int(hit.sum())
+        blocked = (v["last"] - v["first"]).dt.total_seconds().clip(lower=0).fillna(0) / 60
+        counts = (
+            segments.loc[seg[hit], keys].reset_index(drop=True)
+            .assign(hour=v.loc[hit, "first"].dt.floor("h").to_numpy(), violations=1,
+                    blocked_min=blocked[hit].to_numpy())
+            .groupby(keys + ["hour"], as_index=False)[["violations", "blocked_min"]].sum()
+        )
+
+    hours = (
+        speeds.assign(weighted=speeds["speed"] * speeds["trips"])
+        .groupby(keys + ["timepoint_stop_name", "next_timepoint_stop_name", "hour"], as_index=False, dropna=False)
+        [["weighted", "trips"]].sum()
+    )
+    hours["speed"] = hours["weighted"] / hours["trips"].where(hours["trips"] > 0)
+    hours = hours.drop(columns="weighted")
+    if counts is None:
+        hours["violations"], hours["blocked_min"] = 0, 0.0
+    else:
+        hours = hours.merge(counts, on=keys + ["hour"], how="left")
+        hours[["violations", "blocked_min"]] = hours[["violations", "blocked_min"]].fillna(0)
+    hours.insert(0, "route_id", route)
+    return hours, len(v), matched
+
+
+def _route_chunk(routes, feeds, violations, cell_m, max_dist_m):
+    parts, seen, matched = [], 0, 0
+    for route in routes:
+        hours, n, m = route_join(route, feeds, violations, cell_m, max_dist_m)
+        seen, matched = seen + n, matched + m
+        if hours is not None:
+            parts.append(hours)
+    return (pd.concat(parts, ignore_index=True) if parts else None), seen, matched
+
+
+def load_vs_speed(hours):
+    # per segment: hours observed and with violations, violations, blocked
+    # minutes, trip-weighted speed in clear vs violation hours, and the
+    # trip-weighted least-squares slope of speed on violations per hour
+    w = hours["trips"].where(hours["speed"].notna(), 0)
+    x, y = hours["violations"], hours["speed"].fillna(0)
+    blocked = hours["violations"] > 0
+    sums = hours[SEGMENT + ["timepoint_stop_name", "next_timepoint_stop_name", "violations", "blocked_min"]].assign(
+        hours=1, violation_hours=blocked.astype(int),
+        w=w, wx=w * x, wy=w * y, wxx=w * x * x, wxy=w * x * y,
+        w_clear=w * ~blocked, wy_clear=w * y * ~blocked, w_blocked=w * blocked, wy_blocked=w * y * blocked,
+    ).groupby(SEGMENT + ["timepoint_stop_name", "next_timepoint_stop_name"], observed=True, dropna=False).sum()
+
+    out = sums[["hours", "violation_hours", "violations", "blocked_min"]].copy()
+    out["speed"] = sums["wy"] / sums["w"].where(sums["w"] > 0)
+    out["speed_clear"] = sums["wy_clear"] / sums["w_clear"].where(sums["w_clear"] > 0)
+    out["speed_with_violations"] = sums["wy_blocked"] / sums["w_blocked"].where(sums["w_blocked"] > 0)
+    out["speed_delta"] = out["speed_with_violations"] - out["speed_clear"]
+    var = sums["wxx"] - sums["wx"] ** 2 / sums["w"].where(sums["w"] > 0)
+    cov = sums["wxy"] - sums["wx"] * sums["wy"] / sums["w"].where(sums["w"] > 0)
+    out["speed_per_violation"] = cov / var.where(var > 1e-9)
+    return out.reset_index().sort_values("violations", ascending=False, ignore_index=True)
+
+
+@metrics.instrument()
+def build(feeds=SPEEDS, violations=VIOLATIONS, routes=None, max_workers=None,
+          cell_m=CELL_M, max_dist_m=MAX_DIST_M, out_dir=OUT_DIR):
+    # segment_hours.parquet (segment x hour) and load_vs_speed.parquet
+    # (per segment) for every route with speed data
+    if routes is None:
+        routes = sorted(set().union(*(storage.routes(name) for name in feeds)))
+    metrics.record(rows_in=sum(storage.count_rows(name, routes=routes) for name in [*feeds, violations]))
+    workers = max_workers or os.cpu_count()
+    chunks = [routes[i::workers * 4] for i in range(min(len(routes), workers * 4))]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_route_chunk, c, feeds, violations, cell_m, max_dist_m) for c in chunks]
+        results = [f.result() for f in futures]
+    hours = pd.concat([h for h, _, _ in results if h is not None], ignore_index=True)
+    for col in ["route_id", "direction", "timepoint_stop_name", "next_timepoint_stop_name"]:
+        hours[col] = hours[col].astype("category")
+    seen = sum(n for _, n, _ in results)
+    matched = sum(m for _, _, m in results)
+
+    table = load_vs_speed(hours)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    hours.to_parquet(out_dir / "segment_hours.parquet", index=False)
+    table.to_parquet(out_dir / "load_vs_speed.parquet", index=False)
+    metrics.record(rows_out=len(hours))
+    print(f"[DONE] {matched:,} of {seen:,} violations on routes with speeds matched to a segment "
+          f"within {max_dist_m} m; {len(table):,} segments -> {out_dir}")
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Join violations onto speed segments and hours")
+    parser.add_argument("--feeds", nargs="+", default=SPEEDS)
+    parser.add_argument("--routes", nargs="+")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--max-dist", type=float, default=MAX_DIST_M, help="metres from a segment")
+    args = parser.parse_args()
+    table = build(args.feeds, routes=args.routes, max_workers=args.workers, max_dist_m=args.max_dist)
+    print(table.head(20).to_string(index=False))
@@ -0,0 +1,229 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import argparse
+import json
+import os
+import phases
+import storage
+
+# Materialized speed summary: one row per
+# route x corridor x hour x day type x phase x sketch bin, holding weighted
+# sums and counts. The bins form a log-spaced quantile sketch (relative
+# error ACCURACY, as in DDSketch), so everything in the cube is a plain sum:
+# new speed rows are folded in by adding their own cube, and any query (route
+# wide, per corridor, rush hours, ...) is a group-by sum plus one cumsum for
+# the quantiles, without touching raw rows.
+
+CUBE_DIR = Path("data/cube/speeds")
+
+KEYS = ["route", "corridor", "hour", "day_type", "phase"]
+
+# quantile sketch: values within ACCURACY (relative) of the true quantile
+ACCURACY = 0.01
+GAMMA = (1 + ACCURACY) / (1 - ACCURACY)
+# speeds at or below this share the lowest bin
+MIN_SPEED = 0.1
+# notebooks' crawl threshold (mph)
+CRAWL_MPH = 5
+# columns identifying a speed row (data_raw / labeled schema)
+ROW_KEY = storage.FEEDS["speeds_raw"]["key"]
+
+
+def sketch_bin(x):
+    return np.ceil(np.log(np.maximum(x, MIN_SPEED)) / np.log(GAMMA)).astype(np.int16)
+
+
+def bin_value(b):
+    # midpoint of bin b in the sketch's relative-error sense
+    return 2 * GAMMA ** b.astype(float) / (GAMMA + 1)
+
+
+def cube_rows(df, ace_start=phases.ACE_ANNOUNCE, cbd_start=phases.CBD_START):
+    # cube contribution of speed rows in the data_raw / labeled-notebook
+    # schema (Title Case columns)
+    times = pd.to_datetime(df["Timestamp"], errors="coerce")
+    speed = df["Average Road Speed"].to_numpy(dtype=float)
+    weight = df["Bus Trip Count"].to_numpy(dtype=float)
+    hour = df["Hour of Day"] if "Hour of Day" in df else times.dt.hour
+
+    rows = pd.DataFrame({
+        "route": df["Route ID"].astype("string"),
+        "corridor": df["Timepoint Stop Name"].astype("string") + " → " + df["Next Timepoint Stop Name"].astype("string"),
+        "hour": pd.Series(hour).astype("Int8").to_numpy(),
+        "day_type": np.where(times.dt.dayofweek < 5, "weekday", "weekend"),
+        "phase": phases.phase_label(times, ace_start, cbd_start=cbd_start).astype(object),
+        "bin": sketch_bin(speed),
+        "rows": 1,
+        "weight": weight,
+        "weighted_speed": weight * speed,
+        "crawl_weight": weight * (speed < CRAWL_MPH),
+    })
+    ok = ~np.isnan(speed) & ~np.isnan(weight) & times.notna().to_numpy()
+    return merge(rows[ok])
+
+
+def merge(*cubes):
+    # cubes are sums, so merging is concat + group-by sum
+    cube = pd.concat([c for c in cubes if c is not None], ignore_index=True)
+    return (
+        cube.groupby(KEYS + ["bin"], sort=False, observed=True, dropna=False)[["rows", "weight", "weighted_speed", "crawl_weight"]]
+        .sum()
+        .reset_index()
+    )
+
+
+def load_cube(cube_dir=CUBE_DIR):
+    path = Path(cube_dir) / "cube.parquet"
+    if not path.exists():
+        return None, None
+    with open(Path(cube_dir) / "state.json") as f:
+        state = json.load(f)
+    return pd.read_parquet(path), state
+
+
+def save_cube(cube, state, cube_dir=CUBE_DIR):
+    # write then rename, cube first, so state never points past the cube
+    cube_dir = Path(cube_dir)
+    cube_dir.mkdir(parents=True, exist_ok=True)
+    tmp = cube_dir / "cube.parquet.tmp"
+    cube.to_parquet(tmp, index=False)
+    os.replace(tmp, cube_dir / "cube.parquet")
+    tmp = cube_dir / "state.json.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, cube_dir / "state.json")
+
+
+def route_marks(cube, state):
+    # route -> {"high_water", "boundary_keys"}; a cube saved with one mark
+    # for all routes gets it on every route it holds
+    if state is None:
+        return {}
+    if "routes" not in state:
+        return {r: {"high_water": state["high_water"], "boundary_keys": []}
+                for r in cube["route"].dropna().unique()} if state["high_water"] else {}
+    return state["routes"]
+
+
+def unseen(df, marks):
+    # rows not folded in yet: after their route's mark, or on it with a key
+    # not stored there (rows can share the mark's hourly timestamp)
+    times = pd.to_datetime(df["Timestamp"], errors="coerce")
+    hw = pd.to_datetime(df["Route ID"].astype(str).map({r: m["high_water"] for r, m in marks.items()}))
+    keep = (hw.isna() | (times > hw)).to_numpy()
+    on = (times == hw).to_numpy()
+    if on.any():
+        seen = set().union(*(m["boundary_keys"] for m in marks.values()))
+        keep[on] = ~storage.row_keys(df[on], ROW_KEY).isin(seen).to_numpy()
+    return df[keep]
+
+
+def advance(marks, df):
+    # move each route's mark to its latest row; rows on the mark keep their
+    # keys so the next refresh, which starts at the mark (>=), skips them
+    marks = dict(marks)
+    times = pd.to_datetime(df["Timestamp"], errors="coerce")
+    route = df["Route ID"].astype(str)
+    for r, t in times.groupby(route.to_numpy()).max().dropna().items():
+        mark = marks.get(r)
+        hw = pd.Timestamp(mark["high_water"]) if mark else None
+        if hw is not None and hw > t:
+            continue
+        keys = set(storage.row_keys(df[((route == r) & (times == t)).to_numpy()], ROW_KEY))
+        if hw == t:
+            keys |= set(mark["boundary_keys"])
+        marks[r] = {"high_water": t.isoformat(), "boundary_keys": sorted(keys)}
+    return marks
+
+
+def update(df, cube_dir=CUBE_DIR):
+    # fold new speed rows into the stored cube. Rows already folded in (by
+    # their route's high-water mark and boundary keys) are dropped first,
+    # so re-reading from a mark never counts a row twice
+    cube, state = load_cube(cube_dir)
+    marks = route_marks(cube, state)
+    state = state or {"rows": 0}
+    df = unseen(df, marks)
+    delta = cube_rows(df)
+    cube = delta if cube is None else merge(cube, delta)
+
+    state["routes"] = advance(marks, df)
+    state["high_water"] = max((m["high_water"] for m in state["routes"].values()), default=None)
+    state["rows"] += int(delta["rows"].sum())
+    save_cube(cube, state, cube_dir)
+    print(f"[CUBE] +{int(delta['rows'].sum()):,} rows -> {len(cube):,} cells, high water {state['high_water']}")
+    return cube
+
+
+def refresh(name="speeds_raw", routes=None, cube_dir=CUBE_DIR):
+    # pull the store rows from each route's own high-water mark on, month by
+    # month; a refresh of some routes leaves the other routes' marks alone
+    cube, state = load_cube(cube_dir)
+    marks = route_marks(cube, state)
+    columns = list(dict.fromkeys(["Timestamp", "Route ID", "Timepoint Stop Name", "Next Timepoint Stop Name",
+                                  "Hour of Day", "Average Road Speed", "Bus Trip Count", *ROW_KEY]))
+
+    months = sorted({f.parent.name.split("=", 1)[1] for f in storage.store_path(name).rglob("*.parquet")})
+    wanted = routes if routes is not None else storage.routes(name)
+    if wanted and all(r in marks for r in wanted):
+        # every route has a mark: start at the month of the earliest one
+        since = min(pd.Timestamp(marks[r]["high_water"]) for r in wanted)
+        months = [m for m in months if m >= since.strftime("%Y-%m")]
+    cube = None
+    for month in months:
+        start = pd.Timestamp(month + "-01")
+        df = storage.load(name, columns=columns, routes=routes, start=start, end=start + pd.offsets.MonthBegin())
+        if len(df):
+            cube = update(df, cube_dir)
+    return cube if cube is not None else load_cube(cube_dir)[0]
+
+
+def select(cube, routes=None, corridors=None, hours=None, day_types=None, phases=None):
+    mask = np.ones(len(cube), dtype=bool)
+    for col, values in [("route", routes), ("corridor", corridors), ("hour", hours),
+                        ("day_type", day_types), ("phase", phases)]:
+        if values is not None:
+            mask &= cube[col].isin(list(values)).to_numpy()
+    return cube[mask]
+
+
+def query(cube, by, quantiles=(0.10, 0.50, 0.90), **filters):
+    # e.g. query(cube, ["route", "phase"], routes=["M101"], hours=range(6, 22),
+    #            day_types=["weekday"])
+    # -> by columns, mean, p10/p50/p90, crawl share, weight, rows
+    by = [by] if isinstance(by, str) else list(by)
+    sub = select(cube, **filters)
+    binned = sub.groupby(by + ["bin"], sort=True, observed=True)[["rows", "weight", "weighted_speed", "crawl_weight"]].sum()
+    groups = binned.groupby(level=by, sort=False, observed=True)
+    out = groups.sum()
+    out = pd.DataFrame({
+        "mean": out["weighted_speed"] / out["weight"],
+        "crawl_share": out["crawl_weight"] / out["weight"],
+        "weight": out["weight"],
+        "rows": out["rows"],
+    })
+
+    # bins are sorted inside each group: one cumsum, then a searchsorted per quantile
+    w = binned["weight"].to_numpy()
+    bins = binned.index.get_level_values("bin").to_numpy()
+    size = groups.size().to_numpy()
+    start = np.concatenate([[0], np.cumsum(size)[:-1]])
+    end = start + size - 1
+    cum = np.cumsum(w)
+    before = np.where(start > 0, cum[np.maximum(start - 1, 0)], 0.0)
+    total = out["weight"].to_numpy()
+    for q in quantiles:
+        k = np.clip(np.searchsorted(cum, before + q * total, side="left"), start, end)
+        out.insert(len(out.columns) - 2, f"p{round(q * 100):g}", bin_value(bins[k]))
+    return out.reset_index()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fold new speed rows into the summary cube")
+    parser.add_argument("--feed", default="speeds_raw", choices=[n for n, f in storage.FEEDS.items() if f["schema"] == "speeds_raw"])
+    parser.add_argument("--routes", nargs="*")
+    args = parser.parse_args()
+    cube = refresh(args.feed, args.routes)
+    if cube is not None:
+        print(query(cube, ["route", "phase"], day_types=["weekday"], hours=range(6, 22)).round(3).head(20))
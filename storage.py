@@ -0,0 +1,282 @@
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pathlib import Path
+import argparse
+import shutil
+import schemas
+
+# Shared storage layer: every raw feed is converted once into parquet
+# partitioned by route and month (hive layout, e.g.
+# data/store/speeds_2025/route_id=M101/month=2025-01/part-0.parquet).
+# load() reads only the partitions and columns a query needs.
+
+STORE_DIR = Path("data/store")
+
+# rows read from the source per conversion batch
+BATCH_ROWS = 1_000_000
+# row group size inside each route/month file
+ROW_GROUP_ROWS = 128_000
+# route/month directories one batch may write to (pyarrow stops at 1024 by
+# default; routes x months since 2019 is already past that)
+MAX_PARTITIONS = 100_000
+
+# route = column used for the route partition, time = timestamp column used
+# for the month partition (stored parsed, so time filters push down too),
+# schema = column types in schemas.py (narrow numerics on disk, categoricals
+# once loaded), key = columns that identify a row (sync dedupe, sampling,
+# incremental refreshes)
+FEEDS = {
+    # OData pulls written by access_data.py
+    "violations": {
+        "source": ["data/violations"],
+        "route": "bus_route_id",
+        "time": "first_occurrence",
+        "schema": "violations",
+        "key": ["violation_id"],
+    },
+    "speeds_2025": {
+        "source": ["data/speeds_2025"],
+        "route": "route_id",
+        "time": "timestamp",
+        "schema": "speeds",
+        "key": ["timestamp", "route_id", "direction", "timepoint_stop_id", "next_timepoint_stop_id"],
+    },
+    "speeds_2023-24": {
+        "source": ["data/speeds_2023-24"],
+        "route": "route_id",
+        "time": "timestamp",
+        "schema": "speeds",
+        "key": ["timestamp", "route_id", "direction", "timepoint_stop_id", "next_timepoint_stop_id"],
+    },
+    # CSV exports from data.ny.gov used by scripts/
+    "speeds_raw": {
+        "source": [
+            "data_raw/MTA_Bus_Route_Segment_Speeds__2023_-_2024_20250921.csv",
+            "data_raw/MTA_Bus_Route_Segment_Speeds__Beginning_2025_20250919.csv",
+        ],
+        "route": "Route ID",
+        "time": "Timestamp",
+        "schema": "speeds_raw",
+        "key": ["Timestamp", "Route ID", "Direction", "Timepoint Stop ID", "Next Timepoint Stop ID"],
+    },
+    "violations_raw": {
+        "source": ["data_raw/MTA_Bus_Automated_Camera_Enforcement_Violations__Beginning_October_2019_20250919.csv"],
+        "route": "Bus Route ID",
+        "time": "First Occurrence",
+        "schema": "violations_raw",
+        "key": ["Violation ID"],
+    },
+}
+
+
+def row_keys(df, keys):
+    # "|"-joined key columns per row (as access_data.row_key), for deduping
+    # rows on a high-water mark; timestamps as int64 ns, since astype(str)
+    # drops the time of day when every value in a slice is at midnight
+    def part(col):
+        if pd.api.types.is_datetime64_any_dtype(col):
+            col = col.astype("int64")
+        return col.astype(str)
+
+    out = part(df[keys[0]])
+    for k in keys[1:]:
+        out = out + "|" + part(df[k])
+    return out
+
+
+def iter_source(paths, batch_rows=BATCH_ROWS):
+    # yields pandas batches from CSV files or parquet files/directories
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            files = sorted(path.glob("*.parquet"))
+        else:
+            files = [path]
+        for f in files:
+            if f.suffix == ".parquet":
+                for batch in pq.ParquetFile(f).iter_batches(batch_size=batch_rows):
+                    yield batch.to_pandas()
+            else:
+                for chunk in pd.read_csv(f, chunksize=batch_rows, low_memory=False):
+                    yield chunk
+
+
+def partitioning(feed):
+    return ds.partitioning(
+        pa.schema([(feed["route"], pa.string()), ("month", pa.string())]),
+        flavor="hive",
+    )
+
+
+def store_path(name, store_dir=STORE_DIR):
+    return Path(store_dir) / name
+
+
+def compact(leaf_dir, time_col):
+    # merge the per-batch chunk files of one route/month into a single
+    # time-sorted file
+    files = sorted(leaf_dir.glob("chunk*.parquet"))
+    tables = [pq.ParquetFile(f).read() for f in files]
+    table = pa.concat_tables(tables, promote_options="permissive")
+    table = table.sort_by(time_col)
+    pq.write_table(table, leaf_dir / "part-0.parquet", row_group_size=ROW_GROUP_ROWS)
+    for f in files:
+        f.unlink()
+    return table.schema
+
+
+def build_store(name, store_dir=STORE_DIR, batch_rows=BATCH_ROWS, source=None):
+    feed = FEEDS[name]
+    source = source or feed["source"]
+    missing = [p for p in source if not Path(p).exists()]
+    if missing:
+        raise FileNotFoundError(f"[STOP] Source for {name} not found: {missing}")
+
+    out = store_path(name, store_dir)
+    staging = out.with_name(out.name + ".tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+
+    rows = 0
+    for i, chunk in enumerate(iter_source(source, batch_rows)):
+        chunk = schemas.apply(chunk, feed["schema"], categories=False)
+        times = chunk[feed["time"]]
+        chunk["month"] = times.dt.strftime("%Y-%m")
+        chunk[feed["route"]] = chunk[feed["route"]].astype("string")
+        ds.write_dataset(
+            pa.Table.from_pandas(chunk, preserve_index=False),
+            staging,
+            format="parquet",
+            partitioning=partitioning(feed),
+            basename_template=f"chunk{i:05d}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            max_partitions=MAX_PARTITIONS,
+        )
+        rows += len(chunk)
+        print(f"[{name}] converted {rows:,} rows")
+
+    # one file per route/month, and one schema every file can be read as
+    leaf_schemas = []
+    for leaf in sorted({f.parent for f in staging.rglob("chunk*.parquet")}):
+        leaf_schemas.append(compact(leaf, feed["time"]))
+    schema = pa.unify_schemas(leaf_schemas, promote_options="permissive")
+    pq.write_metadata(schema, staging / "_common_metadata")
+
+    shutil.rmtree(out, ignore_errors=True)
+    staging.rename(out)
+    print(f"[DONE] Stored {rows:,} rows of {name} -> {out}")
+    return out
+
+
+def dataset(name, store_dir=STORE_DIR):
+    feed = FEEDS[name]
+    path = store_path(name, store_dir)
+    if not path.exists():
+        build_store(name, store_dir)
+    part = partitioning(feed)
+    schema = pa.unify_schemas([pq.read_schema(path / "_common_metadata"), part.schema])
+    return ds.dataset(path, format="parquet", partitioning=part, schema=schema)
+
+
+def load(name, columns=None, routes=None, start=None, end=None, filter=None,
+         engine="pandas", store_dir=STORE_DIR):
+    # e.g. load("speeds_2025", columns=["timestamp", "route_id", ...],
+    #           routes=["M101"], start="2025-01-01", end="2025-04-01")
+    # routes and the month range prune whole directories; start/end (end is
+    # exclusive) and any extra pyarrow filter expression are pushed down to
+    # the row groups
+    feed = FEEDS[name]
+    expr = None
+
+    def both(a, b):
+        return b if a is None else a & b
+
+    if routes is not None:
+        expr = both(expr, pc.field(feed["route"]).isin(list(routes)))
+    if start is not None:
+        start = pd.Timestamp(start)
+        expr = both(expr, pc.field("month") >= start.strftime("%Y-%m"))
+        expr = both(expr, pc.field(feed["time"]) >= pa.scalar(start.to_datetime64()))
+    if end is not None:
+        end = pd.Timestamp(end)
+        expr = both(expr, pc.field("month") <= end.strftime("%Y-%m"))
+        expr = both(expr, pc.field(feed["time"]) < pa.scalar(end.to_datetime64()))
+    if filter is not None:
+        expr = both(expr, filter)
+
+    table = dataset(name, store_dir).to_table(columns=columns, filter=expr)
+    if engine == "arrow":
+        return table
+    if engine == "polars":
+        return pl.from_arrow(table)
+    return schemas.to_pandas(table, feed["schema"])
+
+
+def scan(name, routes=None, start=None, end=None, store_dir=STORE_DIR):
+    # lazy polars counterpart of load() for streaming pipelines: partitions
+    # are pruned up front, everything else is left to the polars optimizer
+    # and streaming engine
+    feed = FEEDS[name]
+    path = store_path(name, store_dir)
+    d = dataset(name, store_dir)
+
+    expr = None
+    if routes is not None:
+        expr = pc.field(feed["route"]).isin(list(routes))
+    if start is not None:
+        month = pc.field("month") >= pd.Timestamp(start).strftime("%Y-%m")
+        expr = month if expr is None else expr & month
+    if end is not None:
+        month = pc.field("month") <= pd.Timestamp(end).strftime("%Y-%m")
+        expr = month if expr is None else expr & month
+    files = [f.path for f in d.get_fragments(filter=expr)]
+
+    file_schema = pl.from_arrow(pq.read_schema(path / "_common_metadata").empty_table()).schema
+    hive_schema = {feed["route"]: pl.String, "month": pl.String}
+    if not files:
+        return pl.LazyFrame(schema={**file_schema, **hive_schema})
+
+    lf = pl.scan_parquet(
+        files,
+        hive_partitioning=True,
+        hive_schema=hive_schema,
+        try_parse_hive_dates=False,
+        schema=file_schema,
+        missing_columns="insert",
+        cast_options=pl.ScanCastOptions(integer_cast="upcast", float_cast="upcast"),
+    )
+    if start is not None:
+        lf = lf.filter(pl.col(feed["time"]) >= pd.Timestamp(start))
+    if end is not None:
+        lf = lf.filter(pl.col(feed["time"]) < pd.Timestamp(end))
+    return lf
+
+
+def routes(name, store_dir=STORE_DIR):
+    # distinct routes in the store, read from the partition directories
+    feed = FEEDS[name]
+    found = set()
+    for fragment in dataset(name, store_dir).get_fragments():
+        keys = ds.get_partition_keys(fragment.partition_expression)
+        if keys.get(feed["route"]) is not None:
+            found.add(keys[feed["route"]])
+    return sorted(found)
+
+
+def count_rows(name, routes=None, store_dir=STORE_DIR):
+    # row count from parquet footers only, no data pages are read
+    feed = FEEDS[name]
+    expr = None if routes is None else pc.field(feed["route"]).isin(list(routes))
+    return dataset(name, store_dir).count_rows(filter=expr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert raw feeds into the route/month parquet store")
+    parser.add_argument("names", nargs="*", default=["violations", "speeds_2025", "speeds_2023-24"],
+                        choices=list(FEEDS))
+    args = parser.parse_args()
+    for name in args.names:
+        build_store(name)
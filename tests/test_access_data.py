@@ -0,0 +1,147 @@
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import pyarrow.dataset as ds
+import pytest
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import access_data
+
+PAGE_ROWS = 3
+
+
+class ODataStandIn(BaseHTTPRequestHandler):
+    # pages self.server.rows PAGE_ROWS at a time via $skip, like the
+    # data.ny.gov OData endpoint does with @odata.nextLink; understands the
+    # "<col> ge <value>" $filter and $orderby that sync_dataset sends
+    def do_GET(self):
+        server = self.server
+        query = {k: v[0] for k, v in parse_qs(urlsplit(self.path).query).items()}
+        server.requests.append(dict(query))
+        skip = int(query.pop("$skip", "0"))
+        if server.fail_at_skip is not None and skip >= server.fail_at_skip:
+            self.send_error(404)
+            return
+        rows = server.rows
+        if "$filter" in query:
+            col, op, value = query["$filter"].split(" ")
+            assert op == "ge"
+            rows = [r for r in rows if r[col] >= value]
+        if "$orderby" in query:
+            rows = sorted(rows, key=lambda r: r[query["$orderby"]])
+        body = {"value": rows[skip:skip + PAGE_ROWS]}
+        if skip + PAGE_ROWS < len(rows):
+            more = urlencode({**query, "$skip": skip + PAGE_ROWS})
+            body["@odata.nextLink"] = f"http://127.0.0.1:{server.server_port}/feed?{more}"
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def _row(i, hour):
+    return {"violation_id": i, "first_occurrence": f"2025-01-01T{hour:02d}:00:00.000", "bus_route_id": "M15+"}
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ODataStandIn)
+    # the full pull comes back in id order, which is not time order
+    httpd.rows = [_row(i, 8 + i * 7 % 20 // 4) for i in range(20)]
+    httpd.requests = []
+    httpd.fail_at_skip = None
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _ids(path):
+    return sorted(ds.dataset(path, format="parquet").to_table(columns=["violation_id"]).column(0).to_pylist())
+
+
+def test_fetch_by_chunk_writes_every_row_once(server, tmp_path):
+    url = f"http://127.0.0.1:{server.server_port}/feed"
+    rows = access_data.fetch_by_chunk("violations", url, batch_rows=4, session=requests.Session(),
+                                      data_dir=tmp_path, checkpoint_dir=tmp_path / ".checkpoints")
+    assert rows == 20
+    assert _ids(tmp_path / "violations") == list(range(20))
+    state = access_data.load_checkpoint("violations", tmp_path / ".checkpoints")
+    assert state["done"] and state["rows"] == 20 and state["next_link"] is None
+
+
+def test_fetch_by_chunk_resumes_after_an_interrupted_run(server, tmp_path):
+    url = f"http://127.0.0.1:{server.server_port}/feed"
+    kwargs = dict(batch_rows=4, session=requests.Session(), data_dir=tmp_path, checkpoint_dir=tmp_path / ".checkpoints")
+
+    # the feed dies at row 12: the parts written before that are kept and
+    # the checkpoint points at the first page not yet on disk
+    server.fail_at_skip = 12
+    with pytest.raises(requests.HTTPError):
+        access_data.fetch_by_chunk("violations", url, **kwargs)
+    state = access_data.load_checkpoint("violations", tmp_path / ".checkpoints")
+    assert not state["done"] and state["rows"] == 12
+    assert _ids(tmp_path / "violations") == list(range(state["rows"]))
+    assert state["next_link"].endswith(f"skip={state['rows']}")
+
+    server.fail_at_skip = None
+    server.requests.clear()
+    assert access_data.fetch_by_chunk("violations", url, **kwargs) == 20
+    assert _ids(tmp_path / "violations") == list(range(20))
+    # pages already on disk are not fetched again
+    assert min(int(q.get("$skip", "0")) for q in server.requests) == state["rows"]
+
+    # a finished pull is not fetched again at all
+    server.requests.clear()
+    assert access_data.fetch_by_chunk("violations", url, **kwargs) == 20
+    assert server.requests == []
+
+
+def test_sync_finishes_an_interrupted_full_pull_before_bootstrapping(server, tmp_path):
+    url = f"http://127.0.0.1:{server.server_port}/feed"
+    kwargs = dict(batch_rows=4, session=requests.Session(), data_dir=tmp_path, checkpoint_dir=tmp_path / ".checkpoints")
+    server.fail_at_skip = 12
+    with pytest.raises(requests.HTTPError):
+        access_data.fetch_by_chunk("violations", url, **kwargs)
+
+    # the 12 rows on disk already hold the latest timestamp; a high-water
+    # mark taken from them would never fetch the older rows still missing
+    server.fail_at_skip = None
+    server.requests.clear()
+    assert access_data.sync_dataset("violations", url, **kwargs) == 0
+    assert all("$filter" not in q for q in server.requests)
+    assert _ids(tmp_path / "violations") == list(range(20))
+    state = access_data.load_checkpoint("violations.sync", tmp_path / ".checkpoints")
+    assert state["high_water"] == "2025-01-01T12:00:00.000"
+    assert state["boundary_keys"] == sorted(str(i) for i in range(20) if 8 + i * 7 % 20 // 4 == 12)
+
+
+def test_sync_fetches_from_the_high_water_mark_and_skips_boundary_rows(server, tmp_path):
+    url = f"http://127.0.0.1:{server.server_port}/feed"
+    kwargs = dict(batch_rows=4, session=requests.Session(), data_dir=tmp_path, checkpoint_dir=tmp_path / ".checkpoints")
+    access_data.fetch_by_chunk("violations", url, **kwargs)
+
+    # two new rows share the stored high-water timestamp, one is later
+    server.rows += [_row(20, 12), _row(21, 12), _row(22, 13)]
+    server.requests.clear()
+    assert access_data.sync_dataset("violations", url, **kwargs) == 3
+    assert server.requests[0]["$filter"] == "first_occurrence ge 2025-01-01T12:00:00.000"
+    assert server.requests[0]["$orderby"] == "first_occurrence"
+    assert _ids(tmp_path / "violations") == list(range(23))
+    state = access_data.load_checkpoint("violations.sync", tmp_path / ".checkpoints")
+    assert state == {"column": "first_occurrence", "high_water": "2025-01-01T13:00:00.000", "boundary_keys": ["22"]}
+
+    # nothing new: the boundary row is fetched again but not stored twice
+    assert access_data.sync_dataset("violations", url, **kwargs) == 0
+    assert _ids(tmp_path / "violations") == list(range(23))
@@ -0,0 +1,65 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import trips
+
+
+def _chain(rows, **kwargs):
+    # rows: (start "HH:MM", travel minutes, from stop, to stop), one direction
+    starts = pd.to_datetime(["2025-03-03 " + r[0] for r in rows]).to_numpy().astype(np.int64)
+    ends = starts + np.array([r[1] for r in rows], dtype=np.int64) * 60 * 10**9
+    direction = np.array(["0"] * len(rows), dtype=object)
+    from_stop = np.array([r[2] for r in rows])
+    to_stop = np.array([r[3] for r in rows])
+    return trips.chain(starts, ends, direction, from_stop, to_stop, **kwargs)
+
+
+def test_segments_link_into_one_run():
+    nxt, run = _chain([("08:00", 10, 1, 2), ("08:10", 10, 2, 3), ("08:25", 10, 3, 4)])
+    assert nxt.tolist() == [1, 2, -1]
+    assert len(set(run)) == 1
+
+
+def test_rejected_layover_does_not_use_up_the_departure():
+    # row 0 reaches stop 2 at 09:00; the only departure from stop 2 is at
+    # 10:05, past its layover, so row 0 ends its run. Row 1 reaches stop 2
+    # at 10:00 and must still get that departure.
+    nxt, run = _chain([("08:00", 60, 1, 2), ("09:00", 60, 5, 2), ("10:05", 30, 2, 3)],
+                      resolution_min=60, max_layover_min=15)
+    assert nxt.tolist() == [-1, 2, -1]
+    assert run[1] == run[2] != run[0]
+
+
+def test_layover_past_the_limit_splits_the_run():
+    nxt, run = _chain([("08:00", 10, 1, 2), ("08:40", 10, 2, 3)], resolution_min=0, max_layover_min=15)
+    assert nxt.tolist() == [-1, -1]
+    assert run[0] != run[1]
+
+
+
+def test_loop_route_in_one_hour_bin_does_not_cycle():
+    # 1 -> 2 and 2 -> 1 stamped in the same hour bin would follow each
+    # other; the loop is cut so one of them heads the run
+    nxt, run = _chain([("08:00", 10, 1, 2), ("08:00", 10, 2, 1)])
+    assert (nxt >= 0).sum() == 1
+    linked = nxt >= 0
+    assert (run[linked] == run[nxt[linked]]).all()
+    assert len(set(run)) == 1
+
+
+def test_follower_never_starts_before_its_predecessor():
+    # row 1 reaches stop 2 within the resolution window of row 0's start
+    # but row 0 departs an hour before row 1 does
+    nxt, run = _chain([("07:30", 10, 2, 3), ("08:00", 10, 1, 2)])
+    assert nxt.tolist() == [-1, -1]
+    assert run[0] != run[1]
+
+
+def test_loop_route_chains_forward():
+    nxt, run = _chain([("08:00", 10, 1, 2), ("08:15", 10, 2, 1), ("08:30", 10, 1, 2), ("08:45", 10, 2, 1)])
+    assert nxt.tolist() == [1, 2, 3, -1]
+    assert len(set(run)) == 1
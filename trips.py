@@ -0,0 +1,245 @@
+import polars as pl
+import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import argparse
+import os
+import fleet_estimation
+import metrics
+import storage
+
+# Trip chaining: links speeds segment rows into probable bus runs. A row
+# going A -> B that starts at t and ends at t + average_travel_time is
+# followed by the row on the same route and direction that starts at B
+# closest after it, within [end - RESOLUTION_MIN, end + MAX_LAYOVER_MIN]
+# and not before the row's own start
+# (timestamps are clock-hour bins, so a follower can carry an earlier
+# stamp than its predecessor's end). Departures are indexed per (direction,
+# stop) in time order; each arrival finds its window with one binary search
+# and takes the first departure no earlier arrival has taken (first in,
+# first out), so a route is O(n log n) and routes run in parallel. Runs
+# give real headways (gaps between run starts at the origin stop) and
+# fleet counts (peak concurrent runs), instead of the fixed 5-minute
+# headway in convex_optimization and the segment-level lower bound in
+# fleet_estimation.
+
+FEEDS = ["speeds_2025"]
+OUT_DIR = Path("data/trips")
+
+RESOLUTION_MIN = 60
+MAX_LAYOVER_MIN = 15
+# gaps between run starts longer than this are service breaks, not headways
+MAX_HEADWAY_MIN = 120
+
+def load_route(route, feeds=FEEDS):
+    frames = [
+        storage.scan(name, routes=[route]).select(
+            pl.col("timestamp").cast(pl.Datetime("ns")),
+            pl.col("direction").cast(pl.String),
+            pl.col("timepoint_stop_id").cast(pl.Int64),
+            pl.col("next_timepoint_stop_id").cast(pl.Int64),
+            pl.col("average_travel_time").cast(pl.Float64),
+        )
+        for name in feeds
+    ]
+    return pl.concat(frames).drop_nulls().collect()
+
+
+def chain(starts, ends, direction, from_stop, to_stop,
+          resolution_min=RESOLUTION_MIN, max_layover_min=MAX_LAYOVER_MIN):
+    # starts/ends in int64 ns; returns (next row or -1, run id) per row
+    n = len(starts)
+    nxt = np.full(n, -1, np.int64)
+    if n == 0:
+        return nxt, np.zeros(0, np.int64)
+
+    # dense (direction, stop) codes shared by departures and arrivals
+    codes, _ = pd.factorize(pd.MultiIndex.from_arrays([
+        np.concatenate([direction, direction]), np.concatenate([from_stop, to_stop]),
+    ]))
+    dep_code, arr_code = codes[:n].astype(np.int64), codes[n:].astype(np.int64)
+
+    # departure index: one sorted key per row, (code, seconds since t0);
+    # span covers the latest window end, so keys never spill into the next code
+    t0 = min(starts.min(), ends.min()) - resolution_min * 60 * 10**9
+    span = (max(starts.max(), ends.max()) + max_layover_min * 60 * 10**9 - t0) // 10**9 + 1
+    dep_order = np.lexsort((starts, dep_code))
+    dep_sorted = dep_code[dep_order] * span + (starts[dep_order] - t0) // 10**9
+
+    # each arrival's window [lo, hi) in the departure index; a follower is
+    # never stamped before its predecessor's own start
+    arr_order = np.lexsort((ends, arr_code))
+    group = arr_code[arr_order]
+    key = group * span + (ends[arr_order] - t0) // 10**9
+    earliest = np.maximum(ends[arr_order] - resolution_min * 60 * 10**9, starts[arr_order])
+    lo = np.searchsorted(dep_sorted, group * span + (earliest - t0) // 10**9)
+    hi = np.searchsorted(dep_sorted, key + max_layover_min * 60, side="right")
+
+    # arrivals with nothing in their window take nothing; a row that starts
+    # and ends at the same stop would be its own candidate, so it never
+    # arrives anywhere
+    has = (hi > lo) & (from_stop != to_stop)[arr_order]
+    arr, group, lo, hi = arr_order[has], group[has], lo[has], hi[has]
+
+    # FIFO per (direction, stop): arrivals in time order take distinct
+    # departures, the k-th one at least k places past the group's first
+    rank = pd.Series(group).groupby(group).cumcount().to_numpy()
+    taken = pd.Series(lo - rank).groupby(group).cummax().to_numpy() + rank
+
+    # an arrival whose window is used up by earlier ones still takes a slot
+    # above and pushes every later arrival of its group one place on;
+    # groups where that happens are replayed one arrival at a time
+    bad = taken >= hi
+    for g in np.unique(group[bad]):
+        first, last = np.searchsorted(group, [g, g + 1])
+        p = -1
+        for k in range(first, last):
+            q = max(p + 1, lo[k])
+            if q < hi[k]:
+                taken[k] = p = q
+            else:
+                taken[k] = hi[k]
+    ok = taken < hi
+    nxt[arr[ok]] = dep_order[taken[ok]]
+
+    # links between rows in different bins go forward in time, but rows in
+    # one bin can still close a loop (1 -> 2 and 2 -> 1 both stamped 08:00).
+    # Cycles are found by pointer doubling over the same-bin links only and
+    # each is cut at the link into its lowest row
+    same = np.flatnonzero(nxt >= 0)
+    same = same[starts[nxt[same]] == starts[same]]
+    if len(same):
+        hop = np.full(n, -1, np.int64)
+        hop[same] = nxt[same]
+        low = np.arange(n)
+        for _ in range(int(len(same)).bit_length() + 1):
+            live = np.flatnonzero(hop >= 0)
+            low[live] = np.minimum(low[live], low[hop[live]])
+            hop[live] = hop[hop[live]]
+        cyc = np.flatnonzero(hop >= 0)
+        nxt[cyc[nxt[cyc] == low[cyc]]] = -1
+
+    # run id = first row of the chain, by pointer jumping on predecessors
+    prev = np.full(n, -1, np.int64)
+    prev[nxt[nxt >= 0]] = np.flatnonzero(nxt >= 0)
+    root = np.where(prev >= 0, prev, np.arange(n))
+    for _ in range(64):
+        step = root[root]
+        if np.array_equal(step, root):
+            break
+        root = step
+    return nxt, pd.factorize(root)[0].astype(np.int64)
+
+
+def route_runs(route, feeds=FEEDS, resolution_min=RESOLUTION_MIN, max_layover_min=MAX_LAYOVER_MIN):
+    df = load_route(route, feeds)
+    if df.is_empty():
+        return None
+    starts = df["timestamp"].to_numpy().astype(np.int64)
+    ends = starts + (df["average_travel_time"].to_numpy() * 60e9).astype(np.int64)
+    direction = df["direction"].to_numpy()
+    from_stop = df["timepoint_stop_id"].to_numpy()
+    _, run = chain(starts, ends, direction, from_stop,
+                   df["next_timepoint_stop_id"].to_numpy(), resolution_min, max_layover_min)
+
+    # per run: first/last row by start time
+    order = np.lexsort((starts, run))
+    run_sorted = run[order]
+    head = np.flatnonzero(np.r_[True, run_sorted[1:] != run_sorted[:-1]])
+    tail = np.r_[head[1:] - 1, len(order) - 1]
+    first, last = order[head], order[tail]
+    return pd.DataFrame({
+        "route_id": route,
+        "direction": direction[first],
+        "start": pd.to_datetime(starts[first]),
+        "end": pd.to_datetime(np.maximum.reduceat(ends[order], head)),
+        "segments": np.diff(np.r_[head, len(order)]),
+        "first_stop": from_stop[first],
+        "last_stop": df["next_timepoint_stop_id"].to_numpy()[last],
+    })
+
+
+def _route_chunk(routes, feeds, resolution_min, max_layover_min):
+    parts = [route_runs(r, feeds, resolution_min, max_layover_min) for r in routes]
+    parts = [p for p in parts if p is not None]
+    return pd.concat(parts, ignore_index=True) if parts else None
+
+
+@metrics.instrument()
+def build_runs(feeds=FEEDS, routes=None, max_workers=None, resolution_min=RESOLUTION_MIN,
+               max_layover_min=MAX_LAYOVER_MIN, out_dir=OUT_DIR):
+    # every route's runs, routes split over worker processes; writes
+    # runs.parquet and the per-route summary routes.parquet
+    if routes is None:
+        routes = sorted(set().union(*(storage.routes(name) for name in feeds)))
+    metrics.record(rows_in=sum(storage.count_rows(name, routes=routes) for name in feeds))
+    workers = max_workers or os.cpu_count()
+    chunks = [routes[i::workers * 4] for i in range(min(len(routes), workers * 4))]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_route_chunk, c, feeds, resolution_min, max_layover_min) for c in chunks]
+        parts = [p for p in (f.result() for f in futures) if p is not None]
+    runs = pd.concat(parts, ignore_index=True).sort_values(["route_id", "start"], ignore_index=True)
+    runs["route_id"] = runs["route_id"].astype("category")
+    runs["direction"] = runs["direction"].astype("category")
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    runs.to_parquet(out_dir / "runs.parquet", index=False)
+    route_summary(runs).to_parquet(out_dir / "routes.parquet", index=False)
+    print(f"[DONE] {len(runs):,} runs on {runs['route_id'].nunique()} routes -> {out_dir}")
+    return runs
+
+
+def headways(runs, max_headway_min=MAX_HEADWAY_MIN):
+    # minutes between consecutive run starts at each route/direction's
+    # usual origin stop; longer gaps are dropped as service breaks
+    origin = runs.groupby(["route_id", "direction"], observed=True)["first_stop"].agg(lambda s: s.mode().iloc[0])
+    at_origin = runs.merge(origin.rename("origin").reset_index(), on=["route_id", "direction"])
+    at_origin = at_origin[at_origin["first_stop"] == at_origin["origin"]].sort_values(["route_id", "direction", "start"])
+    gap = at_origin.groupby(["route_id", "direction"], observed=True)["start"].diff().dt.total_seconds() / 60
+    out = at_origin[["route_id", "direction", "start"]].assign(headway_min=gap)
+    return out[(out["headway_min"] > 0) & (out["headway_min"] <= max_headway_min)].reset_index(drop=True)
+
+
+def route_fleet(runs):
+    # peak concurrent runs per route (fleet_estimation's sweep over runs
+    # instead of single segments)
+    rows = []
+    for route, g in runs.groupby("route_id", observed=True):
+        times, active = fleet_estimation.sweep(g["start"].to_numpy().astype(np.int64),
+                                               g["end"].to_numpy().astype(np.int64))
+        rows.append((route, int(active.max())))
+    return pd.DataFrame(rows, columns=["route_id", "fleet_size"])
+
+
+def route_summary(runs):
+    # per route: runs, median / p90 headway at the origin, peak fleet
+    h = headways(runs).groupby("route_id", observed=True)["headway_min"]
+    summary = pd.DataFrame({"runs": runs.groupby("route_id", observed=True).size(),
+                            "headway_min": h.median(), "headway_p90": h.quantile(0.9)})
+    summary.index.name = "route_id"
+    summary = summary.reset_index().merge(route_fleet(runs), on="route_id", how="left")
+    summary["route_id"] = summary["route_id"].astype(str)
+    return summary
+
+
+def load_summary(out_dir=OUT_DIR):
+    # routes.parquet indexed by route_id, or None before build_runs has run
+    path = Path(out_dir) / "routes.parquet"
+    if not path.exists():
+        return None
+    return pd.read_parquet(path).set_index("route_id")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chain speeds segments into bus runs; headways and fleet per route")
+    parser.add_argument("--feeds", nargs="+", default=FEEDS)
+    parser.add_argument("--routes", nargs="+")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--max-layover", type=float, default=MAX_LAYOVER_MIN, help="minutes")
+    args = parser.parse_args()
+    build_runs(args.feeds, args.routes, args.workers, max_layover_min=args.max_layover)
+    summary = load_summary()
+    print(summary.to_string())
+    print("Total fleet from chained runs: ", summary["fleet_size"].sum())
@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+import polars as pl
+from pathlib import Path
+import storage
+
+# Pre-aggregated violation counts on disk, one row per
+# grid cell x day x route x violation status. Any before/after hotspot
+# comparison (any cutoff, route subset or status filter) is then a slice and
+# a sum over this cube instead of a re-scan of the raw violations.
+
+CUBE_PATH = Path("data/cube/violations.parquet")
+
+# cells per degree: lat/lon rounded to 3 decimals, stored as integers
+GRID = 1000
+
+
+def build_cube(name="violations", path=CUBE_PATH):
+    feed = storage.FEEDS[name]
+    cube = (
+        storage.scan(name)
+        .select(
+            (pl.col("violation_latitude").cast(pl.Float64) * GRID).round().cast(pl.Int32).alias("lat_cell"),
+            (pl.col("violation_longitude").cast(pl.Float64) * GRID).round().cast(pl.Int32).alias("lon_cell"),
+            pl.col(feed["time"]).dt.date().alias("day"),
+            pl.col(feed["route"]).alias("route"),
+            pl.col("violation_status").cast(pl.String).str.to_uppercase().alias("status"),
+        )
+        .drop_nulls(["lat_cell", "lon_cell", "day"])
+        .group_by(["lat_cell", "lon_cell", "day", "route", "status"])
+        .agg(pl.len().cast(pl.Int32).alias("violations"))
+        .collect(engine="streaming")
+        .sort("day")
+    )
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    cube.write_parquet(path)
+    print(f"[DONE] Cube with {cube.height:,} cells x days -> {path}")
+    return path
+
+
+def load_cube(path=CUBE_PATH):
+    path = Path(path)
+    if not path.exists():
+        build_cube(path=path)
+    cube = pd.read_parquet(path)
+    cube["day"] = pd.to_datetime(cube["day"])
+    cube["route"] = cube["route"].astype("category")
+    cube["status"] = cube["status"].astype("category")
+    return cube.sort_values("day", kind="stable", ignore_index=True)
+
+
+def select(cube, routes=None, statuses=None, status_contains=None, start=None, end=None):
+    # route / status / date-range slice; filters on the categories, so it
+    # costs one pass over the codes rather than string comparisons per row
+    mask = np.ones(len(cube), dtype=bool)
+    if routes is not None:
+        mask &= cube["route"].isin(routes).to_numpy()
+    if statuses is not None:
+        mask &= cube["status"].isin([s.upper() for s in statuses]).to_numpy()
+    if status_contains is not None:
+        cats = cube["status"].cat.categories
+        wanted = cats[cats.str.contains(status_contains.upper(), regex=False)]
+        mask &= cube["status"].isin(wanted).to_numpy()
+    if start is not None:
+        mask &= (cube["day"] >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        mask &= (cube["day"] < pd.Timestamp(end)).to_numpy()
+    return cube[mask]
+
+
+def _cells(cube):
+    # both cell coordinates packed into one int64 key, then hashed once
+    lat = cube["lat_cell"].to_numpy(dtype=np.int64)
+    lon = cube["lon_cell"].to_numpy(dtype=np.int64)
+    codes, keys = pd.factorize((lat << 32) | (lon & 0xFFFFFFFF))
+    cells = np.column_stack([keys >> 32, (keys & 0xFFFFFFFF).astype(np.uint32).astype(np.int32)])
+    return cells, codes
+
+
+def _frame(cells, before, after):
+    out = pd.DataFrame({
+        "lat_grid": cells[:, 0] / GRID,
+        "lon_grid": cells[:, 1] / GRID,
+        "violations_before": before,
+        "violations_after": after,
+    })
+    out["diff"] = out["violations_after"] - out["violations_before"]
+    return out
+
+
+def hotspot_diff(cube, cutoff, **filters):
+    # per grid cell: violations before cutoff, at/after it, and the change
+    # (cutoffs resolve to whole days, the grain of the cube)
+    sub = select(cube, **filters)
+    cells, codes = _cells(sub)
+    counts = sub["violations"].to_numpy(dtype=np.int64)
+    after = (sub["day"] >= pd.Timestamp(cutoff)).to_numpy()
+    before_n = np.bincount(codes, weights=counts * ~after, minlength=len(cells))
+    after_n = np.bincount(codes, weights=counts * after, minlength=len(cells))
+    return _frame(cells, before_n, after_n)
+
+
+def hotspot_diffs(cube, cutoffs, top=10, **filters):
+    # the same comparison for many candidate cutoffs: the slice is sorted by
+    # day once, so each cutoff is a searchsorted plus one bincount
+    sub = select(cube, **filters)
+    cells, codes = _cells(sub)
+    counts = sub["violations"].to_numpy(dtype=np.float64)
+    days = sub["day"].to_numpy()
+    total = np.bincount(codes, weights=counts, minlength=len(cells))
+
+    out = []
+    for cutoff in cutoffs:
+        k = np.searchsorted(days, np.datetime64(pd.Timestamp(cutoff)), side="left")
+        before = np.bincount(codes[:k], weights=counts[:k], minlength=len(cells))
+        frame = _frame(cells, before, total - before)
+        frame.insert(0, "cutoff", pd.Timestamp(cutoff))
+        out.append(frame.sort_values("diff").head(top) if top else frame)
+    return pd.concat(out, ignore_index=True)
+
+
+if __name__ == "__main__":
+    build_cube()
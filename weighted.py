@@ -0,0 +1,57 @@
+import numpy as np
+
+# Weighted means and quantiles for every group of a frame in one pass, shared
+# by the speed notebooks. Rows are sorted once by (group, value); weights are
+# cumulated once, and each quantile of each group is a searchsorted into that
+# running sum, so there is no per-group Python loop.
+
+VALUE = "Average Road Speed"
+WEIGHT = "Bus Trip Count"
+QUANTILES = (0.10, 0.50, 0.90)
+
+
+def _column(df, x):
+    return df[x] if isinstance(x, str) else x
+
+
+def summarize(df, by, value=VALUE, weight=WEIGHT, quantiles=QUANTILES, means=None):
+    # one row per group of `by`: weighted mean, weighted quantiles (p10, p50,
+    # ...), weight sum and row count. means = {name: column or array} adds
+    # more weighted means (e.g. {"crawl": df[VALUE] < 5}). A quantile is the
+    # first value whose cumulative weight reaches q * total weight.
+    by = [by] if isinstance(by, str) else list(by)
+    x = _column(df, value).to_numpy(dtype=float)
+    w = _column(df, weight).to_numpy(dtype=float)
+    ok = ~np.isnan(x) & ~np.isnan(w)
+
+    grouped = df.groupby(by, sort=True, observed=True, dropna=True)
+    codes = grouped.ngroup().to_numpy()
+    ok &= codes >= 0
+    keys = grouped.size().index.to_frame(index=False)
+    n = len(keys)
+
+    codes, x, w = codes[ok], x[ok], w[ok]
+    order = np.lexsort((x, codes))
+    codes, x, w = codes[order], x[order], w[order]
+
+    rows = np.bincount(codes, minlength=n)
+    total = np.bincount(codes, weights=w, minlength=n)
+    start = np.concatenate([[0], np.cumsum(rows)[:-1]])
+    end = start + rows - 1
+    cum = np.cumsum(w)
+    before = np.where(start > 0, cum[np.maximum(start - 1, 0)], 0.0)
+
+    out = keys
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out["mean"] = np.bincount(codes, weights=w * x, minlength=n) / total
+        for name, col in (means or {}).items():
+            col = np.asarray(_column(df, col), dtype=float)[ok][order]
+            out[name] = np.bincount(codes, weights=w * col, minlength=n) / total
+    for q in quantiles:
+        k = np.searchsorted(cum, before + q * total, side="left")
+        k = np.clip(k, start, np.maximum(end, start))
+        out[f"p{round(q * 100):g}"] = np.where(rows > 0, x[np.minimum(k, len(x) - 1)] if len(x) else np.nan, np.nan)
+    out["weight"] = total
+    out["rows"] = rows
+    return out
+